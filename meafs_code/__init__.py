@@ -1,4 +1,11 @@
 __version__ = "6.2.4"
 __author__ = "Matheus J. Castro"
 
-from meafs_code import gui
+import importlib
+
+
+def __getattr__(name):
+    # The GUI (and QT) is only imported when used, so the fit engine can run without it
+    if name == "gui":
+        return importlib.import_module(".gui", __name__)
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
@@ -1,6 +1,6 @@
 # Form implementation generated from reading ui file 'fitsettings.ui'
 #
-# Created by: PyQt6 UI code generator 6.9.1
+# Created by: PyQt6 UI code generator 6.11.0
 #
 # WARNING: Any manual changes made to this file will be lost when pyuic6 is
 # run again.  Do not edit this file unless you know what you are doing.
@@ -12,7 +12,7 @@ from PyQt6 import QtCore, QtGui, QtWidgets
 class Ui_fitparbox(object):
     def setupUi(self, fitparbox):
         fitparbox.setObjectName("fitparbox")
-        fitparbox.resize(582, 535)
+        fitparbox.resize(800, 590)
         self.gridLayout_2 = QtWidgets.QGridLayout(fitparbox)
         self.gridLayout_2.setObjectName("gridLayout_2")
         self.wavecutvalue = QtWidgets.QDoubleSpinBox(parent=fitparbox)
@@ -215,6 +215,131 @@ class Ui_fitparbox(object):
         self.contfitmedwindvalue.setProperty("value", 3)
         self.contfitmedwindvalue.setObjectName("contfitmedwindvalue")
         self.gridLayout_2.addWidget(self.contfitmedwindvalue, 8, 4, 1, 1)
+        self.line_6 = QtWidgets.QFrame(parent=fitparbox)
+        self.line_6.setFrameShape(QtWidgets.QFrame.Shape.VLine)
+        self.line_6.setFrameShadow(QtWidgets.QFrame.Shadow.Sunken)
+        self.line_6.setObjectName("line_6")
+        self.gridLayout_2.addWidget(self.line_6, 0, 5, 19, 1)
+        self.performancelabel = QtWidgets.QLabel(parent=fitparbox)
+        self.performancelabel.setAlignment(QtCore.Qt.AlignmentFlag.AlignCenter)
+        self.performancelabel.setObjectName("performancelabel")
+        self.gridLayout_2.addWidget(self.performancelabel, 0, 6, 1, 2)
+        self.warmstartcheck = QtWidgets.QCheckBox(parent=fitparbox)
+        self.warmstartcheck.setObjectName("warmstartcheck")
+        self.gridLayout_2.addWidget(self.warmstartcheck, 1, 6, 1, 2)
+        self.fitworkerslabel = QtWidgets.QLabel(parent=fitparbox)
+        self.fitworkerslabel.setObjectName("fitworkerslabel")
+        self.gridLayout_2.addWidget(self.fitworkerslabel, 2, 6, 1, 1)
+        self.fitworkersvalue = QtWidgets.QSpinBox(parent=fitparbox)
+        self.fitworkersvalue.setMinimum(1)
+        self.fitworkersvalue.setMaximum(256)
+        self.fitworkersvalue.setObjectName("fitworkersvalue")
+        self.gridLayout_2.addWidget(self.fitworkersvalue, 2, 7, 1, 1)
+        self.synthcachecheck = QtWidgets.QCheckBox(parent=fitparbox)
+        self.synthcachecheck.setObjectName("synthcachecheck")
+        self.gridLayout_2.addWidget(self.synthcachecheck, 6, 6, 1, 2)
+        self.abundmethodlabel = QtWidgets.QLabel(parent=fitparbox)
+        self.abundmethodlabel.setObjectName("abundmethodlabel")
+        self.gridLayout_2.addWidget(self.abundmethodlabel, 11, 6, 1, 1)
+        self.abundmethod = QtWidgets.QComboBox(parent=fitparbox)
+        self.abundmethod.setObjectName("abundmethod")
+        self.abundmethod.addItem("")
+        self.abundmethod.addItem("")
+        self.abundmethod.addItem("")
+        self.gridLayout_2.addWidget(self.abundmethod, 11, 7, 1, 1)
+        self.abundvalidatelabel = QtWidgets.QLabel(parent=fitparbox)
+        self.abundvalidatelabel.setObjectName("abundvalidatelabel")
+        self.gridLayout_2.addWidget(self.abundvalidatelabel, 12, 6, 1, 1)
+        self.abundvalidatevalue = QtWidgets.QDoubleSpinBox(parent=fitparbox)
+        self.abundvalidatevalue.setDecimals(3)
+        self.abundvalidatevalue.setMaximum(1.0)
+        self.abundvalidatevalue.setSingleStep(0.01)
+        self.abundvalidatevalue.setObjectName("abundvalidatevalue")
+        self.gridLayout_2.addWidget(self.abundvalidatevalue, 12, 7, 1, 1)
+        self.mergewindowscheck = QtWidgets.QCheckBox(parent=fitparbox)
+        self.mergewindowscheck.setObjectName("mergewindowscheck")
+        self.gridLayout_2.addWidget(self.mergewindowscheck, 7, 6, 1, 2)
+        self.synthworkerslabel = QtWidgets.QLabel(parent=fitparbox)
+        self.synthworkerslabel.setObjectName("synthworkerslabel")
+        self.gridLayout_2.addWidget(self.synthworkerslabel, 5, 6, 1, 1)
+        self.synthworkersvalue = QtWidgets.QSpinBox(parent=fitparbox)
+        self.synthworkersvalue.setMinimum(1)
+        self.synthworkersvalue.setMaximum(256)
+        self.synthworkersvalue.setObjectName("synthworkersvalue")
+        self.gridLayout_2.addWidget(self.synthworkersvalue, 5, 7, 1, 1)
+        self.opacitycachecheck = QtWidgets.QCheckBox(parent=fitparbox)
+        self.opacitycachecheck.setObjectName("opacitycachecheck")
+        self.gridLayout_2.addWidget(self.opacitycachecheck, 8, 6, 1, 2)
+        self.trimlinelistscheck = QtWidgets.QCheckBox(parent=fitparbox)
+        self.trimlinelistscheck.setObjectName("trimlinelistscheck")
+        self.gridLayout_2.addWidget(self.trimlinelistscheck, 9, 6, 1, 2)
+        self.coarsesteplabel = QtWidgets.QLabel(parent=fitparbox)
+        self.coarsesteplabel.setObjectName("coarsesteplabel")
+        self.gridLayout_2.addWidget(self.coarsesteplabel, 10, 6, 1, 1)
+        self.coarsestepvalue = QtWidgets.QSpinBox(parent=fitparbox)
+        self.coarsestepvalue.setMinimum(1)
+        self.coarsestepvalue.setMaximum(20)
+        self.coarsestepvalue.setObjectName("coarsestepvalue")
+        self.gridLayout_2.addWidget(self.coarsestepvalue, 10, 7, 1, 1)
+        self.spectraworkerslabel = QtWidgets.QLabel(parent=fitparbox)
+        self.spectraworkerslabel.setObjectName("spectraworkerslabel")
+        self.gridLayout_2.addWidget(self.spectraworkerslabel, 4, 6, 1, 1)
+        self.spectraworkersvalue = QtWidgets.QSpinBox(parent=fitparbox)
+        self.spectraworkersvalue.setMinimum(1)
+        self.spectraworkersvalue.setMaximum(256)
+        self.spectraworkersvalue.setObjectName("spectraworkersvalue")
+        self.gridLayout_2.addWidget(self.spectraworkersvalue, 4, 7, 1, 1)
+        self.fitexecutorlabel = QtWidgets.QLabel(parent=fitparbox)
+        self.fitexecutorlabel.setObjectName("fitexecutorlabel")
+        self.gridLayout_2.addWidget(self.fitexecutorlabel, 3, 6, 1, 1)
+        self.fitexecutor = QtWidgets.QComboBox(parent=fitparbox)
+        self.fitexecutor.setObjectName("fitexecutor")
+        self.fitexecutor.addItem("")
+        self.fitexecutor.addItem("")
+        self.fitexecutor.addItem("")
+        self.gridLayout_2.addWidget(self.fitexecutor, 3, 7, 1, 1)
+        self.repfittolcheck = QtWidgets.QCheckBox(parent=fitparbox)
+        self.repfittolcheck.setObjectName("repfittolcheck")
+        self.gridLayout_2.addWidget(self.repfittolcheck, 13, 6, 1, 2)
+        self.repfittolshiftlabel = QtWidgets.QLabel(parent=fitparbox)
+        self.repfittolshiftlabel.setObjectName("repfittolshiftlabel")
+        self.gridLayout_2.addWidget(self.repfittolshiftlabel, 14, 6, 1, 1)
+        self.repfittolshiftvalue = QtWidgets.QDoubleSpinBox(parent=fitparbox)
+        self.repfittolshiftvalue.setDecimals(4)
+        self.repfittolshiftvalue.setMaximum(1.0)
+        self.repfittolshiftvalue.setSingleStep(0.0005)
+        self.repfittolshiftvalue.setObjectName("repfittolshiftvalue")
+        self.gridLayout_2.addWidget(self.repfittolshiftvalue, 14, 7, 1, 1)
+        self.repfittolconvlabel = QtWidgets.QLabel(parent=fitparbox)
+        self.repfittolconvlabel.setObjectName("repfittolconvlabel")
+        self.gridLayout_2.addWidget(self.repfittolconvlabel, 15, 6, 1, 1)
+        self.repfittolconvvalue = QtWidgets.QDoubleSpinBox(parent=fitparbox)
+        self.repfittolconvvalue.setDecimals(4)
+        self.repfittolconvvalue.setMaximum(1.0)
+        self.repfittolconvvalue.setSingleStep(0.005)
+        self.repfittolconvvalue.setObjectName("repfittolconvvalue")
+        self.gridLayout_2.addWidget(self.repfittolconvvalue, 15, 7, 1, 1)
+        self.repfittolabundlabel = QtWidgets.QLabel(parent=fitparbox)
+        self.repfittolabundlabel.setObjectName("repfittolabundlabel")
+        self.gridLayout_2.addWidget(self.repfittolabundlabel, 16, 6, 1, 1)
+        self.repfittolabundvalue = QtWidgets.QDoubleSpinBox(parent=fitparbox)
+        self.repfittolabundvalue.setDecimals(4)
+        self.repfittolabundvalue.setMaximum(1.0)
+        self.repfittolabundvalue.setSingleStep(0.005)
+        self.repfittolabundvalue.setObjectName("repfittolabundvalue")
+        self.gridLayout_2.addWidget(self.repfittolabundvalue, 16, 7, 1, 1)
+        self.batchoutputcheck = QtWidgets.QCheckBox(parent=fitparbox)
+        self.batchoutputcheck.setObjectName("batchoutputcheck")
+        self.gridLayout_2.addWidget(self.batchoutputcheck, 17, 6, 1, 2)
+        self.batchredrawlabel = QtWidgets.QLabel(parent=fitparbox)
+        self.batchredrawlabel.setObjectName("batchredrawlabel")
+        self.gridLayout_2.addWidget(self.batchredrawlabel, 18, 6, 1, 1)
+        self.batchredrawvalue = QtWidgets.QSpinBox(parent=fitparbox)
+        self.batchredrawvalue.setMinimum(0)
+        self.batchredrawvalue.setMaximum(60000)
+        self.batchredrawvalue.setSingleStep(100)
+        self.batchredrawvalue.setObjectName("batchredrawvalue")
+        self.gridLayout_2.addWidget(self.batchredrawvalue, 18, 7, 1, 1)
 
         self.retranslateUi(fitparbox)
         self.okcancelbutton.accepted.connect(fitparbox.accept) # type: ignore
@@ -236,6 +361,24 @@ class Ui_fitparbox(object):
         fitparbox.setTabOrder(self.contfitparepsvalue, self.contfitmedwindvalue)
         fitparbox.setTabOrder(self.contfitmedwindvalue, self.disablecontfit)
         fitparbox.setTabOrder(self.disablecontfit, self.conthardvalue)
+        fitparbox.setTabOrder(self.conthardvalue, self.warmstartcheck)
+        fitparbox.setTabOrder(self.warmstartcheck, self.fitworkersvalue)
+        fitparbox.setTabOrder(self.fitworkersvalue, self.synthcachecheck)
+        fitparbox.setTabOrder(self.synthcachecheck, self.abundmethod)
+        fitparbox.setTabOrder(self.abundmethod, self.abundvalidatevalue)
+        fitparbox.setTabOrder(self.abundvalidatevalue, self.mergewindowscheck)
+        fitparbox.setTabOrder(self.mergewindowscheck, self.synthworkersvalue)
+        fitparbox.setTabOrder(self.synthworkersvalue, self.opacitycachecheck)
+        fitparbox.setTabOrder(self.opacitycachecheck, self.trimlinelistscheck)
+        fitparbox.setTabOrder(self.trimlinelistscheck, self.coarsestepvalue)
+        fitparbox.setTabOrder(self.coarsestepvalue, self.spectraworkersvalue)
+        fitparbox.setTabOrder(self.spectraworkersvalue, self.fitexecutor)
+        fitparbox.setTabOrder(self.fitexecutor, self.repfittolcheck)
+        fitparbox.setTabOrder(self.repfittolcheck, self.repfittolshiftvalue)
+        fitparbox.setTabOrder(self.repfittolshiftvalue, self.repfittolconvvalue)
+        fitparbox.setTabOrder(self.repfittolconvvalue, self.repfittolabundvalue)
+        fitparbox.setTabOrder(self.repfittolabundvalue, self.batchoutputcheck)
+        fitparbox.setTabOrder(self.batchoutputcheck, self.batchredrawvalue)
 
     def retranslateUi(self, fitparbox):
         _translate = QtCore.QCoreApplication.translate
@@ -274,6 +417,47 @@ class Ui_fitparbox(object):
         self.contfitmedwindlabel.setText(_translate("fitparbox", "Median Window"))
         self.contfitparepslabel1.setText(_translate("fitparbox", "10 ^ ( -"))
         self.contfitparepslabel2.setText(_translate("fitparbox", ")"))
+        self.performancelabel.setText(_translate("fitparbox", "Performance"))
+        self.warmstartcheck.setToolTip(_translate("fitparbox", "Seed the Wave. Shift and Convolution fit of each line from the lines already fitted. Changes the results slightly, since the Nelder-Mead method starts from another point."))
+        self.warmstartcheck.setText(_translate("fitparbox", "Warm Start"))
+        self.fitworkerslabel.setToolTip(_translate("fitparbox", "Number of lines of a spectrum fitted at the same time. With TurboSpectrum, each worker runs in its own copy of the configuration folder."))
+        self.fitworkerslabel.setText(_translate("fitparbox", "Fit Workers"))
+        self.synthcachecheck.setToolTip(_translate("fitparbox", "Keep the TurboSpectrum spectra on disk (~/.cache/meafs) and reuse them when the same configuration is synthesized again. The abundances are compared with 4 decimals, so the results can differ slightly from a fit without the cache."))
+        self.synthcachecheck.setText(_translate("fitparbox", "Synthetic Spectra Cache"))
+        self.abundmethodlabel.setToolTip(_translate("fitparbox", "Minimization of the TurboSpectrum abundance fit. The Emulator interpolates a small grid of syntheses instead of synthesizing every step."))
+        self.abundmethodlabel.setText(_translate("fitparbox", "Abundance Method"))
+        self.abundmethod.setItemText(0, _translate("fitparbox", "Nelder-Mead"))
+        self.abundmethod.setItemText(1, _translate("fitparbox", "Brent"))
+        self.abundmethod.setItemText(2, _translate("fitparbox", "Emulator"))
+        self.abundvalidatelabel.setToolTip(_translate("fitparbox", "Maximum difference between the emulated abundance and the abundance fitted directly on the synthesized chi2 around it. Above it, the Nelder-Mead method is used instead."))
+        self.abundvalidatelabel.setText(_translate("fitparbox", "Emulator Tolerance"))
+        self.abundvalidatevalue.setSpecialValueText(_translate("fitparbox", "Off"))
+        self.mergewindowscheck.setToolTip(_translate("fitparbox", "Synthesize the first continuum window of nearby lines once and slice each line from it. The sliced window can differ slightly from a synthesis of the line alone."))
+        self.mergewindowscheck.setText(_translate("fitparbox", "Merge Nearby Windows"))
+        self.synthworkerslabel.setToolTip(_translate("fitparbox", "Number of independent TurboSpectrum syntheses run at the same time, like the grid of the abundance Emulator."))
+        self.synthworkerslabel.setText(_translate("fitparbox", "Synthesis Workers"))
+        self.opacitycachecheck.setToolTip(_translate("fitparbox", "Keep the continuum opacities of TurboSpectrum (~/.cache/meafs) and run only bsyn when the opacity of the current model and range was already computed."))
+        self.opacitycachecheck.setText(_translate("fitparbox", "Continuum Opacity Cache"))
+        self.trimlinelistscheck.setToolTip(_translate("fitparbox", "Give TurboSpectrum only the lines of the line data files around each synthesis range. Hydrogen lines are always kept."))
+        self.trimlinelistscheck.setText(_translate("fitparbox", "Trim Line Lists"))
+        self.coarsesteplabel.setToolTip(_translate("fitparbox", "Multiple of the TurboSpectrum wavelength step used in the first fit stages. The last pass of each line always runs at the step of the configuration file."))
+        self.coarsesteplabel.setText(_translate("fitparbox", "Coarse Step"))
+        self.spectraworkerslabel.setToolTip(_translate("fitparbox", "Number of spectra fitted at the same time, each one in its own process."))
+        self.spectraworkerslabel.setText(_translate("fitparbox", "Spectra Workers"))
+        self.fitexecutorlabel.setToolTip(_translate("fitparbox", "How the lines of the Equivalent Width mode are fitted: one after the other, in threads or in worker processes (see Fit Workers)."))
+        self.fitexecutorlabel.setText(_translate("fitparbox", "Line Executor"))
+        self.fitexecutor.setItemText(0, _translate("fitparbox", "Serial"))
+        self.fitexecutor.setItemText(1, _translate("fitparbox", "Threads"))
+        self.fitexecutor.setItemText(2, _translate("fitparbox", "Processes"))
+        self.repfittolcheck.setToolTip(_translate("fitparbox", "Stop the iterations of a line before the Repeat Fit value once the wavelength shift, convolution and abundance change less than the tolerances below."))
+        self.repfittolcheck.setText(_translate("fitparbox", "Stop Converged Iterations"))
+        self.repfittolshiftlabel.setText(_translate("fitparbox", "Shift Tolerance (A)"))
+        self.repfittolconvlabel.setText(_translate("fitparbox", "Convolution Tolerance"))
+        self.repfittolabundlabel.setText(_translate("fitparbox", "Abundance Tolerance"))
+        self.batchoutputcheck.setToolTip(_translate("fitparbox", "Keep the fitted curves in memory and write them together in On_time_Plots/fit_curves.csv instead of a CSV file for each line, and draw the plot less often."))
+        self.batchoutputcheck.setText(_translate("fitparbox", "Batch Output"))
+        self.batchredrawlabel.setToolTip(_translate("fitparbox", "Minimum interval between the draws of the plot during a batch output run."))
+        self.batchredrawlabel.setText(_translate("fitparbox", "Redraw Interval (ms)"))
 
 
 if __name__ == "__main__":
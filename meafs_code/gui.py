@@ -369,6 +369,7 @@ class MEAFS(QtWidgets.QMainWindow, Ui_MEAFS):
 
         self.run.clicked.connect(self.run_fit)
         self.stop_state = False
+        self.fit_thread = None
         self.stop.clicked.connect(self.stop_func)
 
         # Run Manual Fit Configuration
@@ -425,16 +426,39 @@ class MEAFS(QtWidgets.QMainWindow, Ui_MEAFS):
 
         # Edit Submenu Configuration
         self.fitpar.triggered.connect(self.fitparWindow)
-        self.repfit = 2
-        self.cut_val = [10 / 2, 3 / 2, .4 / 2, 1 / 2]
-        self.max_iter = [1000, 1000, 10]
-        self.convovbound = [0, 5]
-        self.wavebound = .2
-        self.continuumpars = [2, 8]
-        self.medianwindow = 3
-        self.contdisabled = QtCore.Qt.CheckState.Unchecked
-        self.contfixedvalue = 1.0
-        self.contmethodind = 0
+        # The fit defaults are the ones of the fit engine
+        defaults = fit_engine.FitConfig(type_synth=None)
+        self.repfit = defaults.repfit
+        self.repfittol = defaults.repfit_tol
+        self.cut_val = defaults.cut_val
+        self.max_iter = defaults.max_iter
+        self.convovbound = defaults.convovbound
+        self.wavebound = defaults.wavebound
+        self.continuumpars = defaults.contpars
+        self.medianwindow = defaults.medianwindow
+        self.contdisabled = QtCore.Qt.CheckState.Checked if defaults.contdisabled else QtCore.Qt.CheckState.Unchecked
+        self.contfixedvalue = defaults.contfixedvalue
+        self.contmethodind = defaults.contmethod
+        self.warmstart = False
+        self.fitworkers = defaults.workers
+        self.fitexecutor = defaults.executor
+        self.mergewindows = defaults.merge_windows
+        self.synthworkers = defaults.synth_workers
+        self.spectraworkers = 1
+        self.synthcache = False
+        self.opacitycache = False
+        self.trimlinelists = False
+        self.coarsestep = defaults.coarse_step
+        self.abundmethod = defaults.abund_method
+        self.abundvalidate = defaults.abund_validate
+        self.batchoutput = False
+        self.batchredraw = 1000
+        # Settings of the Performance group, saved together in the session
+        self.enginesettings = ["warmstart", "fitworkers", "synthcache", "abundmethod", "abundvalidate",
+                               "mergewindows", "synthworkers", "opacitycache",
+                               "trimlinelists", "coarsestep", "spectraworkers", "fitexecutor", "repfittol",
+                               "batchoutput", "batchredraw"]
+        self.enginedefaults = {name: getattr(self, name) for name in self.enginesettings}
 
         self.errorguireset.triggered.connect(lambda: self.gui_hold(False))
         self.normspec.triggered.connect(self.norm_trunc_spec)
@@ -514,6 +538,9 @@ class MEAFS(QtWidgets.QMainWindow, Ui_MEAFS):
         """
 
         if self.show_quit():
+            if self.fit_thread is not None:
+                self.fit_thread.cancel()
+                self.fit_thread.wait()
             self.ipython_widget.kernel_client.stop_channels()
             self.ipython_widget.kernel_manager.shutdown_kernel()
             event.accept()
@@ -833,6 +860,9 @@ class MEAFS(QtWidgets.QMainWindow, Ui_MEAFS):
         self.currentvaluesplotbutton.setDisabled(value)
         self.currentvaluessavebutton.setDisabled(value)
         self.abundancetable.setDisabled(value)
+        for button in [self.linesplotsingle, self.linesplotall, self.boxplotcreate,
+                       self.histplotsingle, self.hitsplotall]:
+            button.setDisabled(value)
 
         if value:
             btt_text = "Running"
@@ -1337,21 +1367,33 @@ class MEAFS(QtWidgets.QMainWindow, Ui_MEAFS):
             return False
         return True
 
+    def fit_running(self):
+        """
+        Check if a fit, or the syntheses of the final plots, are still running.
+
+        :return: true if a run is in progress, otherwise false.
+        """
+
+        return self.fit_thread is not None and self.fit_thread.isRunning()
+
     def run_fit(self):
         """
         Call the fit algorithm.
         """
 
+        if self.fit_running():
+            return
+
         if self.check_output_folder():
             self.abundancetable.setRowCount(0)
-            self.results_array, self.ax, self.plot_line_refer = fit.gui_call(self.specs_data,
-                                                                             self,
-                                                                             QtCore.Qt.CheckState.Checked,
-                                                                             self.canvas,
-                                                                             self.ax,
-                                                                             cut_val=self.cut_val,
-                                                                             plot_line_refer=self.plot_line_refer,
-                                                                             repfit=self.repfit)
+            fit.gui_call(self.specs_data,
+                         self,
+                         QtCore.Qt.CheckState.Checked,
+                         self.canvas,
+                         self.ax,
+                         cut_val=self.cut_val,
+                         plot_line_refer=self.plot_line_refer,
+                         repfit=self.repfit)
 
     def run_fit_nopars(self):
         """
@@ -1359,6 +1401,9 @@ class MEAFS(QtWidgets.QMainWindow, Ui_MEAFS):
         Wavelength Shift, Continuum and Convolution.
         """
 
+        if self.fit_running():
+            return
+
         if self.check_output_folder():
             ind = self.abundancetable.currentRow()
             ind_col = self.abundancetable.currentColumn()
@@ -1374,18 +1419,17 @@ class MEAFS(QtWidgets.QMainWindow, Ui_MEAFS):
                         self.convolutionvalue.value()]
 
             self.abundancetable.setRowCount(0)
-            self.results_array, self.ax, self.plot_line_refer = fit.gui_call(self.specs_data,
-                                                                             self,
-                                                                             QtCore.Qt.CheckState.Checked,
-                                                                             self.canvas,
-                                                                             self.ax,
-                                                                             cut_val=self.cut_val,
-                                                                             plot_line_refer=self.plot_line_refer,
-                                                                             opt_pars=opt_pars,
-                                                                             repfit=self.repfit,
-                                                                             only_abund_ind=ind)
-
-            self.abundancetable.setCurrentCell(ind, ind_col)
+            fit.gui_call(self.specs_data,
+                         self,
+                         QtCore.Qt.CheckState.Checked,
+                         self.canvas,
+                         self.ax,
+                         cut_val=self.cut_val,
+                         plot_line_refer=self.plot_line_refer,
+                         opt_pars=opt_pars,
+                         repfit=self.repfit,
+                         only_abund_ind=ind,
+                         on_finish=lambda: self.abundancetable.setCurrentCell(ind, ind_col))
 
     def run_nofit(self):
         """
@@ -1393,6 +1437,9 @@ class MEAFS(QtWidgets.QMainWindow, Ui_MEAFS):
         with the selected values.
         """
 
+        if self.fit_running():
+            return
+
         if self.check_output_folder():
             ind = self.abundancetable.currentRow()
             if ind == -1:
@@ -1404,16 +1451,16 @@ class MEAFS(QtWidgets.QMainWindow, Ui_MEAFS):
                         self.convolutionvalue.value()]
             abundplot = self.abundancevalue.value()
 
-            self.results_array, self.ax, self.plot_line_refer = fit.gui_call(self.specs_data,
-                                                                             self,
-                                                                             QtCore.Qt.CheckState.Checked,
-                                                                             self.canvas,
-                                                                             self.ax,
-                                                                             cut_val=self.cut_val,
-                                                                             plot_line_refer=self.plot_line_refer,
-                                                                             opt_pars=opt_pars,
-                                                                             repfit=0, abundplot=abundplot,
-                                                                             results_array=self.results_array)
+            fit.gui_call(self.specs_data,
+                         self,
+                         QtCore.Qt.CheckState.Checked,
+                         self.canvas,
+                         self.ax,
+                         cut_val=self.cut_val,
+                         plot_line_refer=self.plot_line_refer,
+                         opt_pars=opt_pars,
+                         repfit=0, abundplot=abundplot,
+                         results_array=self.results_array)
 
     def run_final_plots(self, plot_type, single=False):
         """
@@ -1423,6 +1470,9 @@ class MEAFS(QtWidgets.QMainWindow, Ui_MEAFS):
         :param single: create a final plot to a single line or for all of them.
         """
 
+        if self.fit_running():
+            return
+
         if self.abundancetable.rowCount() == 0:
             self.show_error("Abundance Table is empty!")
             return
@@ -1445,17 +1495,17 @@ class MEAFS(QtWidgets.QMainWindow, Ui_MEAFS):
                     getsizefrom = self.differhistplotimage
             self.scale = QtCore.QSize(getsizefrom.width(), getsizefrom.height())
 
-        self.results_array, self.ax, self.plot_line_refer = fit.gui_call(self.specs_data,
-                                                                         self,
-                                                                         QtCore.Qt.CheckState.Checked,
-                                                                         self.canvas,
-                                                                         self.ax,
-                                                                         cut_val=self.cut_val,
-                                                                         plot_line_refer=self.plot_line_refer,
-                                                                         results_array=self.results_array,
-                                                                         final_plot=True,
-                                                                         plot_type=plot_type,
-                                                                         single=single)
+        fit.gui_call(self.specs_data,
+                     self,
+                     QtCore.Qt.CheckState.Checked,
+                     self.canvas,
+                     self.ax,
+                     cut_val=self.cut_val,
+                     plot_line_refer=self.plot_line_refer,
+                     results_array=self.results_array,
+                     final_plot=True,
+                     plot_type=plot_type,
+                     single=single)
 
     def run_check_continuum(self):
         """
@@ -1568,6 +1618,8 @@ class MEAFS(QtWidgets.QMainWindow, Ui_MEAFS):
         """
 
         self.stop_state = True
+        if self.fit_thread is not None:
+            self.fit_thread.cancel()
 
     def save_cur_abund(self):
         """
@@ -1585,11 +1637,10 @@ class MEAFS(QtWidgets.QMainWindow, Ui_MEAFS):
         ind = self.results_array[(self.results_array["Element"] == elem) &
                                  (self.results_array["Lambda (A)"] == float(lamb))].index
         for i in ind:
-            file = Path(self.outputname.text()).joinpath("On_time_Plots",
-                                                  "fit_{}_{}_ang_{}.csv".format(elem, lamb, 1))
+            spec_fits = fit.read_fit_curves(self.outputname.text(), elem, lamb)
 
-            if os.path.isfile(file):
-                spec_fit = pd.read_csv(file)
+            if spec_fits:
+                spec_fit = spec_fits[0]
                 # Fit of Equivalent Width Fitted Spectrum
                 # noinspection PyUnresolvedReferences
                 spec1d = Spectrum(spectral_axis=np.asarray(spec_fit.iloc[:, 0]) * u.AA,
@@ -1633,6 +1684,7 @@ class MEAFS(QtWidgets.QMainWindow, Ui_MEAFS):
                                                       directory=init_path)[0]
         line, self.results_array = fit.open_previous([], [], fl_name=fname)
 
+        curves = fit.FitCurves.load(os.path.dirname(fname))
         self.abundancetable.setRowCount(len(self.results_array))
         for i in range(len(self.results_array)):
             elem = self.results_array.iloc[i, 0]
@@ -1641,20 +1693,11 @@ class MEAFS(QtWidgets.QMainWindow, Ui_MEAFS):
             self.abundancetable.setItem(i, 0, QtWidgets.QTableWidgetItem(str(elem)))
             self.abundancetable.setItem(i, 1, QtWidgets.QTableWidgetItem(str(lamb)))
 
-            path = Path(os.path.dirname(fname)).joinpath("On_time_Plots")
-            count = 0
-            while True:
-                file = path.joinpath("fit_{}_{}_ang_{}.csv".format(elem, lamb, count + 1))
-
-                if os.path.isfile(file):
-                    data = pd.read_csv(file)
-                    count += 1
-                    lineplot = self.ax.plot(data.iloc[:, 0], data.iloc[:, 1], "--", linewidth=1.5)
-                    axvlineplot = self.ax.axvline(lamb, ls="-.", c="red", linewidth=.5)
-                    self.plot_line_refer.loc[len(self.plot_line_refer)] = {"elem": elem, "wave": lamb, "refer": lineplot[0]}
-                    self.plot_line_refer.loc[len(self.plot_line_refer)] = {"elem": elem, "wave": lamb, "refer": axvlineplot}
-                else:
-                    break
+            for data in fit.read_fit_curves(os.path.dirname(fname), elem, lamb, curves=curves):
+                lineplot = self.ax.plot(data.iloc[:, 0], data.iloc[:, 1], "--", linewidth=1.5)
+                axvlineplot = self.ax.axvline(lamb, ls="-.", c="red", linewidth=.5)
+                self.plot_line_refer.loc[len(self.plot_line_refer)] = {"elem": elem, "wave": lamb, "refer": lineplot[0]}
+                self.plot_line_refer.loc[len(self.plot_line_refer)] = {"elem": elem, "wave": lamb, "refer": axvlineplot}
             self.canvas.draw()
 
     def results_show_tab(self):
@@ -1743,6 +1786,11 @@ class MEAFS(QtWidgets.QMainWindow, Ui_MEAFS):
         Call and get the values of the *Fit Parameters* window.
         """
 
+        # Methods of the TurboSpectrum abundance fit, in the order of the combo box
+        abund_methods = ["nelder-mead", "brent", "emulator"]
+        # Tolerances of the wavelength shift, convolution and abundance shown while they are not used
+        repfit_tol = self.repfittol if self.repfittol is not None else [0.001, 0.01, 0.01]
+
         def accept():
             """Write the values from the window in the main variables"""
 
@@ -1763,6 +1811,25 @@ class MEAFS(QtWidgets.QMainWindow, Ui_MEAFS):
             self.contdisabled = uifitset.disablecontfit.checkState()
             self.contfixedvalue = uifitset.conthardvalue.value()
             self.contmethodind = uifitset.contmethod.currentIndex()
+            self.warmstart = uifitset.warmstartcheck.isChecked()
+            self.fitworkers = uifitset.fitworkersvalue.value()
+            self.fitexecutor = fit_engine.LineExecutor.backends[uifitset.fitexecutor.currentIndex()]
+            self.synthcache = uifitset.synthcachecheck.isChecked()
+            self.abundmethod = abund_methods[uifitset.abundmethod.currentIndex()]
+            self.abundvalidate = uifitset.abundvalidatevalue.value() or None
+            self.mergewindows = uifitset.mergewindowscheck.isChecked()
+            self.synthworkers = uifitset.synthworkersvalue.value()
+            self.opacitycache = uifitset.opacitycachecheck.isChecked()
+            self.trimlinelists = uifitset.trimlinelistscheck.isChecked()
+            self.coarsestep = uifitset.coarsestepvalue.value()
+            self.spectraworkers = uifitset.spectraworkersvalue.value()
+            self.repfittol = None
+            if uifitset.repfittolcheck.isChecked():
+                self.repfittol = [uifitset.repfittolshiftvalue.value(),
+                                  uifitset.repfittolconvvalue.value(),
+                                  uifitset.repfittolabundvalue.value()]
+            self.batchoutput = uifitset.batchoutputcheck.isChecked()
+            self.batchredraw = uifitset.batchredrawvalue.value()
 
         def check_convov(showerror=False):
             """Check if the convolution respect the limits."""
@@ -1819,6 +1886,25 @@ class MEAFS(QtWidgets.QMainWindow, Ui_MEAFS):
                 uifitset.contfitparepsvalue.setEnabled(False)
                 uifitset.contfitparepslabel2.setEnabled(False)
 
+        def check_abund_method():
+            """Only the Emulator method is validated."""
+            emulator = abund_methods[uifitset.abundmethod.currentIndex()] == "emulator"
+            uifitset.abundvalidatelabel.setEnabled(emulator)
+            uifitset.abundvalidatevalue.setEnabled(emulator)
+
+        def check_repfit_tol():
+            """The tolerances are only used when the converged iterations are stopped."""
+            enabled = uifitset.repfittolcheck.isChecked()
+            for widget in [uifitset.repfittolshiftlabel, uifitset.repfittolshiftvalue,
+                           uifitset.repfittolconvlabel, uifitset.repfittolconvvalue,
+                           uifitset.repfittolabundlabel, uifitset.repfittolabundvalue]:
+                widget.setEnabled(enabled)
+
+        def check_batch_output():
+            """The canvas is only drawn less often with the batch output."""
+            uifitset.batchredrawlabel.setEnabled(uifitset.batchoutputcheck.isChecked())
+            uifitset.batchredrawvalue.setEnabled(uifitset.batchoutputcheck.isChecked())
+
         fitparbox = QtWidgets.QDialog()
         uifitset = Ui_fitparbox()
         uifitset.setupUi(fitparbox)
@@ -1840,6 +1926,24 @@ class MEAFS(QtWidgets.QMainWindow, Ui_MEAFS):
         uifitset.conthardvalue.setValue(self.contfixedvalue)
         uifitset.contmethod.setCurrentIndex(self.contmethodind)
         uifitset.waveboundmaxshiftvalue.setValue(self.wavebound)
+        uifitset.warmstartcheck.setChecked(self.warmstart)
+        uifitset.fitworkersvalue.setValue(self.fitworkers)
+        uifitset.fitexecutor.setCurrentIndex(fit_engine.LineExecutor.backends.index(self.fitexecutor))
+        uifitset.synthcachecheck.setChecked(self.synthcache)
+        uifitset.abundmethod.setCurrentIndex(abund_methods.index(self.abundmethod))
+        uifitset.abundvalidatevalue.setValue(0 if self.abundvalidate is None else self.abundvalidate)
+        uifitset.mergewindowscheck.setChecked(self.mergewindows)
+        uifitset.synthworkersvalue.setValue(self.synthworkers)
+        uifitset.opacitycachecheck.setChecked(self.opacitycache)
+        uifitset.trimlinelistscheck.setChecked(self.trimlinelists)
+        uifitset.coarsestepvalue.setValue(self.coarsestep)
+        uifitset.spectraworkersvalue.setValue(self.spectraworkers)
+        uifitset.repfittolcheck.setChecked(self.repfittol is not None)
+        uifitset.repfittolshiftvalue.setValue(repfit_tol[0])
+        uifitset.repfittolconvvalue.setValue(repfit_tol[1])
+        uifitset.repfittolabundvalue.setValue(repfit_tol[2])
+        uifitset.batchoutputcheck.setChecked(self.batchoutput)
+        uifitset.batchredrawvalue.setValue(self.batchredraw)
         uifitset.okcancelbutton.accepted.connect(accept)
 
         uifitset.wavecutvalue.editingFinished.connect(lambda: check_convov(showerror=False))
@@ -1848,8 +1952,14 @@ class MEAFS(QtWidgets.QMainWindow, Ui_MEAFS):
 
         uifitset.contmethod.currentIndexChanged.connect(lambda: check_cont_method())
         uifitset.disablecontfit.checkStateChanged.connect(lambda: check_cont_method())
+        uifitset.abundmethod.currentIndexChanged.connect(lambda: check_abund_method())
+        uifitset.repfittolcheck.checkStateChanged.connect(lambda: check_repfit_tol())
+        uifitset.batchoutputcheck.checkStateChanged.connect(lambda: check_batch_output())
 
         check_cont_method()
+        check_abund_method()
+        check_repfit_tol()
+        check_batch_output()
 
         self.centralize_child_window(fitparbox)
 
@@ -2389,7 +2499,8 @@ class MEAFS(QtWidgets.QMainWindow, Ui_MEAFS):
                      self.plotstab.currentIndex(),
                      self.abundshift.value(),
                      self.histbinsvalue.value(),
-                     self.loadDatacheck]
+                     self.loadDatacheck,
+                     {name: getattr(self, name) for name in self.enginesettings}]
 
         if getdill:
             return list_save
@@ -2475,6 +2586,10 @@ class MEAFS(QtWidgets.QMainWindow, Ui_MEAFS):
             self.abundshift.setValue(list_save[35])
             self.histbinsvalue.setValue(list_save[36])
             self.loadDatacheck = list_save[37]
+            # Sessions saved before the Performance settings existed do not have them
+            if len(list_save) > 38:
+                for name, value in list_save[38].items():
+                    setattr(self, name, value)
 
             self.canvas = FigureCanvasQTAgg(self.fig)
             self.ax = self.fig.axes[0]
@@ -2511,6 +2626,7 @@ class MEAFS(QtWidgets.QMainWindow, Ui_MEAFS):
             self.ax.grid()
             self.canvas.draw()
 
+            defaults = fit_engine.FitConfig(type_synth=None)
             list_save = [
                          # filepath
                          None,
@@ -2563,25 +2679,25 @@ class MEAFS(QtWidgets.QMainWindow, Ui_MEAFS):
                          # turbospectrumoutputname
                          "",
                          # repfit
-                         2,
+                         defaults.repfit,
                          # cut_val
-                         [10 / 2, 3 / 2, .4 / 2, 1 / 2],
+                         defaults.cut_val,
                          # max_iter
-                         [1000, 1000, 10],
+                         defaults.max_iter,
                          # convovbound
-                         [0, 5],
+                         defaults.convovbound,
                          # wavebound
-                         .2,
+                         defaults.wavebound,
                          # continuumpars
-                         [2, 8],
+                         defaults.contpars,
                          # medianwindow
-                         3,
+                         defaults.medianwindow,
                          # contdisabled
-                         QtCore.Qt.CheckState.Unchecked,
+                         QtCore.Qt.CheckState.Checked if defaults.contdisabled else QtCore.Qt.CheckState.Unchecked,
                          # contfixedvalue
-                         1.0,
+                         defaults.contfixedvalue,
                          # contmethodind
-                         0,
+                         defaults.contmethod,
                          # tabplotshels
                          0,
                          # stdtext
@@ -2593,7 +2709,9 @@ class MEAFS(QtWidgets.QMainWindow, Ui_MEAFS):
                          # histbinsvalue
                          20,
                          # loadDatacheck
-                         False
+                         False,
+                         # enginesettings
+                         dict(self.enginedefaults)
                          ]
 
             self.lambshifvalue.setValue(0.0000)
@@ -1,6 +1,15 @@
-
-from . import abundance_fit as fit
-from . import abundance_plot as final_plots
-from . import unify_plots
+import importlib
 
 from . import fit_functions as ff
+from . import fit_engine
+
+__all__ = ["fit", "final_plots", "unify_plots", "ff", "fit_engine"]
+
+# Modules that depend on QT are only imported when used, so the fit engine can run without it
+_qt_modules = {"fit": "abundance_fit", "final_plots": "abundance_plot", "unify_plots": "unify_plots"}
+
+
+def __getattr__(name):
+    if name in _qt_modules:
+        return importlib.import_module("." + _qt_modules[name], __name__)
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
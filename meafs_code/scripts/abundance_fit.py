@@ -7,14 +7,13 @@
   the synthetic spectrum, plot the curves and more.
 """
 
-from specutils.analysis import equivalent_width
 from PyQt6 import QtWidgets, QtCore
-from specutils import Spectrum, SpectralRegion
 import matplotlib.pyplot as plt
-import astropy.units as u
 from pathlib import Path
 import pandas as pd
 import numpy as np
+import threading
+import traceback
 import time
 import csv
 import sys
@@ -24,45 +23,16 @@ from . import fit_functions as ff
 from . import voigt_functions as vf
 from . import turbospec_functions as tf
 from . import abundance_plot as ap
+# The fit itself does not depend on QT, its functions are re-exported here for compatibility
+from .fit_engine import (cur_time, log_write, check_order, fit_line, init_line_worker, fit_line_worker,  # noqa: F401
+                         fit_lines_pool, FitConfig, fit_lines, fit_spectra, result_columns)
+from .results_store import ResultsStore, FitCurves, read_results, read_fit_curves, pending_lines
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
 # noinspection PyUnresolvedReferences
 from meafs_code import __version__
 
 
-def cur_time():
-    """
-    Function to return the formated local current time.
-
-    :return: the local formated time
-    """
-    init_local = time.localtime()
-    local = ("{:04d}.{:02d}.{:02d} "
-             "{:02d}:{:02d}:{:02d}: ").format(init_local.tm_year,
-                                              init_local.tm_mon,
-                                              init_local.tm_mday,
-                                              init_local.tm_hour,
-                                              init_local.tm_min,
-                                              init_local.tm_sec)
-    return local
-
-
-def log_write(folder, msg):
-    """
-    Function to write a message in the log and print on the GUI/terminal.
-
-    :param folder: folder path of the log file.
-    :param msg: the message to be written.
-    """
-    # noinspection PyTypeChecker
-    with open(str(Path(folder).joinpath("log.txt")), "a") as f:
-        f.write(cur_time())
-        f.write(msg)
-        f.write("\n")
-        f.close()
-    print(cur_time() + msg)
-
-
 def get_sep(file):
     """
     Get the delimiter automatically from an ASCII file using Sniffer.
@@ -142,37 +112,26 @@ def save_spec(spec, fl_name, delimiter=","):
                    fmt="%.8f", delimiter=delimiter)
 
 
-def open_previous(linelist, columns_names, fl_name=Path("found_values.csv")):
+def open_previous(linelist, columns_names, fl_name=Path("found_values.csv"), spectrum=None):
     """
     Open the previous results and analyse it.
 
     :param linelist: linelist object.
     :param columns_names: names of the columns in the file.
     :param fl_name: file name.
+    :param spectrum: only the previous results of this spectrum (the ``Spectrum`` column) are
+                     removed from the linelist. If None, the results of any spectrum are.
     :return: the new linelist and the pandas dataframe with the previous results.
     """
 
-    try:
-        # Try to open
-        prev = pd.read_csv(fl_name, delimiter=",", dtype=str)
-    except (FileNotFoundError, pd.errors.EmptyDataError):
+    # Includes the lines saved in the results store by an unfinished fit
+    prev = read_results(fl_name)
+    if prev is None:
         # If file not found or empty database, create a new one and return
         return linelist, pd.DataFrame(columns=columns_names)
 
-    for i in prev.columns:
-        if i != "Element" and i != "Chi" and i != "Equiv Width Obs (A)" and i != "Equiv Width Fit (A)":
-            prev[i] = prev[i].astype(float)
-
-    # Reads the existing data
-    new_linelist = pd.DataFrame(columns=[0, 1])
-    for i in range(len(linelist)):
-        elem = linelist.iloc[i][0]
-        lamb = linelist.iloc[i][1]
-        ind = prev[(prev["Element"] == elem) & (prev["Lambda (A)"] == float(lamb))].index
-        if ind.tolist() == []:
-            new_linelist.loc[i] = linelist.iloc[i]
-
-    return new_linelist, prev
+    # Removes the lines already in the results
+    return pending_lines(linelist, prev, spectrum=spectrum), prev
 
 
 def get_specs_lims(specs, overlim_x=False, overlim_y=False, margin=0.02):
@@ -268,7 +227,6 @@ def plot_spec(spec1, spec2, spec3, lamb, elem, folder, show=False, save=True):
     :param save: true to save the spectrum.
     """
 
-
     plt.figure(figsize=(16, 9))
 
     plt.plot(spec1[0], spec1[1], label="Observed")
@@ -288,7 +246,7 @@ def plot_spec(spec1, spec2, spec3, lamb, elem, folder, show=False, save=True):
 
 
 def plot_spec_ui(spec_fit_arr, folder, elem, lamb, order, ax, canvas, plot_line_refer, vline=True,
-                 save=True, overlim_x=False, overlim_y=True, enable_lim=True, color=None):
+                 save=True, overlim_x=False, overlim_y=True, enable_lim=True, color=None, draw=True):
     """
     Plot the current line results in the GUI.
 
@@ -306,6 +264,7 @@ def plot_spec_ui(spec_fit_arr, folder, elem, lamb, order, ax, canvas, plot_line_
     :param overlim_y: if extrapolate the y limits by 10% or not.
     :param enable_lim: enable or disable to change the plot range.
     :param color: set the color of the line plot.
+    :param draw: redraw the canvas. False when several lines are plotted at once.
     :return: the actualized ``plot_line_refer`` array.
     """
 
@@ -342,59 +301,25 @@ def plot_spec_ui(spec_fit_arr, folder, elem, lamb, order, ax, canvas, plot_line_
         ax.set_xlim(lims_x[0], lims_x[1])
         ax.set_ylim(lims_y[0], lims_y[1])
 
-    canvas.draw()
+    if draw:
+        canvas.draw()
 
     return plot_line_refer
 
 
-def check_order(elem):
-    """
-    | Check if the current element has any type of order written in the end of the string.
-    | Supported types are: roman numbers *(I, II, III...)* and western digits *(1, 2, 3...)*.
-
-    :param elem: the element string
-    :return: the element without the order and the order itself.
-    """
-
-    if len(elem) == 1:
-        return elem, ""
-
-    if elem[1].isdigit() or elem[1] == "I" or elem[1] == "V" or elem[1] == "X" or elem[1] == " ":
-        if elem[1] == " ":
-            order = elem[2:]
-        else:
-            order = elem[1:]
-        elem = elem[0]
-    else:
-        if len(elem) == 2:
-            return elem, ""
-        if elem[2] == " ":
-            order = elem[3:]
-        else:
-            order = elem[2:]
-        elem = elem[0:2]
-
-    return elem, order
-
-
-def plot_abund_nofit(elem, lamb, abundplot, refer_fl, folder, type_synth,
-                     cut_val=None, canvas=None, ax=None, plot_line_refer=None,
-                     opt_pars=None):
+def abund_nofit_spectrum(elem, lamb, abundplot, refer_fl, type_synth, cut_val=None, opt_pars=None, cancel_event=None):
     """
-    Plot in the GUI the specified parameters.
+    Get the spectrum of a line with the specified parameters, without any fit.
 
     :param elem: current element.
     :param lamb: current wavelength.
     :param abundplot: abundance to be plotted.
     :param refer_fl: reference abundance dataframe.
-    :param folder: directory to save.
     :param type_synth: type of the current synthetics spectrum generator.
     :param cut_val: range to plot.
-    :param canvas: canvas to plot.
-    :param ax: ax to plot.
-    :param plot_line_refer: array to save the reference label of the plots.
     :param opt_pars: parameters for the convolution, wavelength shift and continuum.
-    :return: the actualized ``plot_line_refer`` array.
+    :param cancel_event: event (like ``threading.Event``) set to cancel the TurboSpectrum synthesis.
+    :return: the element, its order, the wavelength and the spectrum, or None if the method is unknown.
     """
 
     if type_synth[0] == "TurboSpectrum":
@@ -421,35 +346,106 @@ def plot_abund_nofit(elem, lamb, abundplot, refer_fl, folder, type_synth,
     elif type_synth[0] == "TurboSpectrum":
         tf.change_abund_configfl(config_fl, elem, find=False, abund=abundplot)
         tf.change_spec_range_configfl(config_fl, lamb, cut_val[3])
-        tf.run_configfl(config_fl)
-        # Return the Turbospectrum2019 configuration file to original abundance value
-        tf.change_abund_configfl(config_fl, elem, find=False, abund=abund_val_refer)
-
-        spec_conv = pd.read_csv(conv_name, header=None, delimiter=r"\s+")
+        try:
+            spec_conv = tf.synthesize(config_fl, conv_name, cancel_event=cancel_event)
+        finally:
+            # Return the Turbospectrum2019 configuration file to original abundance value
+            tf.change_abund_configfl(config_fl, elem, find=False, abund=abund_val_refer)
 
         # noinspection PyTypeChecker
         spec_fit = ff.spec_operations(spec_conv.copy(), lamb_desloc=opt_pars[0], continuum=opt_pars[1],
                                       convol=opt_pars[2])
     else:
+        return None
+
+    return elem, order, lamb, spec_fit
+
+
+def plot_abund_nofit(elem, lamb, abundplot, refer_fl, folder, type_synth,
+                     cut_val=None, canvas=None, ax=None, plot_line_refer=None,
+                     opt_pars=None):
+    """
+    Plot in the GUI the specified parameters.
+
+    :param elem: current element.
+    :param lamb: current wavelength.
+    :param abundplot: abundance to be plotted.
+    :param refer_fl: reference abundance dataframe.
+    :param folder: directory to save.
+    :param type_synth: type of the current synthetics spectrum generator.
+    :param cut_val: range to plot.
+    :param canvas: canvas to plot.
+    :param ax: ax to plot.
+    :param plot_line_refer: array to save the reference label of the plots.
+    :param opt_pars: parameters for the convolution, wavelength shift and continuum.
+    :return: the actualized ``plot_line_refer`` array.
+    """
+
+    line = abund_nofit_spectrum(elem, lamb, abundplot, refer_fl, type_synth, cut_val=cut_val, opt_pars=opt_pars)
+    if line is None:
         return plot_line_refer
 
-    spec_fit_arr = [spec_fit]
-    plot_line_refer = plot_spec_ui(spec_fit_arr, folder, elem, lamb, order, ax, canvas, plot_line_refer)
+    elem, order, lamb, spec_fit = line
+    plot_line_refer = plot_spec_ui([spec_fit], folder, elem, lamb, order, ax, canvas, plot_line_refer)
 
     return plot_line_refer
 
 
+def show_previous(found_val, folder, ui, canvas, ax, plot_line_refer):
+    """
+    Show the previous results in the abundance table and their saved fits in the plot.
+
+    :param found_val: dataframe with the previous results.
+    :param folder: directory of the results.
+    :param ui: main GUI QT object.
+    :param canvas: canvas to plot.
+    :param ax: ax to plot.
+    :param plot_line_refer: array to save the reference label of the plots.
+    """
+
+    curves = FitCurves.load(folder)
+    ui.abundancetable.setRowCount(0)
+    for i in range(len(found_val)):
+        elem = found_val.iloc[i, 0]
+        lamb = float(found_val.iloc[i, 1])
+
+        elem, order = check_order(elem)
+
+        ui.abundancetable.insertRow(i)
+        ui.abundancetable.setItem(i, 0, QtWidgets.QTableWidgetItem(str(elem)+str(order)))
+        ui.abundancetable.setItem(i, 1, QtWidgets.QTableWidgetItem(str(lamb)))
+        for data in read_fit_curves(folder, elem+order, lamb, curves=curves):
+            ind = plot_line_refer[(plot_line_refer["elem"] == elem + order) &
+                                  (plot_line_refer["wave"] == lamb)].index
+            for line in plot_line_refer.loc[ind, "refer"]: line.remove()
+            plot_line_refer.drop(ind, inplace=True)
+            plot_line_refer.reset_index(drop=True, inplace=True)
+
+            lineplot = ax.plot(data.iloc[:, 0], data.iloc[:, 1], "--", linewidth=1.5)
+            axvlineplot = ax.axvline(lamb, ls="-.", c="red", linewidth=.5)
+            plot_line_refer.loc[len(plot_line_refer)] = {"elem": elem+order, "wave": lamb,
+                                                         "refer": lineplot[0]}
+            plot_line_refer.loc[len(plot_line_refer)] = {"elem": elem+order, "wave": lamb,
+                                                         "refer": axvlineplot}
+        canvas.draw()
+
+
 def fit_abundance(linelist, spec_obs, refer_fl, folder, type_synth, cut_val=None,
                   abund_lim_df=1., restart=False, save_name="found_values.csv",
                   ui=None, canvas=None, ax=None, plot_line_refer=None,
                   opt_pars=None, repfit=2, max_iter=None, convovbound=None,
                   contpars=None, wavebound=None, only_abund_ind=None,
-                  spec_count=None, spec_iter=None):
+                  spec_count=None, spec_iter=None, warm_start=None, workers=1, merge_windows=False,
+                  synth_workers=1, spectra_workers=1, settings=None, report=None, batch_output=False,
+                  cancel_event=None):
     """
-    Main function to analyse the spectrum and find the fit values for it
+    Main function to analyse the spectrum and find the fit values for it.
+    The fit itself is done by ``fit_engine.fit_lines`` (or ``fit_engine.fit_spectra`` for a list
+    of spectra); this function resumes the previous results, saves them after each line in the
+    ``results_store.ResultsStore`` and shows them in the GUI. The CSV file is written at the end.
 
     :param linelist: linelist dataframe.
-    :param spec_obs: spectrum data.
+    :param spec_obs: spectrum data, or a list of spectra to fit them at the same time in worker processes.
     :param refer_fl: reference abundace dataframe.
     :param folder: directory to save.
     :param type_synth: type of the current synthetics spectrum generator.
@@ -457,7 +453,7 @@ def fit_abundance(linelist, spec_obs, refer_fl, folder, type_synth, cut_val=None
     :param abund_lim_df: default value of the range of the allowed abundance.
     :param restart: if it should ignore past results in the database.
     :param save_name: file name of the previous results.
-    :param ui: main GUI QT object.
+    :param ui: main GUI QT object. If None, the default settings of ``fit_engine.FitConfig`` are used.
     :param canvas: canvas to plot.
     :param ax: ax to plot.
     :param plot_line_refer: array to save the reference label of the plots.
@@ -470,33 +466,51 @@ def fit_abundance(linelist, spec_obs, refer_fl, folder, type_synth, cut_val=None
     :param only_abund_ind: change only abundance without fitting other parameters at this index.
     :param spec_count: defines the total number of spectra to be analysed.
     :param spec_iter: defines the current spectrum index.
+    :param warm_start: ``fit_functions.WarmStart`` object to seed the Wavelength Shift and
+                       Convolution fit from the neighbouring lines and previous spectra.
+    :param workers: number of worker processes to fit the lines in the TurboSpectrum mode.
+    :param merge_windows: share the TurboSpectrum syntheses of the continuum windows of nearby lines
+                          (see ``turbospec_functions.SharedWindows``). Only used when fitting serially.
+    :param synth_workers: number of simultaneous independent TurboSpectrum syntheses of a line, like
+                          the grid of the emulator. Only used when fitting serially.
+    :param spectra_workers: number of worker processes when ``spec_obs`` is a list of spectra.
+    :param settings: other ``fit_engine.FitConfig`` fields, like the ones of ``ui_fit_settings``.
+    :param report: function called as ``report(event, info)`` with the events of ``fit_engine.fit_lines``,
+                   instead of updating the GUI. The results are saved, but not plotted. If it returns
+                   true, the fit is cancelled. It allows the fit to run outside the GUI thread (see ``FitThread``).
+    :param batch_output: keep the fitted curves in memory and write them together (see ``results_store.FitCurves``)
+                         instead of a CSV file (or a PDF plot without the GUI) for each line.
+    :param cancel_event: event (like ``threading.Event``) set to cancel the TurboSpectrum syntheses.
     :return: dataframe with the results of the fit, the actualized
              ``ax`` array and the actualized ``plot_line_refer`` array.
     """
 
-    if type_synth[0] == "TurboSpectrum":
-        conv_name = type_synth[1]
-        config_fl = type_synth[2]
-    else:
-        conv_name = None
-        config_fl = None
-
     # For each fit parameter, a spectrum range can be selected
     # a value of 5, will select a total of 10 Angstroms with the element line wavelength in the middle
     if cut_val is None:
         # spec range vals for [continuum, convolution, abundance, plot]
         cut_val = [10/2, 3/2, .4/2, 1/2]
 
-    columns_names = ["Element", "Lambda (A)", "Lamb Shift", "Continuum", "Convolution",
-                     "Refer Abundance", "Fit Abundance", "Differ", "Chi", "Equiv Width Obs (A)",
-                     "Equiv Width Fit (A)"]
+    columns_names = result_columns
+    multiple = isinstance(spec_obs, list)
+    spec_index = spec_iter if spec_iter is not None else 0
 
-    contdisbool = False if ui.contdisabled == QtCore.Qt.CheckState.Unchecked else True
+    fl_name = Path(folder).joinpath(save_name)
+    store = ResultsStore(fl_name, columns=columns_names)
 
     if restart:
+        store.reset()
         found_val = pd.DataFrame(columns=columns_names)
+        linelists = [linelist] * len(spec_obs) if multiple else None
     else:
-        linelist, found_val = open_previous(linelist, columns_names, fl_name=Path(folder).joinpath(save_name))
+        if multiple:
+            # Each spectrum resumes from its own previous results
+            linelists = [open_previous(linelist, columns_names, fl_name=fl_name, spectrum=k+1)[0]
+                         for k in range(len(spec_obs))]
+            found_val = open_previous([], columns_names, fl_name=fl_name)[1]
+        else:
+            linelist, found_val = open_previous(linelist, columns_names, fl_name=fl_name,
+                                                spectrum=None if only_abund_ind is not None else spec_index+1)
 
         if only_abund_ind is not None:
             linelist = pd.DataFrame(columns=[0, 1])
@@ -504,279 +518,51 @@ def fit_abundance(linelist, spec_obs, refer_fl, folder, type_synth, cut_val=None
                                found_val.loc[only_abund_ind, "Lambda (A)"]]
 
         if ui is not None:
-            ui.abundancetable.setRowCount(0)
-            for i in range(len(found_val)):
-                elem = found_val.iloc[i, 0]
-                lamb = float(found_val.iloc[i, 1])
-
-                elem, order = check_order(elem)
-
-                ui.abundancetable.insertRow(i)
-                ui.abundancetable.setItem(i, 0, QtWidgets.QTableWidgetItem(str(elem)+str(order)))
-                ui.abundancetable.setItem(i, 1, QtWidgets.QTableWidgetItem(str(lamb)))
-                path = Path(folder).joinpath("On_time_Plots")
-                count = 0
-                while True:
-                    file = path.joinpath("fit_{}_{}_ang_{}.csv".format(elem+order, lamb, count + 1))
-
-                    if os.path.isfile(file):
-                        data = pd.read_csv(file)
-                        count += 1
-
-                        ind = plot_line_refer[(plot_line_refer["elem"] == elem + order) &
-                                              (plot_line_refer["wave"] == lamb)].index
-                        for line in plot_line_refer.loc[ind, "refer"]: line.remove()
-                        plot_line_refer.drop(ind, inplace=True)
-                        plot_line_refer.reset_index(drop=True, inplace=True)
-
-                        lineplot = ax.plot(data.iloc[:, 0], data.iloc[:, 1], "--", linewidth=1.5)
-                        axvlineplot = ax.axvline(lamb, ls="-.", c="red", linewidth=.5)
-                        plot_line_refer.loc[len(plot_line_refer)] = {"elem": elem+order, "wave": lamb,
-                                                                     "refer": lineplot[0]}
-                        plot_line_refer.loc[len(plot_line_refer)] = {"elem": elem+order, "wave": lamb,
-                                                                     "refer": axvlineplot}
-                    else:
-                        break
-                canvas.draw()
-
-    if opt_pars is None:
-        continuum, cont_err, cont_func = ff.fit_continuum(spec_obs,
-                                                          contpars=contpars,
-                                                          iterac=max_iter[0],
-                                                          method=ui.contmethodind,
-                                                          contdisabled=contdisbool,
-                                                          medianwindow=ui.medianwindow,
-                                                          hardvalue=ui.contfixedvalue)
-    else:
-        continuum = None
+            show_previous(found_val, folder, ui, canvas, ax, plot_line_refer)
 
-    input_opt_pars = opt_pars
+    rows = found_val.values.tolist()
+    curves = FitCurves(folder) if batch_output else None
 
-    # For each line in the linelist file
-    for i in range(len(linelist)):
-        elem = linelist.iloc[i][0]
-        lamb = float(linelist.iloc[i][1])
+    settings = dict(settings or {})
+    settings.update({"cut_val": cut_val, "abund_lim": abund_lim_df, "opt_pars": opt_pars, "repfit": repfit,
+                     "max_iter": max_iter, "convovbound": convovbound, "wavebound": wavebound, "contpars": contpars,
+                     "workers": workers, "merge_windows": merge_windows, "synth_workers": synth_workers})
+    if ui is not None:
+        settings.update(ui_fit_settings(ui))
+    config = FitConfig(type_synth, **{key: value for key, value in settings.items() if value is not None})
 
-        opt_pars = input_opt_pars
+    if ui is not None:
+        ui.abundancelabel.setText("Depth" if type_synth[0] == "Equivalent Width" else "Abundance")
 
-        if ui is not None:
-            ui.linedefvalue.setText("Element {}, line {}".format(elem, lamb))
-            # Allow QT to actualize the UI while in the loop
-            QtCore.QCoreApplication.processEvents()
-            if ui.stop_state:
-                ui.stop_state = False
-                return found_val, ax, plot_line_refer
-
-        msg = ("Analysing the element {} for lambda {}. Line {} out of {} "
-               "for spectrum {} out of {}.").format(elem, lamb, i+1, len(linelist),
-                                                    spec_iter+1, spec_count)
-        log_write(folder, msg)
+    def show_result(i, total, row, result):
+        nonlocal plot_line_refer
 
-        elem, order = check_order(elem)
+        elem, order = check_order(row[0])
+        lamb = row[1]
 
-        # Try to find element abundance reference. If not found, 0 is used.
-        try:
-            abund_val_refer = float(refer_fl.loc[elem, "value"]) if not refer_fl.loc[elem].isnull().item() else 0
-        except KeyError:
-            abund_val_refer = 0
-
-        abund_lim = abund_lim_df if abund_val_refer != 0 else 3
-
-        # Check whether the element exists in turbospectrum config file
-        if type_synth[0] == "TurboSpectrum" and not tf.check_elem_configfl(config_fl, elem):
-            print("Element not in TurboSpectrum Configuration file")
-            continue
-        # If the lamb is not between the range of the spec, skip the iteration
-        if not spec_obs.iloc[0][0] <= lamb <= spec_obs.iloc[-1][0]:
-            print("Wavelength not in the range of the spectrum.")
-            continue
-        # If continuum, conv, abund or plot range to fit is smaller than 0, skip the iteration
-        if len(ff.cut_spec(spec_obs, lamb, cut_val=cut_val[0])) <= 1:
-            print("Continuum range smaller than 0.")
-            continue
-        elif len(ff.cut_spec(spec_obs, lamb, cut_val=cut_val[1])) <= 1:
-            print("Convolution range smaller than 0.")
-            continue
-        elif len(ff.cut_spec(spec_obs, lamb, cut_val=cut_val[2])) <= 1:
-            print("Abundance range smaller than 0.")
-            continue
-        elif len(ff.cut_spec(spec_obs, lamb, cut_val=cut_val[3])) <= 1:
-            print("Plot range smaller than 0.")
-            continue
-
-        if max_iter is None:
-            max_iter = [100, 10]
-
-        # arrumar segundo espectro overwriting os valores bons do primeiro
-        chi, equiv_width_obs, equiv_width_fit = 0, 0, 0
-        par = [abund_val_refer]
-        spec_fit = [[], []]
-        for repeat in range(repfit):
-            # Fit of lambda shift, continuum and convolution
-            spec_obs_cut = ff.cut_spec(spec_obs, lamb, cut_val=cut_val[0])
-
-            if type_synth[0] == "Equivalent Width":
-                if opt_pars is None:
-                    continuum_local, cont_err_local, cont_func_local = ff.fit_continuum(spec_obs_cut,
-                                                                                        contpars=contpars,
-                                                                                        iterac=max_iter[0],
-                                                                                        method=ui.contmethodind,
-                                                                                        contdisabled=contdisbool,
-                                                                                        medianwindow=ui.medianwindow,
-                                                                                        hardvalue=ui.contfixedvalue)
-                    opt_pars, chi, spec_fit = vf.optimize_spec(spec_obs_cut, type_synth, lamb, continuum_local,
-                                                               iterac=max_iter[1], convovbound=convovbound,
-                                                               wavebound=wavebound)
-                if ui is not None:
-                    ui.abundancelabel.setText("Depth")
-            elif type_synth[0] == "TurboSpectrum":
-                tf.change_spec_range_configfl(config_fl, lamb, cut_val[0])
-                tf.run_configfl(config_fl)
-                spec_conv = pd.read_csv(conv_name, header=None, delimiter=r"\s+")
-                if ui is not None:
-                    ui.abundancelabel.setText("Abundance")
-
-                if opt_pars is None:
-                    opt_pars = tf.optimize_spec(spec_obs_cut, spec_conv, lamb, cut_val, continuum,
-                                                init=opt_pars, iterac=max_iter[1], convovbound=convovbound,
-                                                wavebound=wavebound)
-            # opt_pars = [0,0,0]
-
-            msg = "\n\tLamb Shift:\t\t{:.4f}\n".format(opt_pars[0])
-            msg += "\tContinuum:\t\t{:.4f}\n".format(opt_pars[1])
-            msg += "\tConvolution:\t\t{:.4f}\n".format(opt_pars[2])
-
-            if ui is not None:
-                ui.lambshifvalue.setValue(opt_pars[0])
-                ui.continuumvalue.setValue(opt_pars[1])
-                ui.convolutionvalue.setValue(opt_pars[2])
-                # Allow QT to actualize the UI while in the loop
-                QtCore.QCoreApplication.processEvents()
-                if ui.stop_state:
-                    ui.stop_state = False
-                    return found_val, ax, plot_line_refer
-
-            # Fit of abundance
-            spec_obs_cut = ff.cut_spec(spec_obs, lamb, cut_val=cut_val[3])
-            if type_synth[0] == "Equivalent Width":
-                par, chi, spec_fit = vf.optimize_abund(spec_obs_cut, type_synth, lamb, opt_pars, iterac=max_iter[2])
-            elif type_synth[0] == "TurboSpectrum":
-                tf.change_spec_range_configfl(config_fl, lamb, cut_val[3])
-
-                par, chi, spec_fit = tf.optimize_abund(spec_obs_cut, config_fl, conv_name, elem, opt_pars, par,
-                                                       abund_lim, iterac=max_iter[2])
-
-            msg += "\tAbundance:\t\t{:.4f}".format(par[0])
-            log_write(folder, msg)
-
-            if ui is not None:
-                ui.abundancevalue.setValue(par[0])
-                # Allow QT to actualize the UI while in the loop
-                QtCore.QCoreApplication.processEvents()
-                if ui.stop_state:
-                    ui.stop_state = False
-                    return found_val, ax, plot_line_refer
-
-            # Fit of Equivalent Width Observed Spectrum
-            # noinspection PyUnresolvedReferences
-            cont_level = ff.fit_continuum(spec_obs_cut,
-                                          contpars=contpars,
-                                          iterac=max_iter[0],
-                                          method=ui.contmethodind,
-                                          contdisabled=contdisbool,
-                                          medianwindow=ui.medianwindow,
-                                          hardvalue=ui.contfixedvalue)[2]
-            spec1d = Spectrum(spectral_axis=np.asarray(spec_obs_cut[0]) * u.AA,
-                                flux=np.asarray(spec_obs_cut[1]) * u.dimensionless_unscaled)
-            spec1d = spec1d / cont_level
-
-            # Get the minimum and maximum range of the line to apply the equivalent width function
-            min_line, max_line = ff.line_boundaries(spec_obs_cut, lamb, threshold=0.98, contpars=contpars,
-                                                    iterac=max_iter[0])
-
-            if max_line < len(spec_obs_cut)-10:
-                max_line += 10
-            else:
-                max_line = len(spec_obs_cut) - 1
-
-            if min_line > 10:
-                min_line -= 10
-            else:
-                min_line = 0
-
-            region = SpectralRegion(spec_obs_cut.iloc[min_line][0] * u.AA,
-                                    spec_obs_cut.iloc[max_line][0] * u.AA)
-
-            equiv_width_obs = equivalent_width(spec1d, regions=region)
-            # noinspection PyUnresolvedReferences
-            equiv_width_obs = np.float16(equiv_width_obs / u.AA)
-
-            # Fit of Equivalent Width Fitted Spectrum
-            # noinspection PyUnresolvedReferences
-            cont_level = ff.fit_continuum(spec_fit,
-                                          contpars=contpars,
-                                          iterac=max_iter[0],
-                                          method=ui.contmethodind,
-                                          contdisabled=contdisbool,
-                                          medianwindow=ui.medianwindow,
-                                          hardvalue=ui.contfixedvalue)[2]
-            spec1d = Spectrum(spectral_axis=np.asarray(spec_fit[0]) * u.AA,
-                                flux=np.asarray(spec_fit[1]) * u.dimensionless_unscaled)
-            spec1d = spec1d / cont_level
-
-            # Get the minimum and maximum range of the line to apply the equivalent width function
-            min_line, max_line = ff.line_boundaries(spec_fit, lamb, threshold=0.98, contpars=contpars,
-                                                    iterac=max_iter[0])
-
-            if max_line < len(spec_obs_cut)-10:
-                max_line += 10
-            else:
-                max_line = len(spec_obs_cut) - 1
-
-            if min_line > 10:
-                min_line -= 10
-            else:
-                min_line = 0
-
-            region = SpectralRegion(spec_fit.iloc[min_line][0] * u.AA,
-                                    spec_fit.iloc[max_line][0] * u.AA)
-
-            equiv_width_fit = equivalent_width(spec1d, regions=region)
-            # noinspection PyUnresolvedReferences
-            equiv_width_fit = np.float16(equiv_width_fit / u.AA)
-
-        index_append = len(found_val) if only_abund_ind is None else only_abund_ind
-        found_val.loc[index_append] = [elem+order, lamb, opt_pars[0], opt_pars[1], opt_pars[2], abund_val_refer,
-                                       par[0], np.abs(par[0]-abund_val_refer), "{:.4e}".format(chi),
-                                       "{:.4e}".format(equiv_width_obs), "{:.4e}".format(equiv_width_fit)]
-
-        # Plot of data
-        spec_obs_cut = ff.cut_spec(spec_obs, lamb, cut_val=cut_val[3])
-        if type_synth[0] == "Equivalent Width":
-            func = vf.find_func(type_synth[1])
-            x = np.linspace(min(spec_obs_cut.iloc[:, 0]), max(spec_obs_cut.iloc[:, 0]), 1000)
-            spec_fit = pd.DataFrame({0: x, 1: func(x, b=opt_pars[0]+lamb, c=opt_pars[2], a=par[0], d=opt_pars[1])})
-        elif type_synth[0] == "TurboSpectrum":
-            tf.change_abund_configfl(config_fl, elem, find=False, abund=par[0])
-            tf.change_spec_range_configfl(config_fl, lamb, cut_val[3])
-            tf.run_configfl(config_fl)
-            # Return the Turbospectrum2019 configuration file to original abundance value
-            tf.change_abund_configfl(config_fl, elem, find=False, abund=abund_val_refer)
-
-            spec_conv = pd.read_csv(conv_name, header=None, delimiter=r"\s+")
+        # Save the line result in the results store
+        if only_abund_ind is None:
+            rows.append(row)
+            store.append(row)
+        else:
+            rows[only_abund_ind] = row
+            store.replace(only_abund_ind, row)
 
-            # noinspection PyTypeChecker
-            spec_fit = ff.spec_operations(spec_conv.copy(), lamb_desloc=opt_pars[0], continuum=opt_pars[1],
-                                          convol=opt_pars[2])
+        if curves is not None:
+            curves.add(elem+order, lamb, [result["spec_fit"]])
 
-        if ui is None:
-            plot_spec(spec_obs_cut, spec_conv, spec_fit, lamb, elem+order, folder)
-        else:
-            spec_fit_arr = [spec_fit]
-            plot_line_refer = plot_spec_ui(spec_fit_arr, folder, elem, lamb, order, ax, canvas, plot_line_refer)
+        if ui is None and report is None:
+            if curves is None:
+                plot_spec(result["spec_obs_cut"], result["spec_conv"], result["spec_fit"], lamb, elem+order, folder)
+        elif ui is not None:
+            ui.lambshifvalue.setValue(row[2])
+            ui.continuumvalue.setValue(row[3])
+            ui.convolutionvalue.setValue(row[4])
+            ui.abundancevalue.setValue(row[6])
 
-        # Write the line result to the csv file
-        found_val.to_csv(Path(folder).joinpath(save_name), index=False, float_format="%.4f")
+            spec_fit_arr = [result["spec_fit"]]
+            plot_line_refer = plot_spec_ui(spec_fit_arr, folder, elem, lamb, order, ax, canvas, plot_line_refer,
+                                           save=curves is None)
 
         if ui is not None:
             if only_abund_ind is None:
@@ -786,11 +572,76 @@ def fit_abundance(linelist, spec_obs, refer_fl, folder, type_synth, cut_val=None
                 ui.abundancetable.setItem(rowpos, 1, QtWidgets.QTableWidgetItem(str(lamb)))
 
             # linescurrent = ui.progressvalue.text().split("/")
-            ui.progressvalue.setText("{}/{}".format(i+1, len(linelist)))
+            ui.progressvalue.setText("{}/{}".format(i+1, total))
+
+    def progress(event, info):
+        if event == "result":
+            show_result(info["index"], info["total"], info["row"], info["result"])
+            if report is not None:
+                report(event, info)
+            return False
+        if report is not None:
+            return report(event, info)
+        if ui is None:
+            return False
+
+        # Show the current values and allow QT to actualize the UI while in the loop
+        if event == "line":
+            ui.linedefvalue.setText("Element {}, line {}".format(info["elem"] + info["order"], info["lamb"]))
+        elif event == "spec":
+            ui.lambshifvalue.setValue(info[0])
+            ui.continuumvalue.setValue(info[1])
+            ui.convolutionvalue.setValue(info[2])
+        elif event == "abund":
+            ui.abundancevalue.setValue(info[0])
+        QtCore.QCoreApplication.processEvents()
+        if ui.stop_state:
+            ui.stop_state = False
+            return True
+        return False
+
+    try:
+        if multiple:
+            # The curves of the observed and synthetic spectra are only needed for the plots of each line
+            plots = ui is None and report is None and curves is None
+            fit_spectra(spec_obs, linelists, refer_fl, config, folder=folder, callback=progress,
+                        warm_start=warm_start is not None, workers=spectra_workers,
+                        result_keys=("spec_obs_cut", "spec_conv", "spec_fit") if plots else ("spec_fit",))
+        else:
+            fit_lines(spec_obs, linelist, refer_fl, config, folder=folder, callback=progress, warm_start=warm_start,
+                      spec_index=spec_index, spec_count=spec_count if spec_count is not None else 1,
+                      cancel_event=cancel_event)
+    finally:
+        # Write the csv file once, with all the lines saved until here
+        store.export()
+        store.close()
+        if curves is not None:
+            curves.export()
+
+    found_val = pd.DataFrame(rows, columns=found_val.columns)
 
     return found_val, ax, plot_line_refer
 
 
+def ui_fit_settings(ui):
+    """
+    Read the fit settings of the GUI that are not arguments of ``fit_abundance``.
+
+    :param ui: main GUI QT object.
+    :return: dictionary with the ``fit_engine.FitConfig`` fields.
+    """
+
+    return {"contmethod": ui.contmethodind,
+            "contdisabled": ui.contdisabled != QtCore.Qt.CheckState.Unchecked,
+            "medianwindow": ui.medianwindow,
+            "contfixedvalue": ui.contfixedvalue,
+            "abund_method": ui.abundmethod,
+            "abund_validate": ui.abundvalidate,
+            "coarse_step": ui.coarsestep,
+            "repfit_tol": ui.repfittol,
+            "executor": ui.fitexecutor}
+
+
 def read_config(config_name):
     """
     Function to read the configuration file (previously necessary in
@@ -855,10 +706,13 @@ def create_basic_folder_structure(folder):
 
 def gui_call(spec_obs, ui, checkstate, canvas, ax, cut_val=None, plot_line_refer=None, opt_pars=None,
              repfit=2, abundplot=None, results_array=None, only_abund_ind=None, final_plot=False,
-             plot_type=None, single=None):
+             plot_type=None, single=None, on_finish=None):
     """
     Main function to be called from the GUI.
 
+    | The fit and the syntheses run in a ``FitThread``, so this function returns before they end.
+      The results are set in ``ui.results_array`` and ``ui.plot_line_refer`` when the run ends.
+
     :param spec_obs: spectrum data.
     :param ui: main GUI QT object.
     :param checkstate: QT checked state for checkboxes.
@@ -875,8 +729,8 @@ def gui_call(spec_obs, ui, checkstate, canvas, ax, cut_val=None, plot_line_refer
     :param final_plot: if it's meant to create the final plots instead of fitting.
     :param plot_type: type of the final plot to create.
     :param single: create a final plot to a single line or for all of them.
-    :return: the results of the fit, the actualized ``ax`` variable and the
-             actualized ``plot_line_refer`` variable.
+    :param on_finish: function called in the GUI thread when the run ends, after the GUI is released.
+    :return: the ``results_array``, ``ax`` and ``plot_line_refer`` given, as the run is not over yet.
     """
 
     # Time Counter
@@ -934,6 +788,24 @@ def gui_call(spec_obs, ui, checkstate, canvas, ax, cut_val=None, plot_line_refer
 
             return results_array, ax, plot_line_refer
 
+        # Persistent cache of the synthetic spectra
+        if not ui.synthcache:
+            tf.cache = None
+        elif tf.cache is None:
+            tf.enable_cache()
+
+        # Run only the bsyn stage of TurboSpectrum when the continuum opacity is cached
+        if not ui.opacitycache:
+            tf.opacity_cache = None
+        elif tf.opacity_cache is None:
+            tf.enable_opacity_cache()
+
+        # Give TurboSpectrum only the line data around each synthesis range
+        if not ui.trimlinelists:
+            tf.linelist_cache = None
+        elif tf.linelist_cache is None:
+            tf.enable_linelist_cache()
+
     if not final_plot:
         ui.methodsdatafittab.setCurrentIndex(2)
 
@@ -942,28 +814,91 @@ def gui_call(spec_obs, ui, checkstate, canvas, ax, cut_val=None, plot_line_refer
     wavebound = ui.wavebound
     contpars = ui.continuumpars
 
-    # Allow QT to actualize the UI while in the loop
-    QtCore.QCoreApplication.processEvents()
+    def finish():
+        if methodconfig[0] == "TurboSpectrum":
+            # Write the pending reference abundances back to the configuration file
+            tf.flush_configfl(methodconfig[2])
+
+        ui.gui_hold(False)
+
+        if final_plot:
+            ui.run.setDisabled(True)
+
+        # Time Counter
+        end = time.time()
+        dif = end - init
+        time_spent = "Time spent: {:.0f} h {:.0f} m {:.0f} s ({:.0f} s).".format(dif // 3600, (dif // 60) % 60,
+                                                                                 dif % 60, dif)
+        log_write(folder, time_spent)
+
+        msg = "Results saved at {}".format(folder)
+        log_write(folder, msg)
+
+        if on_finish is not None:
+            on_finish()
+
+    # The widgets are read here, the fit and the syntheses run in a FitThread
+    ui.stop_state = False
+    view = FitView(ui, canvas, ax, plot_line_refer, folder, only_abund_ind=only_abund_ind,
+                   batch_output=ui.batchoutput, redraw=ui.batchredraw if ui.batchoutput else 0)
 
     if abundplot is None and not final_plot:
+        warm_start = ff.WarmStart() if ui.warmstart and opt_pars is None else None
+        settings = ui_fit_settings(ui)
         spec_count = len(spec_obs)
-        for spec_iter, spec in enumerate(spec_obs):
-            results_array, ax, plot_line_refer = fit_abundance(linelist, spec, refer_fl, folder, methodconfig,
-                                                               restart=restart, ui=ui, canvas=canvas, ax=ax,
-                                                               cut_val=cut_val, plot_line_refer=plot_line_refer,
-                                                               opt_pars=opt_pars, repfit=repfit, max_iter=max_iter,
-                                                               convovbound=convovbound, contpars=contpars,
-                                                               wavebound=wavebound, only_abund_ind=only_abund_ind,
-                                                               spec_count=spec_count, spec_iter=spec_iter)
-            restart = False
+        parallel = ui.spectraworkers > 1 and spec_count > 1 and only_abund_ind is None
+
+        if not restart:
+            found_val = open_previous([], result_columns, fl_name=Path(folder).joinpath("found_values.csv"))[1]
+            show_previous(found_val, folder, ui, canvas, ax, plot_line_refer)
+        ui.abundancelabel.setText("Depth" if methodconfig[0] == "Equivalent Width" else "Abundance")
+
+        fit_args = {"refer_fl": refer_fl, "folder": folder, "type_synth": methodconfig, "cut_val": cut_val,
+                    "opt_pars": opt_pars, "repfit": repfit, "max_iter": max_iter, "convovbound": convovbound,
+                    "contpars": contpars, "wavebound": wavebound, "spec_count": spec_count,
+                    "warm_start": warm_start, "merge_windows": ui.mergewindows, "synth_workers": ui.synthworkers,
+                    "settings": settings}
+
+        def job(report, stop):
+            if parallel:
+                # All the spectra at the same time in worker processes, with their results in the same file
+                return fit_abundance(linelist, list(spec_obs), restart=restart, spectra_workers=ui.spectraworkers,
+                                     report=report, **fit_args)[0]
+
+            found_val = None
+            first = restart
+            for spec_iter, spec in enumerate(spec_obs):
+                found_val = fit_abundance(linelist, spec, restart=first, only_abund_ind=only_abund_ind,
+                                          spec_iter=spec_iter, workers=ui.fitworkers, report=report,
+                                          cancel_event=stop, **fit_args)[0]
+                first = False
+                if report("poll"):
+                    break
+            return found_val
+
+        def done(found_val):
+            if found_val is not None:
+                ui.results_array = found_val
+            # Each worker process has its own warm start
+            if warm_start is not None and not parallel:
+                log_write(folder, warm_start.summary())
+            finish()
     elif not final_plot:
         currow = ui.abundancetable.currentRow()
         currow = ui.abundancetable.rowCount() - 1 if currow == -1 else currow
         elem = ui.abundancetable.item(currow, 0).text()
         lamb = ui.abundancetable.item(currow, 1).text()
-        plot_line_refer = plot_abund_nofit(elem, lamb, abundplot, refer_fl, folder, methodconfig,
-                                           cut_val=cut_val, canvas=canvas, ax=ax, plot_line_refer=plot_line_refer,
-                                           opt_pars=opt_pars)
+
+        def job(report, stop):
+            return abund_nofit_spectrum(elem, lamb, abundplot, refer_fl, methodconfig, cut_val=cut_val,
+                                        opt_pars=opt_pars, cancel_event=stop)
+
+        def done(line):
+            if line is not None:
+                elem_plot, order, lamb_plot, spec_fit = line
+                ui.plot_line_refer = plot_spec_ui([spec_fit], folder, elem_plot, lamb_plot, order, ax, canvas,
+                                                  view.plot_line_refer)
+            finish()
     else:
         ap.folders_creation(folder)
 
@@ -985,46 +920,285 @@ def gui_call(spec_obs, ui, checkstate, canvas, ax, cut_val=None, plot_line_refer
                 ind = ui.abundancetable.currentRow()
                 res_to_send = results_array.iloc[[ind]]
 
-            ap.plot_lines(spec_obs,
-                          res_to_send,
-                          refer_fl,
-                          methodconfig,
-                          folder,
-                          cut_val=cut_val[3],
-                          abundance_shift=ui.abundshift.value(),
-                          ui=ui)
-        elif plot_type == "box":
-            ui.plotstab.setCurrentIndex(1)
-            ap.plot_abund_box(res_arr_copy, elements, folder, ui=ui)
-        elif plot_type == "hist":
-            ui.plotstab.setCurrentIndex(2)
-            if single:
-                ind = ui.abundancetable.currentRow()
-                elem = ui.results_array.Element.iloc[ind]
-                elem, order = check_order(elem)
-                elements = [elem]
-                # res_arr_copy = ui.res_arr_copy[ui.results_array.Element.str.contains(elem)]
+            view.abundance_shift = ui.abundshift.value()
+            ui.progressvalue.setText("{}/{}".format(0, len(res_to_send)))
+            synth_workers = ui.synthworkers
+
+            def job(report, stop):
+                # Sandboxes to run the syntheses of each line at the same time
+                pool = None
+                if methodconfig[0] == "TurboSpectrum":
+                    pool = tf.SynthesisPool(methodconfig[2], methodconfig[1], limit=synth_workers, cancel_event=stop)
+
+                try:
+                    for line in ap.line_plot_spectra(spec_obs, res_to_send, methodconfig, cut_val=cut_val[3],
+                                                     abundance_shift=view.abundance_shift, pool=pool):
+                        if report("plot", line):
+                            break
+                finally:
+                    if pool is not None:
+                        pool.cleanup()
+
+            def done(value):
+                finish()
+        else:
+            if plot_type == "box":
+                ui.plotstab.setCurrentIndex(1)
+                ap.plot_abund_box(res_arr_copy, elements, folder, ui=ui)
+            elif plot_type == "hist":
+                ui.plotstab.setCurrentIndex(2)
+                if single:
+                    ind = ui.abundancetable.currentRow()
+                    elem = ui.results_array.Element.iloc[ind]
+                    elem, order = check_order(elem)
+                    elements = [elem]
+                    # res_arr_copy = ui.res_arr_copy[ui.results_array.Element.str.contains(elem)]
+
+                bins = ui.histbinsvalue.value()
+                ap.plot_abund_hist(res_arr_copy, elements, folder, ui=ui, bins=bins)
+                ap.plot_differ_hist(res_arr_copy, elements, folder, ui=ui, bins=bins)
+
+            # Only drawing, nothing to run in a thread
+            finish()
+            return results_array, ax, plot_line_refer
 
-            bins = ui.histbinsvalue.value()
-            ap.plot_abund_hist(res_arr_copy, elements, folder, ui=ui, bins=bins)
-            ap.plot_differ_hist(res_arr_copy, elements, folder, ui=ui, bins=bins)
+    def failed(msg):
+        log_write(folder, "Error: {}".format(msg))
+        ui.show_error(msg)
+        finish()
 
-    ui.gui_hold(False)
+    thread = FitThread(job)
+    view.connect(thread, done, failed)
+    ui.fit_thread = thread
+    thread.start()
 
-    if final_plot:
-        ui.run.setDisabled(True)
+    return results_array, ax, plot_line_refer
 
-    # Time Counter
-    end = time.time()
-    dif = end - init
-    time_spent = "Time spent: {:.0f} h {:.0f} m {:.0f} s ({:.0f} s).".format(dif // 3600, (dif // 60) % 60,
-                                                                             dif % 60, dif)
-    log_write(folder, time_spent)
 
-    msg = "Results saved at {}".format(folder)
-    log_write(folder, msg)
+class FitThread(QtCore.QThread):
+    """
+    Thread to run a fit, or the syntheses of the final plots, without blocking the GUI.
 
-    return results_array, ax, plot_line_refer
+    | The ``job`` is called in the thread as ``job(report, stop)``. ``report(event, info)`` emits the
+      ``progress`` signal and returns true once the run is cancelled, so it is the callback of the fit.
+    | ``stop`` is the event set by :meth:`cancel`, given to the TurboSpectrum syntheses of the job as
+      their ``cancel_event`` so they are cancelled too.
+    | When the job ends, ``done`` is emitted with its returned value, or ``failed`` with the error message.
+
+    :param job: function to run in the thread.
+    """
+
+    progress = QtCore.pyqtSignal(str, object)
+    done = QtCore.pyqtSignal(object)
+    failed = QtCore.pyqtSignal(str)
+
+    def __init__(self, job):
+        super().__init__()
+        self.job = job
+        self.stop = threading.Event()
+
+    def cancel(self):
+        """
+        Cancel the run. It takes effect in the next event of the fit or before the next synthesis.
+        """
+
+        self.stop.set()
+
+    def report(self, event, info=None):
+        """
+        Send an event to the GUI thread.
+
+        :param event: name of the event. ``"poll"`` only checks the cancellation.
+        :param info: information of the event.
+        :return: true if the run was cancelled.
+        """
+
+        if event != "poll":
+            self.progress.emit(event, info)
+        return self.stop.is_set()
+
+    def run(self):
+        try:
+            value = self.job(self.report, self.stop)
+        except tf.SynthesisCancelled:
+            value = None
+        except Exception as err:
+            traceback.print_exc()
+            self.failed.emit("{}: {}".format(type(err).__name__, err))
+            return
+        self.done.emit(value)
+
+
+class FitView(QtCore.QObject):
+    """
+    Show the progress of a ``FitThread`` in the GUI. The events are queued and shown together by
+    a timer, so the canvas is drawn once for all the lines fitted in the meantime.
+
+    :param ui: main GUI QT object.
+    :param canvas: canvas to plot.
+    :param ax: ax to plot.
+    :param plot_line_refer: array to save the reference label of the plots.
+    :param folder: directory to save.
+    :param only_abund_ind: row of the abundance table when only the abundance of a line is fitted.
+    :param interval: interval between the updates of the GUI in milliseconds.
+    :param batch_output: keep the fitted curves in memory and write them together (see ``results_store.FitCurves``)
+                         instead of a CSV file for each line.
+    :param redraw: minimum interval between the draws of the canvas in milliseconds.
+    """
+
+    def __init__(self, ui, canvas, ax, plot_line_refer, folder, only_abund_ind=None, interval=200,
+                 batch_output=False, redraw=0):
+        super().__init__()
+        self.ui = ui
+        self.canvas = canvas
+        self.ax = ax
+        self.plot_line_refer = plot_line_refer
+        self.folder = folder
+        self.only_abund_ind = only_abund_ind
+        self.abundance_shift = .1
+        self.on_done = None
+        self.on_failed = None
+
+        self.curves = FitCurves(folder) if batch_output else None
+        self.redraw = redraw / 1000
+        self.last_draw = 0.
+        self.pending_draw = False
+
+        self.values = {}
+        self.results = []
+        self.plots = []
+        self.timer = QtCore.QTimer(self)
+        self.timer.setInterval(interval)
+        self.timer.timeout.connect(self.flush)
+
+    def connect(self, thread, on_done, on_failed):
+        """
+        Follow the events of a thread.
+
+        :param thread: the ``FitThread`` object.
+        :param on_done: function called with the value returned by the job, after the last update.
+        :param on_failed: function called with the error message.
+        """
+
+        self.on_done = on_done
+        self.on_failed = on_failed
+        thread.progress.connect(self.queue)
+        thread.done.connect(self.done)
+        thread.failed.connect(self.failed)
+        # Keep the view alive while the thread runs
+        thread.view = self
+
+    @QtCore.pyqtSlot(str, object)
+    def queue(self, event, info):
+        """
+        Queue an event of the thread.
+
+        :param event: name of the event.
+        :param info: information of the event.
+        """
+
+        if event == "result":
+            self.results.append(info)
+        elif event == "plot":
+            self.plots.append(info)
+        else:
+            # Only the last values of each stage are shown
+            self.values[event] = info
+
+        if not self.timer.isActive():
+            self.timer.start()
+
+    def flush(self, final=False):
+        """
+        Show the queued events.
+
+        :param final: last update of the run, the canvas is drawn and the fitted curves are written.
+        """
+
+        self.timer.stop()
+        ui = self.ui
+
+        if "line" in self.values:
+            info = self.values["line"]
+            ui.linedefvalue.setText("Element {}, line {}".format(info["elem"] + info["order"], info["lamb"]))
+        if "spec" in self.values:
+            ui.lambshifvalue.setValue(self.values["spec"][0])
+            ui.continuumvalue.setValue(self.values["spec"][1])
+            ui.convolutionvalue.setValue(self.values["spec"][2])
+        if "abund" in self.values:
+            ui.abundancevalue.setValue(self.values["abund"][0])
+        self.values = {}
+
+        for info in self.results:
+            row = info["row"]
+            elem, order = check_order(row[0])
+            lamb = row[1]
+
+            ui.lambshifvalue.setValue(row[2])
+            ui.continuumvalue.setValue(row[3])
+            ui.convolutionvalue.setValue(row[4])
+            ui.abundancevalue.setValue(row[6])
+
+            self.plot_line_refer = plot_spec_ui([info["result"]["spec_fit"]], self.folder, elem, lamb, order,
+                                                self.ax, self.canvas, self.plot_line_refer, draw=False,
+                                                save=self.curves is None)
+            if self.curves is not None:
+                self.curves.add(elem+order, lamb, [info["result"]["spec_fit"]])
+
+            if self.only_abund_ind is None:
+                rowpos = ui.abundancetable.rowCount()
+                ui.abundancetable.insertRow(rowpos)
+                ui.abundancetable.setItem(rowpos, 0, QtWidgets.QTableWidgetItem(str(elem)+str(order)))
+                ui.abundancetable.setItem(rowpos, 1, QtWidgets.QTableWidgetItem(str(lamb)))
+
+            ui.progressvalue.setText("{}/{}".format(info["index"]+1, info["total"]))
+
+        if self.results:
+            ui.plot_line_refer = self.plot_line_refer
+            self.pending_draw = True
+        self.results = []
+
+        if self.pending_draw:
+            if final or time.perf_counter() - self.last_draw >= self.redraw:
+                self.canvas.draw()
+                self.last_draw = time.perf_counter()
+                self.pending_draw = False
+            elif not self.timer.isActive():
+                # Draw the last lines later
+                self.timer.start()
+
+        if final and self.curves is not None:
+            self.curves.export()
+
+        # The final plots are drawn here, matplotlib can not draw them outside the GUI thread
+        for line in self.plots:
+            fig_path = ap.save_line_plot(line, self.folder, abundance_shift=self.abundance_shift)
+            if fig_path is not None:
+                print("{} of {} finished.".format(line["index"]+1, line["total"]))
+                ap.show_line_plot(ui, fig_path, line["index"], line["total"])
+        self.plots = []
+
+    @QtCore.pyqtSlot(object)
+    def done(self, value):
+        """
+        Show the last events and end the run.
+
+        :param value: the value returned by the job.
+        """
+
+        self.flush(final=True)
+        self.on_done(value)
+
+    @QtCore.pyqtSlot(str)
+    def failed(self, msg):
+        """
+        Show the last events and the error.
+
+        :param msg: the error message.
+        """
+
+        self.flush(final=True)
+        self.on_failed(msg)
 
 
 def main(args):
@@ -1050,8 +1224,9 @@ def main(args):
         os.mkdir(folder+"On_time_Plots")
 
     # Open some files
-    linelist = open_linelist_refer_fl(list_name)
-    refer_fl = open_linelist_refer_fl(refer_name)
+    linelist = open_linelist_refer_fl(list_name[0])
+    refer_fl = open_linelist_refer_fl(refer_name[0])
+    refer_fl = pd.DataFrame({"value": refer_fl[1].values}, index=refer_fl[0].values)
     # Function to open the observed spectrum file using PANDAS
     spec_obs = []
     for i in range(0, len(observed_name), 2):
@@ -1064,19 +1239,17 @@ def main(args):
 
     # Adjust parameters for each spectra declared
     # Caution: be aware of data overlay on the final csv file
-    for spec in spec_obs:
-        fit_abundance(linelist, spec, refer_fl, folder, type_synth,
-                      restart=False)
+    for spec_iter, spec in enumerate(spec_obs):
+        fit_abundance(linelist, spec, refer_fl, folder, type_synth, restart=False, spec_count=len(spec_obs),
+                      spec_iter=spec_iter)
+    tf.flush_configfl(config_fl)
 
     # Time Counter
     end = time.time()
     dif = end - init
     time_spent = "Time spent: {:.0f} h {:.0f} m {:.0f} s ({:.0f} s)".format(dif // 3600, (dif // 60) % 60, dif % 60,
                                                                             dif)
-
-    # noinspection PyTypeChecker
-    np.savetxt(folder+"log.txt", [time_spent], fmt="%s")
-    print(time_spent)
+    log_write(folder, time_spent)
 
 
 def args_menu(args):
@@ -240,10 +240,9 @@ def get_spectrum(fit_data, conv_name, config_fl, elem, abundance_shift=0., cut_v
     # Run the model with the desired abundance
     tf.change_spec_range_configfl(config_fl, lamb, cut_val)
     tf.change_abund_configfl(config_fl, elem, find=False, abund=abundance)
-    tf.run_configfl(config_fl)
 
-    # Read and cut the model spectrum to the desired range
-    spec = pd.read_csv(conv_name, header=None, delimiter=r"\s+")
+    # Run (or read from the cache) and cut the model spectrum to the desired range
+    spec = tf.synthesize(config_fl, conv_name)
     # spec = ab_fit.cut_spec(spec, lamb, cut_val/2)
 
     # Apply the fit resolutions to the spectra
@@ -253,6 +252,32 @@ def get_spectrum(fit_data, conv_name, config_fl, elem, abundance_shift=0., cut_v
     return spec
 
 
+def get_spectra(fit_data, pool, elem, abundance_shifts, cut_val=1., poll=None):
+    """
+    Function to get the synthetic spectra of several abundance shifts at the same time.
+
+    :param fit_data: pandas dataframe with the results.
+    :param pool: ``turbospec_functions.SynthesisPool`` object.
+    :param elem: element to be plotted.
+    :param abundance_shifts: list of overall shifts in abundance.
+    :param cut_val: range to plot.
+    :param poll: function called periodically while waiting for the syntheses.
+    :return: list with the final spectra.
+    """
+
+    # Get data from fit
+    lamb = fit_data["Lambda (A)"]
+    abundance = fit_data["Fit Abundance"]
+
+    requests = [{"lam_min": lamb - cut_val, "lam_max": lamb + cut_val, elem + "_ab": abundance + shift}
+                for shift in abundance_shifts]
+    specs = pool.synthesize_all(requests, poll=poll)
+
+    # Apply the fit resolutions to the spectra
+    return [ff.spec_operations(spec.copy(), lamb_desloc=fit_data["Lamb Shift"], continuum=fit_data.Continuum,
+                               convol=fit_data.Convolution) for spec in specs]
+
+
 def get_diff(spec1, spec2):
     """
     Get the difference of observed and synthetic spectrum.
@@ -286,36 +311,23 @@ def get_diff(spec1, spec2):
         return [lambs, sp2_interpol-sp1_interpol]
 
 
-def plot_lines(obs_specs, abund, refer_fl, type_synth, folder, cut_val=.5, abundance_shift=.1,
-               drop=0, ui=None):
+def line_plot_spectra(obs_specs, abund, type_synth, cut_val=.5, abundance_shift=.1, pool=None, poll=None):
     """
-    Plot the spectrum fit and the observed one
+    Get the spectra of the final plot of each line: the observed spectrum, the fit, the fit with the abundance
+    shifted up and down and the fit without the element. It does not draw anything, so it can run outside
+    the GUI thread.
 
     :param obs_specs: spectrum data.
     :param abund: abundance pandas object.
-    :param refer_fl: file name of the reference abundances file.
     :param type_synth: type of the current synthetics spectrum generator.
-    :param folder: directory to save.
     :param cut_val: range to plot the lines.
     :param abundance_shift: overall abundance shift.
-    :param drop: remove elements of the ``abund`` dataframe.
-    :param ui: the main ui class in the GUI.
+    :param pool: ``turbospec_functions.SynthesisPool`` object for the TurboSpectrum mode.
+    :param poll: function called periodically while waiting for the syntheses.
+    :return: generator with a dictionary for each line.
     """
 
-    if len(abund) > 1:
-        abund.drop(range(drop), inplace=True)
-
-    if ui is not None:
-        ui.progressvalue.setText("{}/{}".format(0, len(abund)))
-
     for i in range(len(abund)):
-        if ui is not None:
-            # Allow QT to actualize the UI while in the loop
-            QtCore.QCoreApplication.processEvents()
-            if ui.stop_state:
-                ui.stop_state = False
-                return
-
         elem = abund.Element.iloc[i]
         lamb = abund["Lambda (A)"].iloc[i]
         abundance = abund["Fit Abundance"].iloc[i]
@@ -331,21 +343,12 @@ def plot_lines(obs_specs, abund, refer_fl, type_synth, folder, cut_val=.5, abund
         spec_obs = ff.cut_spec(spec_obs, lamb, cut_val)
 
         if type_synth[0] == "TurboSpectrum":
-            spec_fit = get_spectrum(abund.iloc[i], type_synth[1], type_synth[2], elem)
-            spec_fit_under = get_spectrum(abund.iloc[i], type_synth[1], type_synth[2], elem,
-                                          abundance_shift=+abundance_shift)
-            spec_fit_above = get_spectrum(abund.iloc[i], type_synth[1], type_synth[2], elem,
-                                          abundance_shift=-abundance_shift)
-            spec_no = get_spectrum(abund.iloc[i], type_synth[1], type_synth[2], elem,
-                                   abundance_shift=-50)
-
-            # Write the refer value back
-            try:
-                abund_val_refer = float(refer_fl.loc[elem, "value"]) if not refer_fl.loc[elem].isnull().item() else 0
-            except KeyError:
-                abund_val_refer = 0
-
-            tf.change_abund_configfl(type_synth[2], elem, find=False, abund=abund_val_refer)
+            # The four syntheses are independent, so they run at the same time
+            spec_fit, spec_fit_under, spec_fit_above, spec_no = get_spectra(abund.iloc[i], pool, elem,
+                                                                            [0, +abundance_shift,
+                                                                             -abundance_shift, -50],
+                                                                            poll=poll)
+            # The sandboxes do not change the abundances of the configuration file
         elif type_synth[0] == "Equivalent Width":
             opt_pars = [abund["Lamb Shift"].iloc[i],
                         abund["Continuum"].iloc[i],
@@ -365,84 +368,167 @@ def plot_lines(obs_specs, abund, refer_fl, type_synth, folder, cut_val=.5, abund
         else:
             return
 
-        res_fit = get_diff(spec_obs, spec_fit)
-        res_fit_under = get_diff(spec_obs, spec_fit_under)
-        res_fit_above = get_diff(spec_obs, spec_fit_above)
-        res_no = get_diff(spec_obs, spec_no)
+        yield {"index": i, "total": len(abund), "elem": elem, "order": order, "lamb": lamb,
+               "abundance": abundance, "spec_obs": spec_obs, "spec_fit": spec_fit,
+               "spec_fit_under": spec_fit_under, "spec_fit_above": spec_fit_above, "spec_no": spec_no}
 
-        if res_fit == -1 or res_fit_under == -1 or res_fit_above == -1 or res_no == -1:
-            continue
 
-        max_lim = 1.05 * abs(max([max(res_fit[1], key=abs), max(res_fit_above[1], key=abs),
-                                  max(res_fit_under[1], key=abs), max(res_no[1], key=abs)], key=abs))
+def save_line_plot(line, folder, abundance_shift=.1):
+    """
+    Draw and save the final plot of a line.
 
-        plt.figure(figsize=(16, 9))
-        if order == "2":
-            plt.suptitle("{} II at {:.2f} \u212b".format(elem, lamb), fontsize=24)
-        elif order == "1":
-            plt.suptitle("{} I at {:.2f} \u212b".format(elem, lamb), fontsize=24)
-        else:
-            plt.suptitle("{} at {:.2f} \u212b".format(elem, lamb), fontsize=24)
+    :param line: dictionary with the spectra of the line (see ``line_plot_spectra``).
+    :param folder: directory to save.
+    :param abundance_shift: overall abundance shift.
+    :return: the path of the plot, or None if the spectra do not overlap.
+    """
 
-        # noinspection PyTypeChecker
-        plt.subplot(3, 1, (1, 2))
+    elem, order, lamb, abundance = line["elem"], line["order"], line["lamb"], line["abundance"]
+    spec_obs = line["spec_obs"]
+    spec_fit = line["spec_fit"]
+    spec_fit_above = line["spec_fit_above"]
+    spec_no = line["spec_no"]
 
-        plt.ylabel("Normalized Flux", fontsize=20)
+    res_fit = get_diff(spec_obs, spec_fit)
+    res_fit_under = get_diff(spec_obs, line["spec_fit_under"])
+    res_fit_above = get_diff(spec_obs, spec_fit_above)
+    res_no = get_diff(spec_obs, spec_no)
 
-        plt.xlim(min(spec_obs[0]), max(spec_obs[0]))
+    if res_fit == -1 or res_fit_under == -1 or res_fit_above == -1 or res_no == -1:
+        return None
 
-        plt.xticks(fontsize=0)
-        plt.yticks(fontsize=18)
+    max_lim = 1.05 * abs(max([max(res_fit[1], key=abs), max(res_fit_above[1], key=abs),
+                              max(res_fit_under[1], key=abs), max(res_no[1], key=abs)], key=abs))
 
-        plt.plot(spec_obs[0], spec_obs[1], "+", label="Data Point", markersize=10, color="black")
-        plt.axvline(x=lamb, color="red", linestyle=":", zorder=0, linewidth=1.8)
+    plt.figure(figsize=(16, 9))
+    if order == "2":
+        plt.suptitle("{} II at {:.2f} \u212b".format(elem, lamb), fontsize=24)
+    elif order == "1":
+        plt.suptitle("{} I at {:.2f} \u212b".format(elem, lamb), fontsize=24)
+    else:
+        plt.suptitle("{} at {:.2f} \u212b".format(elem, lamb), fontsize=24)
 
-        plt.plot(spec_fit[0], spec_fit[1], "-", label="A({}) {:.2f}".format(elem, abundance), linewidth=1.8,
-                 color="blue")
-        plt.fill_between(spec_fit[0], spec_fit_above[1], spec_fit_under[1], alpha=0.8, color="lightblue",
-                         label="A({}) {:.2f} \u00b1 {:.2f}".format(elem, abundance, abundance_shift))
-        plt.plot(spec_no[0], spec_no[1], "--", label="No {}".format(elem), linewidth=1.5, color="gray")
+    # noinspection PyTypeChecker
+    plt.subplot(3, 1, (1, 2))
 
-        plt.grid(zorder=1)
-        plt.legend(fontsize=18)
+    plt.ylabel("Normalized Flux", fontsize=20)
 
-        plt.subplot(313)
+    plt.xlim(min(spec_obs[0]), max(spec_obs[0]))
 
-        plt.xlabel("Wavelength (\u212b)", fontsize=20)
-        plt.ylabel("Residuals", fontsize=20)
+    plt.xticks(fontsize=0)
+    plt.yticks(fontsize=18)
 
-        plt.xlim(min(spec_obs[0]), max(spec_obs[0]))
-        plt.ylim(-max_lim, max_lim)
+    plt.plot(spec_obs[0], spec_obs[1], "+", label="Data Point", markersize=10, color="black")
+    plt.axvline(x=lamb, color="red", linestyle=":", zorder=0, linewidth=1.8)
 
-        plt.xticks(fontsize=18)
-        plt.yticks(fontsize=18)
+    plt.plot(spec_fit[0], spec_fit[1], "-", label="A({}) {:.2f}".format(elem, abundance), linewidth=1.8,
+             color="blue")
+    plt.fill_between(spec_fit[0], spec_fit_above[1], line["spec_fit_under"][1], alpha=0.8, color="lightblue",
+                     label="A({}) {:.2f} \u00b1 {:.2f}".format(elem, abundance, abundance_shift))
+    plt.plot(spec_no[0], spec_no[1], "--", label="No {}".format(elem), linewidth=1.5, color="gray")
 
-        plt.axhline(y=0, color="black")
-        plt.axvline(x=lamb, color="red", linestyle=":", zorder=0, linewidth=1.8)
+    plt.grid(zorder=1)
+    plt.legend(fontsize=18)
 
-        plt.plot(res_fit[0], res_fit[1], "-", linewidth=1.8, color="blue")
-        plt.fill_between(res_fit_above[0], res_fit_above[1], res_fit_under[1], alpha=0.8, color="lightblue")
-        plt.plot(res_no[0], res_no[1], "--", linewidth=1.5, color="gray")
+    plt.subplot(313)
 
-        plt.grid(zorder=1)
+    plt.xlabel("Wavelength (\u212b)", fontsize=20)
+    plt.ylabel("Residuals", fontsize=20)
 
-        plt.tight_layout()
-        plt.subplots_adjust(wspace=0, hspace=0)
-        main_path = Path(folder).joinpath("Abundance_Analysis", "Lines_Plot")
-        fig_path = main_path.joinpath("fit_{}_{}_ang.pdf".format(elem+order, lamb))
-        plt.savefig(fig_path)
-        plt.close()
+    plt.xlim(min(spec_obs[0]), max(spec_obs[0]))
+    plt.ylim(-max_lim, max_lim)
 
-        print("{} of {} finished.".format(i+1, len(abund)))
+    plt.xticks(fontsize=18)
+    plt.yticks(fontsize=18)
 
-        if ui is not None:
-            ui.progressvalue.setText("{}/{}".format(i + 1, len(abund)))
+    plt.axhline(y=0, color="black")
+    plt.axvline(x=lamb, color="red", linestyle=":", zorder=0, linewidth=1.8)
 
-            pixmap = QtGui.QPixmap(str(fig_path))
-            ui.linesplotimage.setPixmap(pixmap.scaled(ui.scale))
-            ui.linesplotimage.setFixedSize(ui.scale)
+    plt.plot(res_fit[0], res_fit[1], "-", linewidth=1.8, color="blue")
+    plt.fill_between(res_fit_above[0], res_fit_above[1], res_fit_under[1], alpha=0.8, color="lightblue")
+    plt.plot(res_no[0], res_no[1], "--", linewidth=1.5, color="gray")
 
-            QtCore.QCoreApplication.processEvents()
+    plt.grid(zorder=1)
+
+    plt.tight_layout()
+    plt.subplots_adjust(wspace=0, hspace=0)
+    main_path = Path(folder).joinpath("Abundance_Analysis", "Lines_Plot")
+    fig_path = main_path.joinpath("fit_{}_{}_ang.pdf".format(elem+order, lamb))
+    plt.savefig(fig_path)
+    plt.close()
+
+    return fig_path
+
+
+def show_line_plot(ui, fig_path, index, total):
+    """
+    Show the final plot of a line in the GUI.
+
+    :param ui: the main ui class in the GUI.
+    :param fig_path: path of the plot.
+    :param index: index of the line.
+    :param total: total number of lines.
+    """
+
+    ui.progressvalue.setText("{}/{}".format(index + 1, total))
+
+    pixmap = QtGui.QPixmap(str(fig_path))
+    ui.linesplotimage.setPixmap(pixmap.scaled(ui.scale))
+    ui.linesplotimage.setFixedSize(ui.scale)
+
+
+def plot_lines(obs_specs, abund, type_synth, folder, cut_val=.5, abundance_shift=.1,
+               drop=0, ui=None, synth_workers=None):
+    """
+    Plot the spectrum fit and the observed one
+
+    :param obs_specs: spectrum data.
+    :param abund: abundance pandas object.
+    :param type_synth: type of the current synthetics spectrum generator.
+    :param folder: directory to save.
+    :param cut_val: range to plot the lines.
+    :param abundance_shift: overall abundance shift.
+    :param drop: remove elements of the ``abund`` dataframe.
+    :param ui: the main ui class in the GUI.
+    :param synth_workers: number of simultaneous TurboSpectrum syntheses of a line. Default is the
+                          setting of the GUI, or the default of ``fit_engine.FitConfig`` without it.
+    """
+
+    if synth_workers is None:
+        synth_workers = ui.synthworkers if ui is not None else ab_fit.FitConfig.synth_workers
+
+    if len(abund) > 1:
+        abund.drop(range(drop), inplace=True)
+
+    if ui is not None:
+        ui.progressvalue.setText("{}/{}".format(0, len(abund)))
+
+    # Sandboxes to run the syntheses of each line at the same time
+    pool = None
+    if type_synth[0] == "TurboSpectrum":
+        pool = tf.SynthesisPool(type_synth[2], type_synth[1], limit=synth_workers)
+    poll = QtCore.QCoreApplication.processEvents if ui is not None else None
+
+    try:
+        for line in line_plot_spectra(obs_specs, abund, type_synth, cut_val=cut_val,
+                                      abundance_shift=abundance_shift, pool=pool, poll=poll):
+            fig_path = save_line_plot(line, folder, abundance_shift=abundance_shift)
+            if fig_path is None:
+                continue
+
+            print("{} of {} finished.".format(line["index"]+1, line["total"]))
+
+            if ui is not None:
+                show_line_plot(ui, fig_path, line["index"], line["total"])
+
+                # Allow QT to actualize the UI while in the loop
+                QtCore.QCoreApplication.processEvents()
+                if ui.stop_state:
+                    ui.stop_state = False
+                    return
+    finally:
+        if pool is not None:
+            pool.cleanup()
 
 
 def folders_creation(folder):
@@ -485,7 +571,6 @@ def main(args):
 
     fl_name = folder+"found_values.csv"  # result file
 
-    refer_fl = ab_fit.open_linelist_refer_fl(refer_name)
     spec_obs = ab_fit.open_spec_obs(observed_name)
 
     # Create necessary folders
@@ -498,7 +583,8 @@ def main(args):
     type_synth = ["TurboSpectrum", conv_name, config_fl]
 
     # Plot spectra graphics
-    plot_lines(spec_obs, abund, refer_fl, type_synth, folder)
+    plot_lines(spec_obs, abund, type_synth, folder)
+    tf.flush_configfl(config_fl)
 
     # Erase emission order and create an array with elements
     if order_sep == "1":
@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+"""
+| MEAFS Benchmarks
+| Matheus J. Castro
+
+| Timing of the performance sensitive parts of MEAFS.
+| Run with ``python -m meafs_code.scripts.benchmarks``.
+"""
+
+import pandas as pd
+import numpy as np
+import tempfile
+import time
+import sys
+import os
+
+from . import turbospec_functions as tf
+from . import fake_turbospec as ft
+from . import fit_functions as ff
+from . import fit_engine as fe
+
+
+def timeit(func, repeat=10):
+    """
+    Best time of several runs of a function.
+
+    :param func: function without arguments.
+    :param repeat: number of runs.
+    :return: the best time in seconds.
+    """
+
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+
+    return best
+
+
+def write_conv(fl_name, npoints, step=0.01, lamb=5000.):
+    """
+    Write a spectrum in the TurboSpectrum output format (wavelength, normalized and absolute flux).
+
+    :param fl_name: file name of the spectrum.
+    :param npoints: number of points.
+    :param step: wavelength step.
+    :param lamb: first wavelength.
+    """
+
+    x = lamb + step * np.arange(npoints)
+    y = 1 - 0.5 * np.exp(-(x - x.mean())**2 / (2 * 0.05**2))
+    np.savetxt(fl_name, np.c_[x, y, y * 1e15], fmt="%10.3f %11.5f %12.5e")
+
+
+def bench_read_spectrum(sizes=(1000, 100000), repeat=10):
+    """
+    Compare the readers of TurboSpectrum output spectra.
+
+    :param sizes: number of points of each spectrum, e.g. a typical line window and a large range.
+    :param repeat: number of runs of each reader.
+    :return: dataframe with the best times in milliseconds.
+    """
+
+    results = []
+    with tempfile.TemporaryDirectory() as folder:
+        for npoints in sizes:
+            conv_name = os.path.join(folder, "spec_{}.conv".format(npoints))
+            npy_name = os.path.join(folder, "spec_{}.npy".format(npoints))
+            write_conv(conv_name, npoints)
+            np.save(npy_name, tf.read_spectrum(conv_name).to_numpy().T)
+
+            readers = {"pandas.read_csv": lambda: pd.read_csv(conv_name, header=None, delimiter=r"\s+"),
+                       "read_spectrum": lambda: tf.read_spectrum(conv_name),
+                       "read_spectrum npy": lambda: tf.read_spectrum(npy_name),
+                       "read_spectrum npy mmap": lambda: tf.read_spectrum(npy_name, mmap=True)}
+
+            for name, reader in readers.items():
+                results.append({"Points": npoints, "Reader": name, "Time (ms)": 1e3 * timeit(reader, repeat)})
+
+    return pd.DataFrame(results)
+
+
+def fake_observed(type_synth, abundances, shift=0.01, convol=3., noise=0.002, step=0.02, seed=0):
+    """
+    Create an observed spectrum with the TurboSpectrum stand-in.
+
+    :param type_synth: the ``type_synth`` list of the stand-in (see ``fake_turbospec.create``).
+    :param abundances: dictionary with the true abundance of each element.
+    :param shift: wavelength shift.
+    :param convol: convolution in FWHM (in pixels).
+    :param noise: standard deviation of the Gaussian noise.
+    :param step: wavelength step of the observed spectrum.
+    :param seed: seed of the noise.
+    :return: the observed spectrum.
+    """
+
+    template = tf.get_template(type_synth[2])
+    reference = {name: template.get(name) for name in template.slots if name.endswith("_ab")}
+
+    for elem, value in abundances.items():
+        tf.change_abund_configfl(type_synth[2], elem, find=False, abund=value)
+    spec = tf.synthesize(type_synth[2], type_synth[1])
+    for name, value in reference.items():
+        template.set(name, value)
+
+    spec = ff.spec_operations(spec, lamb_desloc=shift, convol=convol)
+    x = np.arange(spec[0].iloc[0], spec[0].iloc[-1], step)
+    y = np.interp(x, spec[0], spec[1]) + np.random.default_rng(seed).normal(0, noise, len(x))
+
+    return pd.DataFrame({0: x, 1: y})
+
+
+def fit_stand_in(type_synth, spec_obs, continuum, folder, repfit=2, max_iter=(1000, 1000, 10),
+                 cut_val=(5, 1.5, .2, .5), contpars=(2, 8), **kwargs):
+    """
+    Fit every line of the stand-in (see ``fake_turbospec``).
+
+    :param type_synth: the ``type_synth`` list of the stand-in.
+    :param spec_obs: the observed spectrum.
+    :param continuum: overall continuum value of the spectrum.
+    :param folder: directory to save the log.
+    :param repfit: number of iterations of the main fit function.
+    :param max_iter: maximum allowed iterations of the continuum, spectrum and abundance fits.
+    :param cut_val: ranges to cut the spectrum.
+    :param contpars: the calibration values of the overall continuum fit method.
+    :param kwargs: other arguments of ``fit_engine.fit_line``.
+    :return: list with the ``fit_line`` results.
+    """
+
+    return [fe.fit_line(spec_obs, elem, "1", lamb, ft.default_abundances[elem], 0.3, type_synth, list(cut_val),
+                        continuum, folder, repfit=repfit, max_iter=list(max_iter), convovbound=[0, 5],
+                        wavebound=.2, contpars=list(contpars), **kwargs)
+            for elem, lamb, _ in ft.default_lines]
+
+
+def bench_turbospec_fit(methods=("nelder-mead", "brent", "emulator"), runtime=0.02, repfit=2,
+                        max_iter=(1000, 1000, 10), cut_val=(5, 1.5, .2, .5), contpars=(2, 8)):
+    """
+    Run the TurboSpectrum fit of every line of the stand-in (see ``fake_turbospec``) with each
+    abundance method, without the cache.
+
+    :param methods: abundance fit methods (see ``turbospec_functions.optimize_abund``).
+    :param runtime: artificial runtime of each synthesis in seconds.
+    :param repfit: number of iterations of the main fit function.
+    :param max_iter: maximum allowed iterations of the continuum, spectrum and abundance fits.
+    :param cut_val: ranges to cut the spectrum.
+    :param contpars: the calibration values of the overall continuum fit method.
+    :return: dataframe with the time, the number of syntheses and the mean abundance error.
+    """
+
+    results = []
+    tf.cache = None
+    with tempfile.TemporaryDirectory() as folder:
+        type_synth = ft.create(folder, runtime=runtime)
+        truth = {elem: value - 0.12 for elem, value in ft.default_abundances.items()}
+        spec_obs = fake_observed(type_synth, truth)
+        continuum = ff.fit_continuum(spec_obs, contpars=list(contpars), iterac=max_iter[0])[0]
+
+        for method in methods:
+            start = time.perf_counter()
+            fits = fit_stand_in(type_synth, spec_obs, continuum, folder, repfit=repfit, max_iter=max_iter,
+                                cut_val=cut_val, contpars=contpars, abund_method=method)
+
+            results.append({"Method": method, "Lines": len(fits),
+                            "Time (s)": time.perf_counter() - start,
+                            "Syntheses": sum(result["nsynth"] for result in fits),
+                            "Abundance Error": np.mean([abs(result["par"][0] - truth[elem])
+                                                        for result, (elem, _, _) in zip(fits, ft.default_lines)])})
+
+    return pd.DataFrame(results)
+
+
+def bench_coarse_sampling(factors=(1, 2, 4), method="brent", runtime=0.01, point_runtime=0.2, repfit=2,
+                          step=0.005):
+    """
+    Run the TurboSpectrum fit of every line of the stand-in with the first stages at a coarser
+    wavelength step (see the ``coarse_step`` argument of ``fit_engine.fit_line``), without the cache.
+
+    :param factors: multiples of the original step. The first one is the reference.
+    :param method: abundance fit method (see ``turbospec_functions.optimize_abund``).
+    :param runtime: artificial runtime of each synthesis in seconds.
+    :param point_runtime: additional artificial runtime for each 1000 synthetic points in seconds.
+    :param repfit: number of iterations of the main fit function.
+    :param step: original wavelength step of the stand-in.
+    :return: dataframe with the time of each stage and the mean abundance difference to the reference.
+    """
+
+    results = []
+    tf.cache = None
+    with tempfile.TemporaryDirectory() as folder:
+        type_synth = ft.create(folder, runtime=runtime, point_runtime=point_runtime, step=step)
+        truth = {elem: value - 0.12 for elem, value in ft.default_abundances.items()}
+        spec_obs = fake_observed(type_synth, truth)
+        continuum = ff.fit_continuum(spec_obs, contpars=[2, 8], iterac=1000)[0]
+
+        reference = None
+        for factor in factors:
+            # Each run starts without the spectra kept by the template
+            tf.get_template(type_synth[2]).windows = []
+            start = time.perf_counter()
+            fits = fit_stand_in(type_synth, spec_obs, continuum, folder, repfit=repfit, abund_method=method,
+                                coarse_step=factor)
+            abund = np.array([result["par"][0] for result in fits])
+            if reference is None:
+                reference = abund
+
+            results.append({"Step": "{:g}x".format(factor), "Time (s)": time.perf_counter() - start,
+                            **{"{} (s)".format(stage.capitalize()): sum(result["times"][stage] for result in fits)
+                               for stage in ["spec", "abund", "plot"]},
+                            "Syntheses": sum(result["nsynth"] for result in fits),
+                            "Abundance Difference": np.mean(np.abs(abund - reference))})
+
+    return pd.DataFrame(results)
+
+
+def bench_repfit_stages(repfits=(1, 2, 4), method="brent", runtime=0.01):
+    """
+    Count the stages run by the fit of every line of the stand-in for several numbers of iterations
+    (the ``repfit`` argument of ``fit_engine.fit_line``), in the Equivalent Width and TurboSpectrum
+    modes, without the cache.
+
+    :param repfits: numbers of iterations.
+    :param method: abundance fit method (see ``turbospec_functions.optimize_abund``).
+    :param runtime: artificial runtime of each synthesis in seconds.
+    :return: dataframe with the time, the iterations and the runs of each stage.
+    """
+
+    results = []
+    tf.cache = None
+    with tempfile.TemporaryDirectory() as folder:
+        type_synth = ft.create(folder, runtime=runtime)
+        truth = {elem: value - 0.12 for elem, value in ft.default_abundances.items()}
+        spec_obs = fake_observed(type_synth, truth)
+        continuum = ff.fit_continuum(spec_obs, contpars=[2, 8], iterac=1000)[0]
+
+        for mode in [["Equivalent Width", "Gaussian", 0.05], type_synth]:
+            for repfit in repfits:
+                start = time.perf_counter()
+                fits = fit_stand_in(mode, spec_obs, continuum, folder, repfit=repfit, abund_method=method)
+
+                results.append({"Mode": mode[0], "Repfit": repfit, "Lines": len(fits),
+                                "Time (s)": time.perf_counter() - start,
+                                "Iterations": sum(result["passes"] for result in fits),
+                                **{"{} Runs".format(stage.capitalize()): sum(result["runs"][stage] for result in fits)
+                                   for stage in ["spec", "abund", "equiv"]},
+                                "Syntheses": sum(result["nsynth"] for result in fits)})
+
+    return pd.DataFrame(results)
+
+
+def main(args):
+    """
+    Main Routine.
+
+    :param args: command line arguments.
+    """
+
+    print(bench_read_spectrum().to_string(index=False, float_format="%.3f"))
+    print()
+    print(bench_turbospec_fit().to_string(index=False, float_format="%.3f"))
+    print()
+    print(bench_coarse_sampling().to_string(index=False, float_format="%.4f"))
+    print()
+    print(bench_repfit_stages().to_string(index=False, float_format="%.3f"))
+
+
+if __name__ == '__main__':
+    arg = sys.argv[1:]
+    main(arg)
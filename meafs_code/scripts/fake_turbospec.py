@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+| MEAFS TurboSpectrum Stand-in
+| Matheus J. Castro
+
+| Fake Turbospectrum2019 script to run and benchmark the TurboSpectrum code paths without
+  a TurboSpectrum install.
+| The created script has the same configuration entries edited by MEAFS (``set lam_min``,
+  ``set lam_max``, ``foreach <elem>_ab`` and ``'LAMBDA_STEP:'``) and writes a deterministic
+  analytic spectrum in the TurboSpectrum output format after an artificial runtime.
+"""
+
+from pathlib import Path
+import sys
+import os
+
+# Element, central wavelength and strength of the lines of the default stand-in
+default_lines = [["Fe", 5010.30, 0.30], ["Fe", 5020.70, 0.35], ["Ti", 5025.20, 0.25],
+                 ["Fe", 5035.10, 0.40], ["Fe", 5038.40, 0.20], ["Ti", 5050.00, 0.45],
+                 ["Fe", 5071.40, 0.55], ["Fe", 5088.80, 0.60]]
+
+# Reference abundances of the default stand-in
+default_abundances = {"Fe": 7.50, "Ti": 4.90}
+
+script_template = '''#!{python}
+"""
+MEAFS TurboSpectrum stand-in. The configuration below is edited by MEAFS.
+
+set lam_min    = '{lam_min}'
+set lam_max    = '{lam_max}'
+'LAMBDA_STEP:' '{step}'
+
+{abundances}
+
+'RESULTFILE :' 'syntspec/fake.spec'
+"""
+
+import numpy as np
+import time
+import re
+import os
+
+LINES = {lines}
+REFERENCE = {reference}
+WIDTH = {width}
+RUNTIME = float(os.environ.get("MEAFS_FAKE_RUNTIME", {runtime}))
+POINT_RUNTIME = {point_runtime}
+
+ranges = dict(re.findall(r"^set (lam_min|lam_max)\\s*=\\s*'([^']*)'", __doc__, flags=re.M))
+abund = dict(re.findall(r"^foreach (\\w+)_ab\\s*\\(([^)]*)\\)", __doc__, flags=re.M))
+STEP = float(re.search(r"'LAMBDA_STEP:'\\s+'([^']*)'", __doc__).group(1))
+
+x = np.arange(float(ranges["lam_min"]), float(ranges["lam_max"]) + STEP / 2, STEP)
+y = np.ones_like(x)
+for elem, lamb, strength in LINES:
+    depth = 1 - np.exp(-strength * 10**(float(abund[elem]) - REFERENCE[elem]))
+    y *= 1 - depth * np.exp(-(x - lamb)**2 / (2 * WIDTH**2))
+
+time.sleep(RUNTIME + POINT_RUNTIME * len(x) / 1000)
+
+os.makedirs("syntspec", exist_ok=True)
+np.savetxt("syntspec/fake.conv", np.c_[x, y, y * 1e15], fmt="%11.4f %11.5f %12.5e")
+'''
+
+
+def create(folder, lines=None, abundances=None, lam_min=5000., lam_max=5100., step=0.01, width=0.03,
+           runtime=0.05, point_runtime=0.):
+    """
+    Create the stand-in script and its output folder.
+
+    :param folder: directory to create the script.
+    :param lines: list with the element, central wavelength and strength of each line.
+    :param abundances: dictionary with the reference abundance of each element.
+    :param lam_min: initial lower limit of the spectrum.
+    :param lam_max: initial upper limit of the spectrum.
+    :param step: wavelength step of the spectrum.
+    :param width: standard deviation of the Gaussian profile of the lines.
+    :param runtime: artificial runtime of each synthesis in seconds. It can be changed later with
+                    the ``MEAFS_FAKE_RUNTIME`` environment variable.
+    :param point_runtime: additional runtime in seconds for each 1000 points of the spectrum, like the
+                          synthesis time of TurboSpectrum that grows with the number of wavelengths.
+    :return: the ``type_synth`` list used in the fit functions.
+    """
+
+    if lines is None:
+        lines = default_lines
+    if abundances is None:
+        abundances = default_abundances
+
+    folder = Path(folder)
+    os.makedirs(folder.joinpath("syntspec"), exist_ok=True)
+
+    text = script_template.format(python=sys.executable, lam_min=lam_min, lam_max=lam_max,
+                                  abundances="\n".join("foreach {}_ab ({:.2f})".format(elem, value)
+                                                       for elem, value in abundances.items()),
+                                  lines=repr([list(line) for line in lines]), reference=repr(abundances),
+                                  step=step, width=width, runtime=runtime, point_runtime=point_runtime)
+
+    config_fl = folder.joinpath("fake_turbospec")
+    with open(config_fl, "w") as file:
+        file.write(text)
+    os.chmod(config_fl, 0o755)
+
+    return ["TurboSpectrum", str(folder.joinpath("syntspec", "fake.conv")), str(config_fl)]
@@ -0,0 +1,1079 @@
+#!/usr/bin/env python3
+"""
+| MEAFS Fit Engine
+| Matheus J. Castro
+
+| Fit of the lines of a spectrum without any dependency on QT, so it can run in scripts,
+  worker processes or on a cluster.
+| The GUI (see ``abundance_fit.fit_abundance``) follows the fit through the callback of :func:`fit_lines`.
+"""
+
+from specutils.analysis import equivalent_width
+from specutils import Spectrum, SpectralRegion
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field, replace
+from multiprocessing import shared_memory
+import astropy.units as u
+import multiprocessing.util
+from pathlib import Path
+from queue import Empty
+import multiprocessing
+import pandas as pd
+import numpy as np
+import time
+import os
+
+from . import fit_functions as ff
+from . import voigt_functions as vf
+from . import turbospec_functions as tf
+
+# Columns of the results of the fit
+result_columns = ["Element", "Lambda (A)", "Lamb Shift", "Continuum", "Convolution",
+                  "Refer Abundance", "Fit Abundance", "Differ", "Chi", "Equiv Width Obs (A)",
+                  "Equiv Width Fit (A)", "Spectrum", "Passes"]
+
+
+def cur_time():
+    """
+    Function to return the formated local current time.
+
+    :return: the local formated time
+    """
+    init_local = time.localtime()
+    local = ("{:04d}.{:02d}.{:02d} "
+             "{:02d}:{:02d}:{:02d}: ").format(init_local.tm_year,
+                                              init_local.tm_mon,
+                                              init_local.tm_mday,
+                                              init_local.tm_hour,
+                                              init_local.tm_min,
+                                              init_local.tm_sec)
+    return local
+
+
+def log_write(folder, msg):
+    """
+    Function to write a message in the log and print on the GUI/terminal.
+
+    :param folder: folder path of the log file.
+    :param msg: the message to be written.
+    """
+    # noinspection PyTypeChecker
+    with open(str(Path(folder).joinpath("log.txt")), "a") as f:
+        f.write(cur_time())
+        f.write(msg)
+        f.write("\n")
+        f.close()
+    print(cur_time() + msg)
+
+
+def check_order(elem):
+    """
+    | Check if the current element has any type of order written in the end of the string.
+    | Supported types are: roman numbers *(I, II, III...)* and western digits *(1, 2, 3...)*.
+
+    :param elem: the element string
+    :return: the element without the order and the order itself.
+    """
+
+    if len(elem) == 1:
+        return elem, ""
+
+    if elem[1].isdigit() or elem[1] == "I" or elem[1] == "V" or elem[1] == "X" or elem[1] == " ":
+        if elem[1] == " ":
+            order = elem[2:]
+        else:
+            order = elem[1:]
+        elem = elem[0]
+    else:
+        if len(elem) == 2:
+            return elem, ""
+        if elem[2] == " ":
+            order = elem[3:]
+        else:
+            order = elem[2:]
+        elem = elem[0:2]
+
+    return elem, order
+
+
+def validate_lines(spectrum, linelist, refer, config):
+    """
+    Check all the lines of a linelist at once before the fit.
+
+    | A line is skipped when its element is not in the TurboSpectrum configuration file, when
+      it is outside of the spectrum or when any of the ``cut_val`` ranges has one point or less.
+
+    :param spectrum: spectrum data.
+    :param linelist: linelist dataframe with the element (with the order) and the wavelength of each line.
+    :param refer: reference abundance dataframe, indexed by the element, with a ``value`` column.
+    :param config: the ``FitConfig`` object.
+    :return: dataframe with a row for each line of the linelist (with the same positions), with the
+             ``Element`` (without the order), ``Order``, ``Lambda (A)``, ``Refer Abundance``,
+             ``Abund Lim`` and the ``Reason`` to skip the line (null if it can be fitted).
+    """
+
+    type_synth = config.type_synth
+    names = linelist.iloc[:, 0].astype(str).to_numpy()
+    lamb = linelist.iloc[:, 1].astype(float).to_numpy()
+
+    # The element and order of each different name
+    split = {name: check_order(name) for name in pd.unique(names)}
+    elems = np.array([split[name][0] for name in names], dtype=object)
+    orders = np.array([split[name][1] for name in names], dtype=object)
+
+    # Reference abundance of the elements, 0 if not found
+    values = pd.to_numeric(refer["value"], errors="coerce")
+    values = values[~values.index.duplicated()]
+    abund_val_refer = pd.Series(elems).map(values).fillna(0).to_numpy(dtype=float)
+    abund_lim = np.where(abund_val_refer != 0, config.abund_lim, 3)
+
+    if type_synth[0] == "TurboSpectrum":
+        # The configuration file is only parsed once
+        template = tf.get_template(type_synth[2])
+        known = {elem: template.has_elem(elem) for elem in set(elems)}
+        in_config = np.array([known[elem] for elem in elems], dtype=bool)
+    else:
+        in_config = np.ones(len(elems), dtype=bool)
+
+    # Number of points of each range, the same as the length of fit_functions.cut_spec
+    wave = spectrum.iloc[:, 0].to_numpy()
+
+    def bisec(values):
+        ind = np.searchsorted(wave, values, side="right") - 1
+        return np.where((values < wave[0]) | (values > wave[-1]), -1, ind)
+
+    def range_size(cut):
+        start = bisec(lamb - cut)
+        stop = bisec(lamb + cut) + 1
+        start = np.where(start < 0, start + len(wave), start)
+        return np.maximum(stop - start, 0)
+
+    conditions = [~in_config, ~((wave[0] <= lamb) & (lamb <= wave[-1]))]
+    reasons = ["Element not in TurboSpectrum Configuration file", "Wavelength not in the range of the spectrum."]
+    for cut, name in zip(config.cut_val, ["Continuum", "Convolution", "Abundance", "Plot"]):
+        conditions.append(range_size(cut) <= 1)
+        reasons.append("{} range smaller than 0.".format(name))
+
+    reason = np.select(conditions, reasons, default="")
+
+    return pd.DataFrame({"Element": elems, "Order": orders, "Lambda (A)": lamb, "Refer Abundance": abund_val_refer,
+                         "Abund Lim": abund_lim, "Reason": np.where(reason == "", None, reason).astype(object)})
+
+
+class LineStages:
+    """
+    Results of the stages of the fit of a line, kept for the lifetime of the line.
+
+    | Each stage is identified by its name and the values of its inputs that can change between
+      the iterations of the fit (``repfit``). A stage only runs again when these inputs changed,
+      otherwise its previous result is returned.
+    """
+
+    def __init__(self):
+        self.results = {}
+        self.runs = {}
+        self.reused = 0
+
+    def done(self, stage, inputs):
+        """
+        Check if a stage already ran with the same inputs.
+
+        :param stage: name of the stage.
+        :param inputs: tuple with the values of the inputs of the stage.
+        :return: true if its result is kept.
+        """
+
+        return (stage, inputs) in self.results
+
+    def run(self, stage, inputs, func, *args, **kwargs):
+        """
+        Run a stage, or return its previous result if it already ran with the same inputs.
+
+        :param stage: name of the stage.
+        :param inputs: tuple with the values of the inputs of the stage.
+        :param func: function of the stage.
+        :param args: arguments of the function.
+        :param kwargs: keyword arguments of the function.
+        :return: the result of the function.
+        """
+
+        key = (stage, inputs)
+        if key in self.results:
+            self.reused += 1
+        else:
+            self.results[key] = func(*args, **kwargs)
+            self.runs[stage] = self.runs.get(stage, 0) + 1
+        return self.results[key]
+
+
+def line_equiv_width(spec, lamb, size, cont_kwargs):
+    """
+    Equivalent width of a line.
+
+    :param spec: spectrum data around the line.
+    :param lamb: central wavelength of the line.
+    :param size: number of points of the observed spectrum around the line, the upper limit of the line range.
+    :param cont_kwargs: arguments of ``fit_functions.fit_continuum``.
+    :return: the equivalent width in Angstroms.
+    """
+
+    # noinspection PyUnresolvedReferences
+    cont_level = ff.fit_continuum(spec, **cont_kwargs)[2]
+    spec1d = Spectrum(spectral_axis=np.asarray(spec[0]) * u.AA,
+                      flux=np.asarray(spec[1]) * u.dimensionless_unscaled)
+    spec1d = spec1d / cont_level
+
+    # Get the minimum and maximum range of the line to apply the equivalent width function
+    min_line, max_line = ff.line_boundaries(spec, lamb, threshold=0.98, contpars=cont_kwargs["contpars"],
+                                            iterac=cont_kwargs["iterac"])
+
+    if max_line < size-10:
+        max_line += 10
+    else:
+        max_line = size - 1
+
+    if min_line > 10:
+        min_line -= 10
+    else:
+        min_line = 0
+
+    region = SpectralRegion(spec.iloc[min_line][0] * u.AA,
+                            spec.iloc[max_line][0] * u.AA)
+
+    equiv_width = equivalent_width(spec1d, regions=region)
+    # noinspection PyUnresolvedReferences
+    return np.float16(equiv_width / u.AA)
+
+
+def synthesis_margin(config_fl, convovbound=None, opt_pars=None):
+    """
+    Margin added to the TurboSpectrum synthesis ranges of a line, so the convolution is not
+    affected by the edges of the range.
+
+    :param config_fl: file name of the TurboSpectrum configuration file.
+    :param convovbound: convolution fit limits, the largest one is used before the fit.
+    :param opt_pars: the fitted wavelength shift, continuum and convolution, if already known.
+    :return: the margin.
+    """
+
+    if opt_pars is not None:
+        convol = opt_pars[2]
+    else:
+        convol = max(convovbound) if convovbound is not None else 4.2
+    return tf.broadening_margin(config_fl, convol)
+
+
+def fit_line(spec_obs, elem, order, lamb, abund_val_refer, abund_lim, type_synth, cut_val, continuum, folder,
+             opt_pars=None, init_pars=None, repfit=2, max_iter=None, convovbound=None, wavebound=None,
+             contpars=None, contmethod=0, contdisabled=False, medianwindow=3, contfixedvalue=1.,
+             abund_method="nelder-mead", abund_validate=None, spec_conv_refer=None, synth_pool=None,
+             callback=None, coarse_step=1, refine_lim=.05, repfit_tol=None, cancel_event=None):
+    """
+    Fit a single line of the linelist. It does not depend on QT, so it can run in worker processes.
+
+    :param spec_obs: spectrum data.
+    :param elem: element without the order.
+    :param order: order of the line.
+    :param lamb: central wavelength of the line.
+    :param abund_val_refer: reference abundance of the element.
+    :param abund_lim: range of the allowed abundance.
+    :param type_synth: type of the current synthetics spectrum generator.
+    :param cut_val: ranges to cut the spectrum.
+    :param continuum: overall continuum value of the spectrum.
+    :param folder: directory to save the log.
+    :param opt_pars: fixed convolution, wavelength shift and continuum. If None, they are fitted.
+    :param init_pars: initial guess for the convolution, wavelength shift and continuum fit.
+    :param repfit: number of iterations of the main fit function. In the Equivalent Width mode only the
+                   first one runs, as the next ones would repeat it with the same inputs.
+    :param max_iter: maximum allowed iterations of the Nelder-Mead method.
+    :param convovbound: range to fit the convolution.
+    :param wavebound: range to fit the wavelength shift.
+    :param contpars: the calibration values of the overall continuum fit method.
+    :param contmethod: method to fit the continuum (see ``fit_functions.fit_continuum``).
+    :param contdisabled: disable the continuum fit and use a fixed value.
+    :param contfixedvalue: fixed value when not continuum fit.
+    :param medianwindow: median window for the Chebyshev method.
+    :param abund_method: method of the TurboSpectrum abundance fit (see ``turbospec_functions.optimize_abund``).
+    :param abund_validate: tolerance of the emulator validation of the TurboSpectrum abundance fit.
+    :param spec_conv_refer: TurboSpectrum spectrum of the continuum window with the current abundances,
+                            used instead of its synthesis in the first iteration.
+    :param synth_pool: ``turbospec_functions.SynthesisPool`` object to run independent syntheses at the same time.
+    :param callback: function called as ``callback(stage, values)`` after the wavelength shift,
+                     continuum and convolution fit (``"spec"``) and after the abundance fit
+                     (``"abund"``). If it returns true, the fit is cancelled.
+    :param coarse_step: multiple of the TurboSpectrum wavelength step used in the wavelength shift,
+                        continuum and convolution fit and in the abundance fit of all but the last
+                        iteration. The last abundance fit and the plot always use the original step.
+    :param refine_lim: range of the last abundance fit around the abundance of a previous fit at the
+                       coarser step. If the fit reaches its edge, it runs again in the full range.
+    :param repfit_tol: tolerances of the changes of the wavelength shift, convolution and abundance
+                       in an iteration. If given, the iterations stop when all the changes are below
+                       them and ``repfit`` is only the maximum number of iterations.
+    :param cancel_event: event (like ``threading.Event``) set to cancel the TurboSpectrum syntheses
+                         (``turbospec_functions.SynthesisCancelled`` is then raised).
+    :return: dictionary with the results, or None if the fit was cancelled.
+    """
+
+    if type_synth[0] == "TurboSpectrum":
+        conv_name = type_synth[1]
+        config_fl = type_synth[2]
+    else:
+        conv_name = None
+        config_fl = None
+
+    if max_iter is None:
+        max_iter = [100, 10, 10]
+
+    chi, equiv_width_obs, equiv_width_fit = 0, 0, 0
+    par = [abund_val_refer]
+    spec_fit = [[], []]
+    spec_conv = None
+    fit_stats = {"nfev": 0, "nsynth": 0}
+    stage_times = {"spec": 0., "abund": 0., "plot": 0.}
+    stages = LineStages()
+
+    def stage_range(cut):
+        # Synthesis range of a stage: its observed window plus the margin of the convolution edges
+        return cut + synthesis_margin(config_fl, convovbound, opt_pars)
+
+    def plot_window(spec):
+        # Remove the margin of the synthesis range
+        return spec[(spec[0] >= lamb - cut_val[3]) & (spec[0] <= lamb + cut_val[3])].reset_index(drop=True)
+
+    def sampling(spec):
+        # The convolution is in pixels of the synthetic spectrum, find its step relative to the original one
+        base_step = tf.get_template(config_fl).base_step
+        if base_step is None or len(spec) < 2:
+            return 1.
+        return (spec[0].iloc[1] - spec[0].iloc[0]) / base_step
+
+    def cut_windows():
+        return ff.cut_spec(spec_obs, lamb, cut_val=cut_val[0]), ff.cut_spec(spec_obs, lamb, cut_val=cut_val[3])
+
+    # Observed windows of the stages, the same for all the iterations
+    spec_obs_spec, spec_obs_cut = stages.run("windows", (), cut_windows)
+    cont_kwargs = {"contpars": contpars, "iterac": max_iter[0], "method": contmethod,
+                   "contdisabled": contdisabled, "medianwindow": medianwindow, "hardvalue": contfixedvalue}
+
+    def fit_spec_ew():
+        continuum_local = stages.run("continuum", (), lambda: ff.fit_continuum(spec_obs_spec, **cont_kwargs)[0])
+        return vf.optimize_spec(spec_obs_spec, type_synth, lamb, continuum_local, iterac=max_iter[1],
+                                convovbound=convovbound, wavebound=wavebound, init=init_pars, stats=fit_stats)
+
+    def synth_spec(step):
+        tf.change_step_configfl(config_fl, step)
+        tf.change_spec_range_configfl(config_fl, lamb, stage_range(cut_val[0]))
+        return tf.synthesize(config_fl, conv_name, cancel_event=cancel_event)
+
+    def fit_spec_ts():
+        # The spectrum of the continuum window is only needed to fit the parameters
+        spec = spec_conv_refer if spec_conv_refer is not None else synth_spec(coarse_step)
+
+        scale = sampling(spec)
+        init = None if init_pars is None else [init_pars[0], init_pars[1], init_pars[2] / scale]
+        bound = None if convovbound is None else [bound / scale for bound in convovbound]
+        pars = tf.optimize_spec(spec_obs_spec, spec, lamb, cut_val, continuum, init=init, iterac=max_iter[1],
+                                convovbound=bound, wavebound=wavebound, stats=fit_stats)
+        pars[2] *= scale
+        return pars, spec
+
+    def fit_abund_ts(pars, step, lim):
+        # Only the last abundance fit uses the original step
+        scale = tf.change_step_configfl(config_fl, step)
+        tf.change_spec_range_configfl(config_fl, lamb, stage_range(cut_val[3]))
+        for lim_fit in [lim, abund_lim]:
+            fit = tf.optimize_abund(spec_obs_cut, config_fl, conv_name, elem, [pars[0], pars[1], pars[2] / scale],
+                                    par, lim_fit, iterac=max_iter[2], method=abund_method,
+                                    validate=abund_validate, stats=fit_stats, pool=synth_pool,
+                                    cancel_event=cancel_event)
+            if lim_fit == abund_lim or abs(fit[0][0] - par[0]) < lim - 1e-3:
+                break
+        return fit[0], fit[1], plot_window(fit[2])
+
+    # Values before the iteration, to find the changes of the fit. The first iteration only
+    # has them when the parameters were fixed or seeded
+    if opt_pars is not None:
+        before = [opt_pars[0], opt_pars[2], abund_val_refer]
+    elif init_pars is not None:
+        before = [init_pars[0], init_pars[2], abund_val_refer]
+    else:
+        before = None
+    passes = 0
+    last = False
+    # Inputs of the wavelength shift, continuum and convolution fit, which runs when they are not fixed
+    fit_pars = opt_pars is None
+    spec_key = () if init_pars is None else tuple(float(value) for value in init_pars)
+    abund_key = ()
+
+    try:
+        for repeat in range(repfit):
+            last = last or repeat == repfit - 1
+            start = time.perf_counter()
+            # Fit of lambda shift, continuum and convolution
+            if fit_pars:
+                if type_synth[0] == "Equivalent Width":
+                    opt_pars = stages.run("spec", spec_key, fit_spec_ew)[0]
+                elif type_synth[0] == "TurboSpectrum":
+                    opt_pars, spec_conv = stages.run("spec", spec_key + (coarse_step,), fit_spec_ts)
+            stage_times["spec"] += time.perf_counter() - start
+
+            # Inputs of the abundance fit. In the TurboSpectrum mode each iteration starts from the
+            # abundance of the previous one, and only the last one uses the original step
+            step = 1 if last else coarse_step
+            abund_key = tuple(float(value) for value in opt_pars)
+            if type_synth[0] == "TurboSpectrum":
+                abund_key += (float(par[0]), step)
+            if stages.done("abund", abund_key):
+                # Nothing changed, so this and the next iterations would repeat the previous one
+                break
+
+            msg = "\n\tLamb Shift:\t\t{:.4f}\n".format(opt_pars[0])
+            msg += "\tContinuum:\t\t{:.4f}\n".format(opt_pars[1])
+            msg += "\tConvolution:\t\t{:.4f}\n".format(opt_pars[2])
+
+            if callback is not None and callback("spec", opt_pars):
+                return None
+
+            # Fit of abundance
+            start = time.perf_counter()
+            if type_synth[0] == "Equivalent Width":
+                par, chi, spec_fit = stages.run("abund", abund_key, vf.optimize_abund, spec_obs_cut, type_synth,
+                                                lamb, opt_pars, iterac=max_iter[2])
+            elif type_synth[0] == "TurboSpectrum":
+                nsynth = fit_stats["nsynth"]
+                # After an abundance fit at the coarser step, the last one only refines its abundance
+                lim = min(refine_lim, abund_lim) if last and coarse_step != 1 and passes > 0 else abund_lim
+                par, chi, spec_fit = stages.run("abund", abund_key, fit_abund_ts, opt_pars, step, lim)
+                msg += "\tSyntheses:\t\t{}\n".format(fit_stats["nsynth"] - nsynth)
+            stage_times["abund"] += time.perf_counter() - start
+
+            msg += "\tAbundance:\t\t{:.4f}".format(par[0])
+            log_write(folder, msg)
+
+            if callback is not None and callback("abund", par):
+                return None
+            passes += 1
+
+            if last:
+                break
+            after = [opt_pars[0], opt_pars[2], par[0]]
+            if repfit_tol is not None and before is not None and \
+                    all(np.abs(a - b) <= tol for a, b, tol in zip(after, before, repfit_tol)):
+                # Converged, only the last abundance fit in the original step is missing
+                if coarse_step == 1:
+                    break
+                last = True
+            before = after
+
+        # Only the Equivalent Widths of the last iteration are kept, the one of the observed spectrum
+        # does not depend on the iteration
+        if passes > 0:
+            equiv_width_obs = stages.run("equiv", ("obs",), line_equiv_width, spec_obs_cut, lamb,
+                                         len(spec_obs_cut), cont_kwargs)
+            equiv_width_fit = stages.run("equiv", ("fit",) + abund_key, line_equiv_width, spec_fit, lamb,
+                                         len(spec_obs_cut), cont_kwargs)
+
+        # Plot of data
+        start = time.perf_counter()
+        if type_synth[0] == "Equivalent Width":
+            func = vf.find_func(type_synth[1])
+            x = np.linspace(min(spec_obs_cut.iloc[:, 0]), max(spec_obs_cut.iloc[:, 0]), 1000)
+            spec_fit = pd.DataFrame({0: x, 1: func(x, b=opt_pars[0]+lamb, c=opt_pars[2], a=par[0], d=opt_pars[1])})
+        elif type_synth[0] == "TurboSpectrum":
+            # Same range of the abundance fit, so its last synthesis is reused
+            tf.change_abund_configfl(config_fl, elem, find=False, abund=par[0])
+            tf.change_step_configfl(config_fl, 1)
+            tf.change_spec_range_configfl(config_fl, lamb, stage_range(cut_val[3]))
+            spec_conv = tf.synthesize(config_fl, conv_name, cancel_event=cancel_event)
+
+            # noinspection PyTypeChecker
+            spec_fit = ff.spec_operations(spec_conv.copy(), lamb_desloc=opt_pars[0], continuum=opt_pars[1],
+                                          convol=opt_pars[2])
+            spec_fit = plot_window(spec_fit)
+        stage_times["plot"] += time.perf_counter() - start
+    finally:
+        if type_synth[0] == "TurboSpectrum":
+            # Return the Turbospectrum2019 configuration file to the original abundance and step,
+            # also when the fit is cancelled
+            tf.change_abund_configfl(config_fl, elem, find=False, abund=abund_val_refer)
+            tf.change_step_configfl(config_fl, 1)
+
+    log_write(folder, "\tStage Times:\t\t{spec:.2f} s (shift, continuum and convolution), "
+                      "{abund:.2f} s (abundance), {plot:.2f} s (plot), {passes} iterations, "
+                      "{reused} stages reused".format(passes=passes, reused=stages.reused, **stage_times))
+    stage_runs = {stage: stages.runs.get(stage, 0) for stage in ["windows", "continuum", "spec", "abund", "equiv"]}
+
+    return {"opt_pars": opt_pars, "par": par, "chi": chi, "equiv_width_obs": equiv_width_obs,
+            "equiv_width_fit": equiv_width_fit, "nfev": fit_stats["nfev"], "nsynth": fit_stats["nsynth"],
+            "times": stage_times, "runs": stage_runs, "passes": passes, "spec_obs_cut": spec_obs_cut,
+            "spec_conv": spec_conv, "spec_fit": spec_fit}
+
+
+worker_state = {}
+
+
+def init_line_worker(config_fl, conv_name, spec_obs, cache=None, opacity_cache=None, linelist_cache=None,
+                     linelist_margin=10.):
+    """
+    Initialize a worker process of the parallel TurboSpectrum fit with its own sandbox.
+
+    :param config_fl: file name of the TurboSpectrum configuration file.
+    :param conv_name: file name of the TurboSpectrum output file.
+    :param spec_obs: spectrum data.
+    :param cache: the synthetic spectra cache of the main process.
+    :param opacity_cache: the continuum opacity cache of the main process.
+    :param linelist_cache: the trimmed line data cache of the main process.
+    :param linelist_margin: margin of the trimmed line data.
+    """
+
+    tf.cache = cache
+    tf.opacity_cache = opacity_cache
+    tf.linelist_cache = linelist_cache
+    tf.linelist_margin = linelist_margin
+
+    sandbox = tf.Sandbox(config_fl, conv_name)
+    # Remove the sandbox when the worker exits
+    multiprocessing.util.Finalize(sandbox, sandbox.cleanup, exitpriority=10)
+
+    worker_state["sandbox"] = sandbox
+    worker_state["spec_obs"] = spec_obs
+
+
+def fit_line_worker(line, line_kwargs):
+    """
+    Fit a line inside a worker process, using the worker sandbox.
+
+    :param line: the line specific arguments of ``fit_line``.
+    :param line_kwargs: the common arguments of ``fit_line``.
+    :return: the ``fit_line`` results.
+    """
+
+    line_kwargs = dict(line_kwargs, type_synth=worker_state["sandbox"].type_synth())
+    return fit_line(worker_state["spec_obs"], **line, **line_kwargs)
+
+
+class LineExecutor:
+    """
+    Run the fit of independent lines serially, in a thread pool or in a process pool.
+    The results are always returned in the order of the tasks, whatever the order they finish.
+
+    :param backend: ``"serial"``, ``"thread"`` or ``"process"``.
+    :param workers: number of threads or worker processes. Default is the number of CPUs.
+    :param initializer: function to initialize each worker process.
+    :param initargs: arguments of the ``initializer``.
+    """
+
+    backends = ["serial", "thread", "process"]
+
+    def __init__(self, backend="serial", workers=None, initializer=None, initargs=()):
+        if backend not in self.backends:
+            raise ValueError("Unknown executor backend {}, use one of {}.".format(backend, self.backends))
+
+        self.backend = backend
+        self.workers = workers
+        self.initializer = initializer
+        self.initargs = initargs
+
+    def map(self, func, tasks, poll=None, order=None, start=None):
+        """
+        Call ``func(**task)`` for each task. In the process backend, ``func`` and the tasks are pickled.
+
+        | The pools only keep ``workers`` tasks submitted ahead of the results already returned, so
+          a task is submitted about when it starts and it can use the results returned before it.
+
+        :param func: the function to call.
+        :param tasks: list with the keyword arguments of each call.
+        :param poll: function called before each task (serial backend) or while waiting for the
+                     results. If it returns true, the remaining tasks are cancelled.
+        :param order: order to submit the tasks to the pool. Default is the order of the tasks.
+        :param start: function called as ``start(index, task)`` right before a task runs (serial
+                      backend) or is submitted, it can change the task.
+        :return: generator of the results, None if cancelled.
+        """
+
+        if self.backend == "serial":
+            for j, task in enumerate(tasks):
+                if poll is not None and poll():
+                    yield None
+                    return
+                if start is not None:
+                    start(j, task)
+                yield func(**task)
+            return
+
+        if self.backend == "thread":
+            pool = ThreadPoolExecutor(max_workers=self.workers)
+        else:
+            pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"),
+                                       initializer=self.initializer, initargs=self.initargs)
+
+        ahead = self.workers if self.workers is not None else os.cpu_count()
+        queue = list(order if order is not None else range(len(tasks)))[::-1]
+
+        with pool:
+            futures = [None] * len(tasks)
+            for i in range(len(tasks)):
+                # Submit until the next result is on its way and the pool is full
+                while queue and (futures[i] is None or sum(f is not None for f in futures[i:]) < ahead):
+                    j = queue.pop()
+                    if start is not None:
+                        start(j, tasks[j])
+                    futures[j] = pool.submit(func, **tasks[j])
+
+                future = futures[i]
+                while not wait([future], timeout=.1).done:
+                    if poll is not None and poll():
+                        pool.shutdown(cancel_futures=True)
+                        yield None
+                        return
+                yield future.result()
+
+
+def fit_lines_pool(spec_obs, lines, line_kwargs, workers=None, poll=None, start=None):
+    """
+    Fit the lines in a process pool. Each worker runs TurboSpectrum in its own sandbox,
+    lines are dispatched by wavelength and the results are returned in the linelist order.
+
+    :param spec_obs: spectrum data.
+    :param lines: list with the line specific arguments of ``fit_line``.
+    :param line_kwargs: the common arguments of ``fit_line``.
+    :param workers: number of worker processes. Default is the number of CPUs.
+    :param poll: function called while waiting for the results. If it returns true,
+                 the remaining lines are cancelled.
+    :param start: function called as ``start(index, line)`` right before a line is submitted, it can
+                  change the line.
+    :return: generator of the ``fit_line`` results, None if cancelled.
+    """
+
+    type_synth = line_kwargs["type_synth"]
+    executor = LineExecutor("process", workers=workers, initializer=init_line_worker,
+                            initargs=(type_synth[2], type_synth[1], spec_obs, tf.cache,
+                                      tf.opacity_cache, tf.linelist_cache, tf.linelist_margin))
+
+    tasks = [{"line": line, "line_kwargs": line_kwargs} for line in lines]
+    return executor.map(fit_line_worker, tasks, poll=poll,
+                        order=sorted(range(len(lines)), key=lambda k: lines[k]["lamb"]),
+                        start=None if start is None else lambda j, task: start(j, task["line"]))
+
+
+@dataclass
+class FitConfig:
+    """
+    Settings of the fit of the lines of a spectrum.
+
+    :param type_synth: type of the current synthetics spectrum generator.
+    :param cut_val: ranges to cut the spectrum for the continuum, convolution, abundance and plot.
+    :param abund_lim: range of the allowed abundance when the element has a reference abundance.
+    :param opt_pars: fixed convolution, wavelength shift and continuum. If None, they are fitted.
+    :param repfit: number of iterations of the main fit function, or its maximum with ``repfit_tol``.
+    :param repfit_tol: tolerances of the changes of the wavelength shift, convolution and abundance
+                       to stop the iterations of a line before ``repfit`` (see :func:`fit_line`).
+                       If None, all the ``repfit`` iterations run.
+    :param max_iter: maximum allowed iterations of the continuum, spectrum and abundance fits.
+    :param convovbound: range to fit the convolution.
+    :param wavebound: range to fit the wavelength shift.
+    :param contpars: the calibration values of the overall continuum fit method.
+    :param contmethod: method to fit the continuum (see ``fit_functions.fit_continuum``).
+    :param contdisabled: disable the continuum fit and use a fixed value.
+    :param medianwindow: median window for the Chebyshev method.
+    :param contfixedvalue: fixed value when not continuum fit.
+    :param abund_method: method of the TurboSpectrum abundance fit (see ``turbospec_functions.optimize_abund``).
+    :param abund_validate: tolerance of the emulator validation of the TurboSpectrum abundance fit.
+    :param coarse_step: multiple of the TurboSpectrum wavelength step used in the first fit stages
+                        (see :func:`fit_line`).
+    :param refine_lim: range of the last abundance fit after a fit at the coarser step (see :func:`fit_line`).
+    :param workers: number of worker processes to fit the lines in the TurboSpectrum mode, or of
+                    threads or worker processes of the ``executor`` in the Equivalent Width mode.
+    :param executor: backend of the ``LineExecutor`` in the Equivalent Width mode: ``"serial"``,
+                     ``"thread"`` or ``"process"``.
+    :param merge_windows: share the TurboSpectrum syntheses of the continuum windows of nearby lines
+                          (see ``turbospec_functions.SharedWindows``). Only used when fitting serially.
+    :param synth_workers: number of simultaneous independent TurboSpectrum syntheses of a line.
+                          Only used when fitting serially.
+    """
+
+    type_synth: list
+    cut_val: list = field(default_factory=lambda: [5, 1.5, .2, .5])
+    abund_lim: float = 1.
+    opt_pars: list | None = None
+    repfit: int = 2
+    repfit_tol: list | None = None
+    max_iter: list = field(default_factory=lambda: [1000, 1000, 10])
+    convovbound: list = field(default_factory=lambda: [0, 5])
+    wavebound: float = .2
+    contpars: list = field(default_factory=lambda: [2, 8])
+    contmethod: int = 0
+    contdisabled: bool = False
+    medianwindow: int = 3
+    contfixedvalue: float = 1.
+    abund_method: str = "nelder-mead"
+    abund_validate: float | None = None
+    coarse_step: float = 1
+    refine_lim: float = .05
+    workers: int = 1
+    executor: str = "serial"
+    merge_windows: bool = False
+    synth_workers: int = 1
+
+    def line_kwargs(self, continuum, folder):
+        """
+        Common arguments of :func:`fit_line` for all the lines of a spectrum.
+
+        :param continuum: overall continuum value of the spectrum.
+        :param folder: directory to save the log.
+        :return: dictionary with the arguments.
+        """
+
+        return {"type_synth": self.type_synth, "cut_val": self.cut_val, "continuum": continuum, "folder": folder,
+                "repfit": self.repfit, "repfit_tol": self.repfit_tol, "max_iter": self.max_iter,
+                "convovbound": self.convovbound, "wavebound": self.wavebound, "contpars": self.contpars,
+                "contmethod": self.contmethod,
+                "contdisabled": self.contdisabled, "medianwindow": self.medianwindow,
+                "contfixedvalue": self.contfixedvalue, "abund_method": self.abund_method,
+                "abund_validate": self.abund_validate, "coarse_step": self.coarse_step,
+                "refine_lim": self.refine_lim}
+
+
+def fit_lines(spectrum, linelist, refer, config, folder=".", callback=None, warm_start=None, spec_index=0,
+              spec_count=1, cancel_event=None):
+    """
+    Fit all the lines of a linelist in a spectrum.
+
+    | The ``callback`` is called as ``callback(event, info)`` with the events:
+    | ``"line"``: before the fit of a line, with a dictionary with its ``index`` among the lines that
+      can be fitted (see :func:`validate_lines`), the ``total`` number of them, ``elem``, ``order`` and
+      ``lamb``. Only when fitting serially.
+    | ``"spec"`` and ``"abund"``: after the wavelength shift, continuum and convolution fit and
+      after the abundance fit of a line, with the fitted values.
+    | ``"poll"``: periodically while waiting for the worker processes, with None.
+    | ``"result"``: after each line, with a dictionary with its ``index`` and the ``total`` number
+      of lines that can be fitted, the ``row`` of the results and the full ``fit_line`` ``result``.
+    | If it returns true in any event but ``"result"``, the fit is cancelled and the results of the
+      lines already fitted are returned. The same happens when the ``cancel_event`` is set while
+      fitting serially in the TurboSpectrum mode, which also stops the running syntheses.
+
+    :param spectrum: spectrum data.
+    :param linelist: linelist dataframe with the element (with the order) and the wavelength of each line.
+    :param refer: reference abundance dataframe, indexed by the element, with a ``value`` column.
+    :param config: the ``FitConfig`` object.
+    :param folder: directory to save the log.
+    :param callback: function to follow the progress and to cancel the fit.
+    :param warm_start: ``fit_functions.WarmStart`` object to seed the Wavelength Shift and
+                       Convolution fit from the neighbouring lines and previous spectra. When the
+                       lines are fitted in parallel, each line only uses the lines returned before
+                       it is submitted, so the results depend on the number of workers.
+    :param spec_index: index of the spectrum, for the log and the ``Spectrum`` column (``spec_index + 1``).
+    :param spec_count: total number of spectra, for the log.
+    :param cancel_event: event (like ``threading.Event``) set to cancel the TurboSpectrum syntheses.
+    :return: dataframe with the results of the fitted lines (see ``result_columns``).
+    """
+
+    type_synth = config.type_synth
+    cut_val = config.cut_val
+
+    def notify(event, info):
+        return callback is not None and bool(callback(event, info))
+
+    if config.opt_pars is None:
+        continuum = ff.fit_continuum(spectrum,
+                                     contpars=config.contpars,
+                                     iterac=config.max_iter[0],
+                                     method=config.contmethod,
+                                     contdisabled=config.contdisabled,
+                                     medianwindow=config.medianwindow,
+                                     hardvalue=config.contfixedvalue)[0]
+    else:
+        continuum = None
+
+    if warm_start is not None:
+        warm_start.new_spectrum()
+
+    line_kwargs = config.line_kwargs(continuum, folder)
+
+    # Select the lines that can be fitted, only they are counted in the progress
+    table = validate_lines(spectrum, linelist, refer, config)
+    skipped = table[table["Reason"].notna()]
+    if len(skipped) > 0:
+        report = skipped[["Element", "Order", "Lambda (A)", "Reason"]].to_string()
+        log_write(folder, "Skipped {} of {} lines:\n{}".format(len(skipped), len(table), report))
+
+    runnable = table[table["Reason"].isna()]
+    lines = [{"elem": elem, "order": order, "lamb": lamb, "abund_val_refer": abund_val_refer, "abund_lim": abund_lim,
+              "opt_pars": config.opt_pars, "init_pars": None}
+             for elem, order, lamb, abund_val_refer, abund_lim in runnable.iloc[:, :5].itertuples(index=False)]
+    total = len(lines)
+
+    def line_start(i, line):
+        # Called when the line starts or is submitted to the workers, so the seed uses all the results before it
+        msg = ("Analysing the element {} for lambda {}. Line {} out of {} "
+               "for spectrum {} out of {}.").format(line["elem"] + line["order"], line["lamb"], i+1,
+                                                    total, spec_index+1, spec_count)
+        log_write(folder, msg)
+
+        # Initial guess for the Wavelength Shift and Convolution
+        if warm_start is not None and config.opt_pars is None:
+            line["init_pars"] = warm_start.seed(line["lamb"])
+
+    if type_synth[0] == "Equivalent Width":
+        # Each task only carries the part of the spectrum its line uses, with a margin so the
+        # ranges cut from it are the same as the ones cut from the whole spectrum
+        wave = spectrum.iloc[:, 0]
+        span = 2 * max(cut_val)
+        tasks = [dict(line, spec_obs=spectrum[(wave >= line["lamb"] - span) & (wave <= line["lamb"] + span)],
+                      **line_kwargs) for line in lines]
+
+        def task_start(i, task):
+            line_start(i, lines[i])
+            task["init_pars"] = lines[i]["init_pars"]
+
+        if config.executor == "serial":
+            # Follow the stages of each line
+            def fit(index, **task):
+                if notify("line", {"index": index, "total": total, "elem": task["elem"],
+                                   "order": task["order"], "lamb": task["lamb"]}):
+                    return None
+                return fit_line(**task, callback=notify)
+
+            func = fit
+            tasks = [dict(task, index=i) for i, task in enumerate(tasks)]
+        else:
+            func = fit_line
+
+        executor = LineExecutor(config.executor, workers=config.workers)
+        fits = executor.map(func, tasks, poll=lambda: notify("poll", None), start=task_start)
+    elif config.workers > 1 and type_synth[0] == "TurboSpectrum" and len(lines) > 1:
+        # Each worker copies the current state of the configuration file
+        tf.flush_configfl(type_synth[2])
+        fits = fit_lines_pool(spectrum, lines, line_kwargs, workers=config.workers,
+                              poll=lambda: notify("poll", None), start=line_start)
+    else:
+        windows = None
+        if config.merge_windows and type_synth[0] == "TurboSpectrum" and len(lines) > 1:
+            windows = tf.SharedWindows(type_synth[2], type_synth[1], [line["lamb"] for line in lines], cut_val[0],
+                                       cancel_event=cancel_event)
+            log_write(folder, "Shared synthesis windows: {} for {} lines.".format(len(windows.groups), len(lines)))
+
+        synth_pool = None
+        if config.synth_workers > 1 and type_synth[0] == "TurboSpectrum":
+            synth_pool = tf.SynthesisPool(type_synth[2], type_synth[1], limit=config.synth_workers,
+                                          cancel_event=cancel_event)
+
+        def serial_fits():
+            try:
+                for i, line in enumerate(lines):
+                    if notify("line", {"index": i, "total": total, "elem": line["elem"],
+                                       "order": line["order"], "lamb": line["lamb"]}):
+                        yield None
+                        return
+
+                    line_start(i, line)
+                    try:
+                        spec_conv_refer = None
+                        if windows is not None:
+                            # Same range of the synthesis of the first stage of fit_line
+                            margin = synthesis_margin(type_synth[2], config.convovbound, line["opt_pars"])
+                            spec_conv_refer = windows.spectrum(i, margin=margin)
+                        result = fit_line(spectrum, **line, **line_kwargs, spec_conv_refer=spec_conv_refer,
+                                          synth_pool=synth_pool, callback=notify, cancel_event=cancel_event)
+                    except tf.SynthesisCancelled:
+                        yield None
+                        return
+                    yield result
+            finally:
+                if synth_pool is not None:
+                    synth_pool.cleanup()
+
+        fits = serial_fits()
+
+    results = pd.DataFrame(columns=result_columns)
+    for (i, line), result in zip(enumerate(lines), fits):
+        if result is None:
+            break
+
+        elem, order, lamb = line["elem"], line["order"], line["lamb"]
+        abund_val_refer = line["abund_val_refer"]
+        opt_pars = result["opt_pars"]
+        par = result["par"]
+
+        if warm_start is not None and config.opt_pars is None:
+            warm_start.count(result["nfev"], warm=line["init_pars"] is not None)
+            warm_start.add(lamb, opt_pars)
+
+        row = [elem+order, lamb, opt_pars[0], opt_pars[1], opt_pars[2], abund_val_refer,
+               par[0], np.abs(par[0]-abund_val_refer), "{:.4e}".format(result["chi"]),
+               "{:.4e}".format(result["equiv_width_obs"]),
+               "{:.4e}".format(result["equiv_width_fit"]), spec_index+1, result["passes"]]
+        results.loc[len(results)] = row
+
+        notify("result", {"index": i, "total": total, "row": row, "result": result})
+
+    return results
+
+
+def init_spectra_worker(shm_name, layout, queue, stop, type_synth, cache=None, opacity_cache=None,
+                        linelist_cache=None, linelist_margin=10.):
+    """
+    Initialize a worker process of the parallel fit of several spectra. The spectra are read
+    from a shared memory block, so they are not copied to each task.
+
+    :param shm_name: name of the shared memory block with the spectra.
+    :param layout: list with the offset, shape and columns of each spectrum in the block.
+    :param queue: queue to send the results of the lines to the main process.
+    :param stop: event set by the main process to cancel the fit.
+    :param type_synth: type of the current synthetics spectrum generator.
+    :param cache: the synthetic spectra cache of the main process.
+    :param opacity_cache: the continuum opacity cache of the main process.
+    :param linelist_cache: the trimmed line data cache of the main process.
+    :param linelist_margin: margin of the trimmed line data.
+    """
+
+    if type_synth[0] == "TurboSpectrum":
+        init_line_worker(type_synth[2], type_synth[1], None, cache=cache, opacity_cache=opacity_cache,
+                         linelist_cache=linelist_cache, linelist_margin=linelist_margin)
+
+    block = shared_memory.SharedMemory(name=shm_name)
+    spectra = []
+    for offset, shape, columns in layout:
+        data = np.ndarray(shape, dtype=np.float64, buffer=block.buf, offset=offset)
+        spectra.append(pd.DataFrame(data, columns=columns, copy=False))
+
+    # The main process reads all the results before the workers exit
+    queue.cancel_join_thread()
+
+    worker_state["block"] = block
+    worker_state["spectra"] = spectra
+    worker_state["queue"] = queue
+    worker_state["stop"] = stop
+
+
+def fit_spectrum_worker(spec_index, linelist, refer, config, folder, warm_start, spec_count,
+                        result_keys=("spec_fit",)):
+    """
+    Fit the lines of a spectrum inside a worker process, sending the row of each line
+    to the main process as soon as it is fitted.
+
+    :param spec_index: index of the spectrum.
+    :param linelist: linelist dataframe of the spectrum.
+    :param refer: reference abundance dataframe.
+    :param config: the ``FitConfig`` object.
+    :param folder: directory to save the log.
+    :param warm_start: seed the fit of each line from the neighbouring lines.
+    :param spec_count: total number of spectra, for the log.
+    :param result_keys: items of the result of :func:`fit_line` sent with the row, like the fitted curve.
+    :return: the number of fitted lines.
+    """
+
+    config = replace(config, workers=1, executor="serial")
+    if "sandbox" in worker_state:
+        config = replace(config, type_synth=worker_state["sandbox"].type_synth())
+
+    queue = worker_state["queue"]
+    stop = worker_state["stop"]
+
+    def relay(event, info):
+        if event == "result":
+            queue.put((spec_index, dict(info, result={key: info["result"][key] for key in result_keys})))
+            return False
+        return stop.is_set()
+
+    results = fit_lines(worker_state["spectra"][spec_index], linelist, refer, config, folder=folder,
+                        callback=relay, warm_start=ff.WarmStart() if warm_start else None,
+                        spec_index=spec_index, spec_count=spec_count, cancel_event=stop)
+    # End of the spectrum
+    queue.put((spec_index, None))
+
+    return len(results)
+
+
+def fit_spectra(spectra, linelists, refer, config, folder=".", callback=None, warm_start=False, workers=None,
+                result_keys=("spec_fit",)):
+    """
+    Fit the lines of several spectra at the same time, one spectrum per worker process.
+
+    | The spectra are copied once to a shared memory block that all the workers read. Each worker
+      fits the lines of its spectrum serially with :func:`fit_lines`, in its own TurboSpectrum sandbox.
+    | The result of each line is sent back as soon as it is fitted, and passed to the ``callback``
+      in the order of the spectra and of their linelists.
+    | The ``callback`` is called as ``callback(event, info)`` with the events:
+    | ``"poll"``: periodically while waiting for the worker processes, with None. If it returns
+      true, the fit is cancelled and the results of the lines already received are returned.
+    | ``"result"``: after each line, with the same ``info`` of :func:`fit_lines` plus the
+      ``spectrum`` index. Only the ``result_keys`` items of the ``result`` are sent back by the workers.
+
+    :param spectra: list of spectra data.
+    :param linelists: list with the linelist dataframe of each spectrum.
+    :param refer: reference abundance dataframe, indexed by the element, with a ``value`` column.
+    :param config: the ``FitConfig`` object.
+    :param folder: directory to save the log.
+    :param callback: function to follow the progress and to cancel the fit.
+    :param warm_start: seed the Wavelength Shift and Convolution fit of each line from the
+                       neighbouring lines of its spectrum (see ``fit_functions.WarmStart``).
+    :param workers: number of worker processes. Default is the number of CPUs.
+    :param result_keys: items of the result of :func:`fit_line` of each line sent back by the workers.
+    :return: dataframe with the results of all the spectra (see ``result_columns``), the
+             ``Spectrum`` column is the index of the spectrum plus one.
+    """
+
+    type_synth = config.type_synth
+    if type_synth[0] == "TurboSpectrum":
+        # Each worker copies the current state of the configuration file
+        tf.flush_configfl(type_synth[2])
+
+    def notify(event, info):
+        return callback is not None and bool(callback(event, info))
+
+    # Copy the spectra to the shared memory block
+    arrays = [np.asarray(spec, dtype=np.float64) for spec in spectra]
+    layout = []
+    size = 0
+    for spec, data in zip(spectra, arrays):
+        layout.append((size, data.shape, list(spec.columns)))
+        size += data.nbytes
+    block = shared_memory.SharedMemory(create=True, size=max(size, 1))
+    for (offset, shape, columns), data in zip(layout, arrays):
+        np.ndarray(shape, dtype=np.float64, buffer=block.buf, offset=offset)[:] = data
+
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    stop = context.Event()
+    workers = min(workers or os.cpu_count(), len(spectra))
+
+    rows = []
+    received = [[] for _ in spectra]
+    current = 0
+    try:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=init_spectra_worker,
+                                 initargs=(block.name, layout, queue, stop, type_synth, tf.cache,
+                                           tf.opacity_cache, tf.linelist_cache, tf.linelist_margin)) as pool:
+            futures = [pool.submit(fit_spectrum_worker, k, linelists[k], refer, config, folder, warm_start,
+                                   len(spectra), result_keys) for k in range(len(spectra))]
+
+            while current < len(spectra):
+                if notify("poll", None):
+                    stop.set()
+                    pool.shutdown(cancel_futures=True)
+                    break
+
+                try:
+                    spec_index, info = queue.get(timeout=.1)
+                except Empty:
+                    for future in futures:
+                        if future.done() and future.exception() is not None:
+                            stop.set()
+                            raise future.exception()
+                    continue
+                received[spec_index].append(info)
+
+                # Pass the results on in the order of the spectra
+                while current < len(spectra) and received[current]:
+                    info = received[current].pop(0)
+                    if info is None:
+                        current += 1
+                        continue
+                    rows.append(info["row"])
+                    notify("result", dict(info, spectrum=current))
+    finally:
+        block.close()
+        block.unlink()
+
+    return pd.DataFrame(rows, columns=result_columns)
@@ -88,6 +88,24 @@ def chi2(spec1, spec2):
     # return sum((sp1_interpol - sp2_interpol)**2 / sp2_interpol)
 
 
+def chi2_pixels(obs_flux, fit_flux):
+    """
+    Function to find the :math:`\\chi^2` of a model evaluated exactly at the observed wavelengths.
+
+    | Same statistic as :func:`chi2`, but without the interpolation pass, since both arrays
+      already share the same wavelength axis.
+
+    :param obs_flux: observed flux array.
+    :param fit_flux: model flux array evaluated at the observed wavelengths.
+    :return: the :math:`\\chi^2`.
+    """
+
+    obs_flux = np.asarray(obs_flux, dtype=np.float64)
+    fit_flux = np.asarray(fit_flux, dtype=np.float64)
+
+    return float(np.sum((obs_flux - fit_flux)**2 / fit_flux))
+
+
 def bisec(spec, lamb):
     """
     Function to apply the bisection script to find a number position in an array.
@@ -284,6 +302,108 @@ def fit_continuum(spec, contpars=None, iterac=1000, method=0, contdisabled=False
     return cont, cont_err, func
 
 
+class WarmStart:
+    """
+    Warm-start policy for the Wavelength Shift and Convolution fit.
+
+    | Each line is seeded with a Gaussian-weighted running smooth of the shift and convolution
+      of the lines already fitted in the current spectrum. For the first lines of a spectrum,
+      the results of the previous spectrum are used instead.
+    | The number of objective evaluations of cold and warm starts are recorded to estimate
+      how many evaluations were saved.
+
+    :param width: width (in Angstroms) of the Gaussian weight used in the running smooth.
+    """
+
+    def __init__(self, width=50.):
+        self.width = width
+        self.current = []
+        self.previous = []
+        self.nfev_cold = []
+        self.nfev_warm = []
+
+    def new_spectrum(self):
+        """
+        Start a new spectrum, keeping the results of the last one as fallback.
+        """
+
+        if self.current:
+            self.previous = self.current
+        self.current = []
+
+    def add(self, lamb, opt_pars):
+        """
+        Store the fitted parameters of a line.
+
+        :param lamb: central wavelength of the line.
+        :param opt_pars: the Wavelength Shift, Continuum and Convolution parameters.
+        """
+
+        self.current.append([lamb, opt_pars[0], opt_pars[2]])
+
+    def seed(self, lamb, continuum=1.):
+        """
+        Find the initial guess for a line.
+
+        :param lamb: central wavelength of the line.
+        :param continuum: continuum value to be used in the guess.
+        :return: the Wavelength Shift, Continuum and Convolution guess or None
+                 if there is nothing to seed from.
+        """
+
+        for points in (self.current, self.previous):
+            if not points:
+                continue
+
+            points = np.asarray(points)
+            weights = np.exp(-0.5 * ((points[:, 0] - lamb) / self.width)**2)
+            if weights.sum() < 1e-8:
+                # No neighbour inside the window, use the closest line
+                weights = np.zeros(len(points))
+                weights[np.argmin(np.abs(points[:, 0] - lamb))] = 1
+
+            shift = np.sum(weights * points[:, 1]) / np.sum(weights)
+            convol = np.sum(weights * points[:, 2]) / np.sum(weights)
+
+            return [float(shift), continuum, float(convol)]
+
+        return None
+
+    def count(self, nfev, warm):
+        """
+        Record the number of objective evaluations used by a line.
+
+        :param nfev: number of evaluations.
+        :param warm: if the line was warm-started or not.
+        """
+
+        if warm:
+            self.nfev_warm.append(nfev)
+        else:
+            self.nfev_cold.append(nfev)
+
+    def summary(self):
+        """
+        Summary of the objective evaluations used and saved.
+
+        :return: a message to be written in the log.
+        """
+
+        if not self.nfev_warm:
+            return "Warm start: no line was warm-started."
+
+        warm = np.sum(self.nfev_warm)
+        msg = "Warm start: {} lines seeded using {} objective evaluations".format(len(self.nfev_warm), warm)
+        if self.nfev_cold:
+            saved = np.mean(self.nfev_cold) * len(self.nfev_warm) - warm
+            msg += " ({:.1f} per cold-started line), about {:.0f} evaluations saved.".format(
+                np.mean(self.nfev_cold), saved)
+        else:
+            msg += "."
+
+        return msg
+
+
 # Compile C files
 if not os.path.isfile(Path(os.path.dirname(__file__)).joinpath("bisec_interpol.so")):
     print("C module not found. Compiling...")
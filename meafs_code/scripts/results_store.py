@@ -0,0 +1,569 @@
+"""
+| MEAFS Results Store
+| Matheus J. Castro
+
+| Results of the fit kept in a SQLite table next to the CSV file, so each line is saved with a
+  single insert instead of rewriting the whole CSV file.
+| The fitted curves of the lines can also be kept in memory and written together in a single file.
+"""
+
+from pathlib import Path
+import pandas as pd
+import numpy as np
+import tempfile
+import sqlite3
+import json
+import time
+import os
+
+from .fit_engine import result_columns
+
+# Columns of the results that are kept as text
+text_columns = ["Element", "Chi", "Equiv Width Obs (A)", "Equiv Width Fit (A)"]
+# Columns of the results that are integers
+integer_columns = ["Spectrum", "Passes"]
+# Columns of the results that identify a line
+key_columns = ["Spectrum", "Element", "Lambda (A)"]
+# Maximum difference between the wavelengths of a line of the linelist and of a previous result
+# for them to be the same line (the results are saved with 4 decimals)
+lamb_tolerance = 5e-4
+
+
+def read_csv(fl_name):
+    """
+    Read a CSV file of results.
+
+    :param fl_name: file name.
+    :return: the pandas dataframe with the results, or None if the file does not exist or is empty.
+    """
+
+    try:
+        prev = pd.read_csv(fl_name, delimiter=",", dtype={i: str for i in text_columns})
+    except (FileNotFoundError, pd.errors.EmptyDataError):
+        return None
+
+    # The other columns are usually already parsed as numbers, columns without values or with
+    # values that are not numbers (like a partially written row) need a cast
+    for i in prev.columns:
+        if i == "Spectrum":
+            # Like the results saved before the spectrum column existed, a row without it belongs to the first spectrum
+            prev[i] = pd.to_numeric(prev[i], errors="coerce").fillna(1).astype(int)
+        elif i not in text_columns and prev[i].dtype != float:
+            prev[i] = pd.to_numeric(prev[i], errors="coerce").astype(float)
+
+    # Results saved before the spectrum column existed belong to the first spectrum,
+    # other missing columns (like the number of iterations) are unknown
+    for i in result_columns:
+        if i not in prev.columns:
+            prev[i] = 1 if i == "Spectrum" else np.nan
+
+    return prev
+
+
+def read_results(fl_name):
+    """
+    Read the results of a CSV file, including the lines of a run still in progress (or interrupted)
+    when its results store exists. It can be called while another process is writing the store, as
+    the store is only opened to read.
+
+    | When the CSV file was changed after the last export of the store, the CSV file is read instead
+      (the store imports it when the fit opens it again).
+
+    :param fl_name: file name of the CSV file.
+    :return: the pandas dataframe with the results, or None if there are no results.
+    """
+
+    if not ResultsStore.path(fl_name).is_file():
+        return read_csv(fl_name)
+
+    try:
+        store = ResultsStore(fl_name, readonly=True)
+        try:
+            results = None if store.outdated() else store.read()
+        finally:
+            store.close()
+    except sqlite3.OperationalError:
+        # The store is still being created
+        results = None
+
+    if results is None:
+        return read_csv(fl_name)
+    return results if len(results) or Path(fl_name).is_file() else None
+
+
+def pending_lines(linelist, results, spectrum=None, tolerance=lamb_tolerance):
+    """
+    Remove from a linelist the lines that are already in the results.
+
+    | The lines are matched by element, wavelength and spectrum with a single join of the
+      two tables, with the wavelengths allowed to differ by ``tolerance``.
+
+    :param linelist: linelist dataframe, with the element in the first column and the wavelength in the second.
+    :param results: dataframe with the results.
+    :param spectrum: only the results of this spectrum (the ``Spectrum`` column) are used. If None,
+                     the results of any spectrum are.
+    :param tolerance: maximum difference of the wavelengths.
+    :return: the linelist with the lines that are not in the results.
+    """
+
+    if len(linelist) == 0:
+        return pd.DataFrame(columns=[0, 1])
+
+    done = results if spectrum is None else results[results["Spectrum"] == spectrum]
+    lines = pd.DataFrame({"Element": linelist.iloc[:, 0].to_numpy(),
+                          "Lambda (A)": linelist.iloc[:, 1].astype(float).to_numpy(),
+                          "position": np.arange(len(linelist))})
+    keys = pd.DataFrame({"Element": done["Element"].to_numpy(),
+                         "Lambda (A)": done["Lambda (A)"].astype(float).to_numpy(),
+                         "found": True}).dropna().drop_duplicates(["Element", "Lambda (A)"])
+    # The same type in both tables, even when one of them is empty
+    lines["Element"] = lines["Element"].astype(str)
+    keys["Element"] = keys["Element"].astype(str)
+
+    # Nearest previous result of the same element for each line
+    matched = pd.merge_asof(lines.sort_values("Lambda (A)"), keys.sort_values("Lambda (A)"), on="Lambda (A)",
+                            by="Element", tolerance=tolerance, direction="nearest")
+    found = np.zeros(len(lines), dtype=bool)
+    found[matched["position"].to_numpy()] = matched["found"].notna().to_numpy()
+
+    return linelist.loc[~found, [0, 1]]
+
+
+class ResultsStore:
+    """
+    Append-only store of the results of the fit.
+
+    | The rows are kept in a SQLite database (``<name>.db``) in WAL mode, next to the CSV file.
+      Each row is committed when it is added, so the results survive a crash, and the GUI or
+      another process can read them while the fit runs.
+    | The ``results`` table has one typed column for each column of the results, named like in the
+      CSV file, and the line of each spectrum (``Spectrum``, ``Element`` and ``Lambda (A)``) is unique.
+      A line added again replaces its previous result.
+    | The CSV file is written by ``export``, usually once at the end of the run. If the CSV file
+      was changed by someone else after the last export (like the manual fit of the GUI), it is
+      imported again when the store is opened to write.
+
+    :param fl_name: file name of the CSV file.
+    :param columns: names of the columns.
+    :param readonly: open the store only to read it, without creating or importing anything.
+    """
+
+    def __init__(self, fl_name, columns=None, readonly=False):
+        self.csv = Path(fl_name)
+        self.columns = columns if columns is not None else result_columns
+        self.key = [name for name in key_columns if name in self.columns]
+        if len(self.key) != len(key_columns):
+            self.key = []
+
+        if readonly:
+            self.conn = sqlite3.connect(self.path(fl_name).absolute().as_uri() + "?mode=ro", uri=True, timeout=30)
+            return
+
+        self.conn = sqlite3.connect(self.path(fl_name), timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        with self.conn:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            self.create()
+
+        self.sync()
+
+    @staticmethod
+    def quote(name):
+        """
+        Quote a column name for SQL.
+
+        :param name: the column name.
+        :return: the quoted name.
+        """
+
+        return '"{}"'.format(name.replace('"', '""'))
+
+    @staticmethod
+    def column_type(name):
+        """
+        SQL type of a column of the results.
+
+        :param name: the column name.
+        :return: ``"TEXT"``, ``"INTEGER"`` or ``"REAL"``.
+        """
+
+        if name in text_columns:
+            return "TEXT"
+        if name in integer_columns:
+            return "INTEGER"
+        return "REAL"
+
+    def create(self):
+        """
+        Create the results table, converting the rows of a table with other columns (like the
+        single JSON column of older versions).
+        """
+
+        names = [info[1] for info in self.conn.execute("PRAGMA table_info(results)")]
+        if names == ["position"] + self.columns:
+            return
+
+        rows = []
+        if "row" in names:
+            # Like in read_csv, the rows saved before the spectrum column existed belong to the first spectrum
+            rows = [row + [1 if name == "Spectrum" else None for name in self.columns[len(row):]]
+                    for row in (json.loads(row) for (row,) in
+                                self.conn.execute("SELECT row FROM results ORDER BY position"))]
+        elif names:
+            rows = [[dict(zip(names, row)).get(name) for name in self.columns]
+                    for row in self.conn.execute("SELECT * FROM results ORDER BY position")]
+
+        columns = ", ".join("{} {}".format(self.quote(name), self.column_type(name)) for name in self.columns)
+        if self.key:
+            columns += ", UNIQUE ({})".format(", ".join(self.quote(name) for name in self.key))
+        self.conn.execute("DROP TABLE IF EXISTS results")
+        self.conn.execute("CREATE TABLE results (position INTEGER PRIMARY KEY, {})".format(columns))
+        self.fill(rows)
+
+    @staticmethod
+    def path(fl_name):
+        """
+        File name of the database of a CSV file.
+
+        :param fl_name: file name of the CSV file.
+        :return: the path of the database.
+        """
+
+        return Path(fl_name).with_suffix(".db")
+
+    def csv_stamp(self):
+        """
+        Modification time and size of the CSV file.
+
+        :return: the stamp string, or None if the file does not exist.
+        """
+
+        try:
+            stat = os.stat(self.csv)
+        except FileNotFoundError:
+            return None
+        return "{}-{}".format(stat.st_mtime_ns, stat.st_size)
+
+    def outdated(self):
+        """
+        Check if the CSV file was changed after the last export or import.
+
+        :return: true if the CSV file exists and was changed, otherwise false.
+        """
+
+        stamp = self.csv_stamp()
+        cur = self.conn.execute("SELECT value FROM meta WHERE key = 'csv'").fetchone()
+        return stamp is not None and (cur is None or cur[0] != stamp)
+
+    def sync(self):
+        """
+        Import the CSV file if it was changed after the last export.
+        """
+
+        if not self.outdated():
+            return
+
+        stamp = self.csv_stamp()
+        prev = read_csv(self.csv)
+        rows = [] if prev is None else prev[self.columns].values.tolist()
+        with self.conn:
+            self.fill(rows)
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('csv', ?)", (stamp,))
+
+    def values(self, row):
+        """
+        Convert a row to the values of the columns of the table.
+
+        :param row: list with the values of the row. Missing values at the end are None.
+        :return: list with the values, with None for the missing ones.
+        """
+
+        values = []
+        for name, value in zip(self.columns, list(row) + [None] * (len(self.columns) - len(row))):
+            if isinstance(value, np.generic):
+                value = value.item()
+            if isinstance(value, float) and np.isnan(value):
+                value = None
+            elif value is not None and self.column_type(name) == "INTEGER":
+                value = int(value)
+            values.append(value)
+        return values
+
+    def insert_sql(self, position="?", conflict="", replace=False):
+        """
+        SQL to insert a row with its position.
+
+        :param position: SQL of the position.
+        :param conflict: the ``ON CONFLICT`` clause.
+        :param replace: replace the rows with the same position or line.
+        :return: the SQL string.
+        """
+
+        return "INSERT {}INTO results (position, {}) VALUES ({}, {}) {}".format(
+            "OR REPLACE " if replace else "", ", ".join(self.quote(name) for name in self.columns), position,
+            ", ".join("?" * len(self.columns)), conflict)
+
+    def fill(self, rows):
+        """
+        Replace all the results, keeping only the last row of each line.
+
+        :param rows: list with the rows.
+        """
+
+        rows = [self.values(row) for row in rows]
+        if self.key:
+            index = [self.columns.index(name) for name in self.key]
+            last = {tuple(row[i] for i in index): j for j, row in enumerate(rows)}
+            rows = [row for j, row in enumerate(rows) if last[tuple(row[i] for i in index)] == j]
+
+        self.conn.execute("DELETE FROM results")
+        self.conn.executemany(self.insert_sql(), [[i] + row for i, row in enumerate(rows)])
+
+    def append(self, row):
+        """
+        Add a row at the end of the results. The previous result of the same line is replaced in its place.
+
+        :param row: list with the values of the row.
+        """
+
+        conflict = ""
+        if self.key:
+            conflict = "ON CONFLICT ({}) DO UPDATE SET {}".format(
+                ", ".join(self.quote(name) for name in self.key),
+                ", ".join("{0} = excluded.{0}".format(self.quote(name)) for name in self.columns))
+        with self.conn:
+            self.conn.execute(self.insert_sql(position="(SELECT COALESCE(MAX(position) + 1, 0) FROM results)",
+                                              conflict=conflict), self.values(row))
+
+    def replace(self, position, row):
+        """
+        Replace a row of the results.
+
+        :param position: index of the row.
+        :param row: list with the values of the row.
+        """
+
+        with self.conn:
+            self.conn.execute(self.insert_sql(replace=True), [int(position)] + self.values(row))
+
+    def reset(self):
+        """
+        Remove all the results.
+        """
+
+        with self.conn:
+            self.conn.execute("DELETE FROM results")
+
+    def rows(self):
+        """
+        All the rows of the results, in order.
+
+        :return: list with the rows.
+        """
+
+        return [list(row) for row in self.conn.execute("SELECT {} FROM results ORDER BY position".format(
+            ", ".join(self.quote(name) for name in self.columns)))]
+
+    def read(self):
+        """
+        Read the results.
+
+        :return: the pandas dataframe with the results.
+        """
+
+        results = pd.DataFrame(self.rows(), columns=self.columns)
+        for name in self.columns:
+            if self.column_type(name) == "REAL" or \
+                    (self.column_type(name) == "INTEGER" and results[name].isna().any()):
+                results[name] = results[name].astype(float)
+        return results
+
+    def export(self):
+        """
+        Write the results to the CSV file, replacing it at once.
+        """
+
+        results = self.read()
+        fd, tmp = tempfile.mkstemp(dir=self.csv.parent, prefix=".tmp_", suffix=".csv")
+        os.close(fd)
+        try:
+            results.to_csv(tmp, index=False, float_format="%.4f")
+            os.replace(tmp, self.csv)
+        except BaseException:
+            os.remove(tmp)
+            raise
+
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('csv', ?)", (self.csv_stamp(),))
+
+    def close(self):
+        """
+        Close the database.
+        """
+
+        self.conn.close()
+
+
+def read_fit_curves(folder, elem, lamb, curves=None):
+    """
+    Read the fitted curves of a line, saved in its own ``fit_<elem>_<lamb>_ang_<n>.csv`` files
+    or in the file of ``FitCurves``, whichever was written last.
+
+    :param folder: directory of the results.
+    :param elem: element with the order.
+    :param lamb: central wavelength of the line.
+    :param curves: curves of the ``FitCurves`` file, returned by ``FitCurves.load``. If None, the file is read.
+    :return: list with the dataframes of the curves.
+    """
+
+    if curves is None:
+        curves = FitCurves.load(folder)
+    fit, batch = curves.get((elem, round(float(lamb), 4)), (None, []))
+
+    path = Path(folder).joinpath("On_time_Plots")
+    first = path.joinpath("fit_{}_{}_ang_1.csv".format(elem, lamb))
+    if not os.path.isfile(first) or (fit is not None and os.stat(first).st_mtime_ns <= fit):
+        return batch
+
+    data = []
+    while True:
+        file = path.joinpath("fit_{}_{}_ang_{}.csv".format(elem, lamb, len(data) + 1))
+        if not os.path.isfile(file):
+            break
+        data.append(pd.read_csv(file))
+    return data
+
+
+class FitCurves:
+    """
+    Fitted curves of the lines for the batch output mode.
+
+    | Instead of a ``fit_<elem>_<lamb>_ang_<n>.csv`` file written for each line, the curves are
+      kept in memory and appended to ``On_time_Plots/fit_curves.csv`` every ``checkpoint`` lines
+      (``flush``) and at the end of the run (``export``). They are read back by :func:`read_fit_curves`.
+    | ``export`` also rewrites the file with only the last fit of each line, so it does not grow
+      across the runs.
+    | The ``fit_<elem>_<lamb>_ang_<n>.csv`` files of previous fits of the lines are kept until
+      ``export``, which removes them as they are outdated.
+
+    :param folder: directory of the results.
+    :param checkpoint: number of lines kept in memory before they are written.
+    """
+
+    columns = ["Element", "Lambda (A)", "Curve", "Fit", "Wave", "Flux"]
+
+    def __init__(self, folder, checkpoint=50):
+        self.folder = folder
+        self.checkpoint = checkpoint
+        self.lines = []
+        self.written = []
+
+    @staticmethod
+    def path(folder):
+        """
+        File name of the curves.
+
+        :param folder: directory of the results.
+        :return: the path of the file.
+        """
+
+        return Path(folder).joinpath("On_time_Plots", "fit_curves.csv")
+
+    def add(self, elem, lamb, curves):
+        """
+        Keep the fitted curves of a line, replacing the ones of a previous fit of the same line.
+
+        :param elem: element with the order.
+        :param lamb: central wavelength of the line.
+        :param curves: list with the dataframes of the curves.
+        """
+
+        self.lines.append((elem, lamb, time.time_ns(), curves))
+        if len(self.lines) >= self.checkpoint:
+            self.flush()
+
+    def flush(self):
+        """
+        Write the curves kept in memory.
+        """
+
+        if not self.lines:
+            return
+
+        blocks = []
+        for elem, lamb, fit, curves in self.lines:
+            for j, curve in enumerate(curves):
+                blocks.append(pd.DataFrame({"Element": elem, "Lambda (A)": lamb, "Curve": j + 1, "Fit": fit,
+                                            "Wave": curve.iloc[:, 0].to_numpy(),
+                                            "Flux": curve.iloc[:, 1].to_numpy()}, columns=self.columns))
+            self.written.append((elem, lamb))
+
+        path = self.path(self.folder)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        pd.concat(blocks).to_csv(path, mode="a", header=not path.is_file(), index=False, float_format="%.4f")
+        self.lines = []
+
+    def export(self):
+        """
+        Write the curves kept in memory at the end of the run, keeping only the last fit of each line
+        in the file, and remove the outdated ``fit_<elem>_<lamb>_ang_<n>.csv`` files of the lines written.
+        """
+
+        self.flush()
+
+        data = self.read(self.folder)
+        if data is not None:
+            path = self.path(self.folder)
+            fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=".tmp_", suffix=".csv")
+            os.close(fd)
+            try:
+                data.to_csv(tmp, index=False, float_format="%.4f")
+                os.replace(tmp, path)
+            except BaseException:
+                os.remove(tmp)
+                raise
+
+        for elem, lamb in self.written:
+            j = 1
+            file = Path(self.folder).joinpath("On_time_Plots", "fit_{}_{}_ang_{}.csv".format(elem, lamb, j))
+            while os.path.isfile(file):
+                os.remove(file)
+                j += 1
+                file = file.with_name("fit_{}_{}_ang_{}.csv".format(elem, lamb, j))
+        self.written = []
+
+    @classmethod
+    def read(cls, folder):
+        """
+        Read the last fit of each line of the file of the curves.
+
+        :param folder: directory of the results.
+        :return: the pandas dataframe with the rows of the file, or None if the file does not exist or is empty.
+        """
+
+        try:
+            data = pd.read_csv(cls.path(folder), dtype={"Element": str})
+        except (FileNotFoundError, pd.errors.EmptyDataError):
+            return None
+
+        return data[data["Fit"] == data.groupby(["Element", "Lambda (A)"])["Fit"].transform("max")]
+
+    @classmethod
+    def load(cls, folder):
+        """
+        Read the file of the curves.
+
+        :param folder: directory of the results.
+        :return: dictionary with the time of the fit (``time.time_ns``) and the list of the dataframes of
+                 the curves of each line, with the element and the wavelength rounded to 4 decimals as key.
+        """
+
+        data = cls.read(folder)
+        if data is None:
+            return {}
+
+        curves = {}
+        for (elem, lamb, _), curve in data.groupby(["Element", "Lambda (A)", "Curve"], sort=False):
+            curves.setdefault((elem, round(lamb, 4)), (int(curve["Fit"].iloc[0]), []))[1].append(
+                pd.DataFrame({0: curve["Wave"].to_numpy(), 1: curve["Flux"].to_numpy()}))
+        return curves
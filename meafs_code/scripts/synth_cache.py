@@ -0,0 +1,343 @@
+"""
+| MEAFS Synthetic Spectra Cache
+| Matheus J. Castro
+
+| Persistent on-disk cache of the TurboSpectrum synthetic spectra, continuum opacities and trimmed line data.
+"""
+
+from pathlib import Path
+import pandas as pd
+import numpy as np
+import tempfile
+import hashlib
+import shutil
+import os
+
+
+class FileCache:
+    """
+    Folder of cache entries with a size limit.
+
+    | Keeps the count of hits and misses and the total size of the entries, the files ending with
+      ``suffix``. When the size goes over ``max_size``, the least recently used entries are removed.
+    | Entries are written to a temporary file and renamed, so other processes never read a partial file.
+
+    :param folder: directory of the cache.
+    :param max_size: maximum size of the cache in bytes.
+    """
+
+    suffix = ""
+
+    def __init__(self, folder, max_size):
+        self.folder = Path(folder)
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(self.folder, exist_ok=True)
+        self.size = sum(entry.stat().st_size for entry in os.scandir(self.folder) if entry.name.endswith(self.suffix))
+
+    def write_entry(self, fl_name, write, mode="wb"):
+        """
+        Write an entry of the cache through a temporary file.
+
+        :param fl_name: the entry, replaced if it already exists.
+        :param write: function called with the open temporary file to write its content.
+        :param mode: mode to open the temporary file.
+        """
+
+        fd, tmp_name = tempfile.mkstemp(dir=self.folder, suffix=".tmp")
+        with os.fdopen(fd, mode) as file:
+            write(file)
+        self.replace(tmp_name, fl_name)
+
+    def replace(self, tmp_name, fl_name):
+        """
+        Move a temporary file to an entry of the cache, keeping the total size up to date.
+
+        :param tmp_name: the temporary file.
+        :param fl_name: the entry, replaced if it already exists.
+        """
+
+        try:
+            self.size -= os.path.getsize(fl_name)
+        except OSError:
+            pass
+        os.replace(tmp_name, fl_name)
+        self.size += os.path.getsize(fl_name)
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the cache is under the size limit.
+        """
+
+        entries = [entry for entry in os.scandir(self.folder) if entry.name.endswith(self.suffix)]
+        entries.sort(key=lambda entry: entry.stat().st_mtime_ns)
+        self.size = sum(entry.stat().st_size for entry in entries)
+
+        for entry in entries:
+            if self.size <= self.max_size:
+                break
+            try:
+                self.size -= entry.stat().st_size
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+    def clear(self):
+        """
+        Remove all entries of the cache.
+        """
+
+        for entry in os.scandir(self.folder):
+            if entry.name.endswith(self.suffix):
+                os.remove(entry.path)
+        self.size = 0
+
+
+class SpectrumCache(FileCache):
+    """
+    Content-addressed cache of synthetic spectra.
+
+    | The key is a hash of the rendered configuration file (with the abundances rounded to
+      ``precision`` decimals) and of the modification time and size of every file it refers to,
+      like the line data and the model atmospheres.
+    | Spectra are stored as binary ``.npy`` arrays with only the wavelength and flux columns.
+      When the total size goes over ``max_size``, the least recently used spectra are removed.
+
+    :param folder: directory of the cache. Default is ``~/.cache/meafs/spectra``.
+    :param max_size: maximum size of the cache in bytes.
+    :param precision: number of decimals of the abundances in the key.
+    """
+
+    suffix = ".npy"
+
+    def __init__(self, folder=None, max_size=500*1024**2, precision=4):
+        if folder is None:
+            folder = Path.home().joinpath(".cache", "meafs", "spectra")
+        super().__init__(folder, max_size)
+        self.precision = precision
+
+    def key(self, template, exclude=None):
+        """
+        Find the cache key of the current state of a configuration template.
+
+        :param template: the ``turbospec_functions.ConfigTemplate`` object.
+        :param exclude: files to ignore, like the output of the synthesis.
+        :return: the key as a hexadecimal string.
+        """
+
+        exclude = [] if exclude is None else [os.path.abspath(fl_name) for fl_name in exclude]
+
+        values = {}
+        for name, value in template.slots.items():
+            if value is None:
+                continue
+            if name.endswith("_ab"):
+                values[name] = "{:.{}f}".format(value, self.precision)
+            else:
+                values[name] = "{:.6f}".format(value)
+
+        key = hashlib.sha256(template.text(values).encode())
+        for fl_name in template.referenced_files():
+            if fl_name in exclude:
+                continue
+            try:
+                stat = os.stat(fl_name)
+            except OSError:
+                continue
+            key.update("{}:{}:{}".format(os.path.basename(fl_name), stat.st_mtime_ns, stat.st_size).encode())
+
+        return key.hexdigest()
+
+    def get(self, key, mmap=False):
+        """
+        Read a spectrum from the cache.
+
+        :param key: the cache key.
+        :param mmap: memory-map the file instead of reading it.
+        :return: the spectrum or None if it is not in the cache.
+        """
+
+        fl_name = self.folder.joinpath(key + ".npy")
+        try:
+            spec = np.load(fl_name, mmap_mode="r" if mmap else None)
+            # Mark as recently used
+            os.utime(fl_name)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return pd.DataFrame({0: spec[0], 1: spec[1]})
+
+    def put(self, key, spec):
+        """
+        Write a spectrum in the cache, removing the least recently used ones if needed.
+
+        :param key: the cache key.
+        :param spec: the spectrum.
+        """
+
+        data = np.array([spec[0], spec[1]], dtype=np.float64)
+        self.write_entry(self.folder.joinpath(key + self.suffix), lambda file: np.save(file, data))
+
+        if self.size > self.max_size:
+            self.evict()
+
+
+class OpacityCache(FileCache):
+    """
+    Cache of the continuum opacity files written by the babsma stage of TurboSpectrum.
+
+    | The key is a hash of the text given by ``turbospec_functions.ConfigTemplate.opacity_state``,
+      which holds everything the opacity depends on: the model atmosphere, the wavelength range
+      and the abundances read by babsma.
+    | Each opacity file is stored as ``<key>.<index>.opac``.
+
+    :param folder: directory of the cache. Default is ``~/.cache/meafs/opacity``.
+    :param max_size: maximum size of the cache in bytes.
+    """
+
+    suffix = ".opac"
+
+    def __init__(self, folder=None, max_size=2*1024**3):
+        if folder is None:
+            folder = Path.home().joinpath(".cache", "meafs", "opacity")
+        super().__init__(folder, max_size)
+
+    def key_state(self, state):
+        """
+        Find the cache key of an opacity state.
+
+        :param state: the text of the opacity state.
+        :return: the key as a hexadecimal string.
+        """
+
+        return hashlib.sha256(state.encode()).hexdigest()
+
+    def restore(self, key, fl_names):
+        """
+        Copy the cached opacity files to their places.
+
+        :param key: the cache key.
+        :param fl_names: the opacity files written by babsma.
+        :return: true if all files were in the cache.
+        """
+
+        entries = [self.folder.joinpath("{}.{}{}".format(key, i, self.suffix)) for i in range(len(fl_names))]
+        if not all(os.path.isfile(entry) for entry in entries):
+            self.misses += 1
+            return False
+
+        for entry, fl_name in zip(entries, fl_names):
+            os.makedirs(os.path.dirname(fl_name), exist_ok=True)
+            shutil.copyfile(entry, fl_name)
+            # Mark as recently used
+            os.utime(entry)
+
+        self.hits += 1
+        return True
+
+    def store(self, key, fl_names):
+        """
+        Store the opacity files written by babsma, removing the least recently used ones if needed.
+
+        :param key: the cache key.
+        :param fl_names: the opacity files.
+        """
+
+        for i, fl_name in enumerate(fl_names):
+            with open(fl_name, "rb") as source:
+                self.write_entry(self.folder.joinpath("{}.{}{}".format(key, i, self.suffix)),
+                                 lambda file: shutil.copyfileobj(source, file))
+
+        if self.size > self.max_size:
+            self.evict()
+
+
+class LinelistCache(FileCache):
+    """
+    Cache of the line data files trimmed to the range of a synthesis.
+
+    | The key is a hash of the content of the source file and of the trimmed range.
+    | Each trimmed file is stored as ``<key>.list`` and is given to TurboSpectrum in place of
+      the source file.
+
+    :param folder: directory of the cache. Default is ``~/.cache/meafs/linelists``.
+    :param max_size: maximum size of the cache in bytes.
+    """
+
+    suffix = ".list"
+
+    def __init__(self, folder=None, max_size=1024**3):
+        if folder is None:
+            folder = Path.home().joinpath(".cache", "meafs", "linelists")
+        super().__init__(folder, max_size)
+        self.hashes = {}
+
+    def source_hash(self, fl_name):
+        """
+        Hash of the content of a source file. It is computed only once for each modification of the file.
+
+        :param fl_name: file name of the source file.
+        :return: the hash as a hexadecimal string.
+        """
+
+        stat = os.stat(fl_name)
+        stamp = (os.path.abspath(fl_name), stat.st_mtime_ns, stat.st_size)
+        if stamp not in self.hashes:
+            key = hashlib.sha256()
+            with open(fl_name, "rb") as file:
+                for block in iter(lambda: file.read(1024**2), b""):
+                    key.update(block)
+            self.hashes[stamp] = key.hexdigest()
+
+        return self.hashes[stamp]
+
+    def key_range(self, fl_name, low, upp):
+        """
+        Find the cache key of a trimmed file.
+
+        :param fl_name: file name of the source file.
+        :param low: lower limit of the range.
+        :param upp: upper limit of the range.
+        :return: the key as a hexadecimal string.
+        """
+
+        return hashlib.sha256("{}:{:.3f}:{:.3f}".format(self.source_hash(fl_name), low, upp).encode()).hexdigest()
+
+    def find(self, key):
+        """
+        Find a trimmed file in the cache.
+
+        :param key: the cache key.
+        :return: the file name, or None if it is not in the cache.
+        """
+
+        fl_name = self.folder.joinpath(key + self.suffix)
+        if not os.path.isfile(fl_name):
+            self.misses += 1
+            return None
+
+        # Mark as recently used
+        os.utime(fl_name)
+        self.hits += 1
+        return str(fl_name)
+
+    def store(self, key, text):
+        """
+        Write a trimmed file in the cache, removing the least recently used ones if needed.
+
+        :param key: the cache key.
+        :param text: the content of the trimmed file.
+        :return: the file name.
+        """
+
+        fl_name = self.folder.joinpath(key + self.suffix)
+        self.write_entry(fl_name, lambda file: file.write(text), mode="w")
+
+        if self.size > self.max_size:
+            self.evict()
+
+        return str(fl_name)
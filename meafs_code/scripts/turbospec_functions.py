@@ -5,12 +5,476 @@
 | TurboSpectrum module functions.
 """
 
-from scipy.optimize import minimize
+from scipy.optimize import minimize, minimize_scalar
+from scipy.interpolate import PchipInterpolator
 import pandas as pd
 import numpy as np
 import subprocess
+import tempfile
+import asyncio
+import shutil
+import signal
+import time
+import os
+import re
 
 from . import fit_functions as ff
+from . import synth_cache as sc
+
+
+class ConfigTemplate:
+    """
+    In-memory template of the Turbospectrum2019 configuration file.
+
+    | The file is parsed once into text chunks and typed slots: ``lam_min``, ``lam_max``, one
+      ``<elem>_ab`` for each ``foreach <elem>_ab (value)`` loop and ``lam_step`` for every
+      ``'LAMBDA_STEP:'`` entry. Only the first ``foreach`` of each element is used.
+    | Slots are changed only in memory and the file is rendered to disk right before a run,
+      and only when something changed.
+    | The last synthesized spectra are kept with their abundances, step and input file stamps, so
+      a range inside one of them is sliced instead of synthesized again (see :meth:`find_window`).
+
+    :param fl_name: file name of the TurboSpectrum configuration file.
+    """
+
+    range_pattern = re.compile(r"^[ \t]*set\s+(lam_min|lam_max)\s*=\s*'([^']*)'", re.MULTILINE)
+    abund_pattern = re.compile(r"^[ \t]*foreach\s+(\w+_ab)\s*\(([^)]*)\)", re.MULTILINE)
+    step_pattern = re.compile(r"'LAMBDA_STEP\s*:'\s*'([^']*)'")
+    output_pattern = re.compile(r"'(?:MODELOPACFILE|RESULTFILE)\s*:'\s*'([^']*)'")
+    opacity_pattern = re.compile(r"'MODELOPACFILE\s*:'\s*'([^']*)'")
+    # Here-document input of the babsma (continuum opacity) and bsyn (synthesis) programs
+    stage_pattern = re.compile(r"^[ \t]*(\S*(babsma|bsyn)\S*)[^\n]*<<[ \t]*['\"]?(\w+)['\"]?[^\n]*\n(.*?)^\3[ \t]*$",
+                               re.MULTILINE | re.DOTALL)
+    # Number of line data files read by bsyn, followed by one file per line
+    linelist_pattern = re.compile(r"'NFILES\s*:'\s*'\s*(\d+)\s*'[^\n]*\n")
+
+    def __init__(self, fl_name):
+        self.fl_name = fl_name
+        self.chunks = []
+        self.slots = {}
+        self.raw = {}
+        self.dirty = False
+        self.stamp = None
+        self.files = None
+        self.windows = []
+        self.step = None
+        self.opacity_key = None
+        self.base_step = None
+        self.load()
+
+    def load(self):
+        """
+        Read and parse the configuration file.
+        """
+
+        with open(self.fl_name, 'r') as file:
+            fl = file.read()
+
+        matches = []
+        for pattern in [self.range_pattern, self.abund_pattern]:
+            for match in pattern.finditer(fl):
+                # Only the first occurrence of each slot is used
+                if match.group(1) not in [m[0] for m in matches]:
+                    matches.append((match.group(1), match.start(2), match.end(2), match.group(2)))
+        # The step of babsma and bsyn are changed together
+        for match in self.step_pattern.finditer(fl):
+            matches.append(("lam_step", match.start(1), match.end(1), match.group(1)))
+        matches.sort(key=lambda m: m[1])
+
+        self.chunks = []
+        self.slots = {}
+        self.raw = {}
+        pos = 0
+        for name, start, end, value in matches:
+            self.chunks.append(fl[pos:start])
+            self.chunks.append(name)
+            if name not in self.raw:
+                self.raw[name] = value
+                try:
+                    self.slots[name] = float(value)
+                except ValueError:
+                    self.slots[name] = None
+            pos = end
+        self.chunks.append(fl[pos:])
+
+        self.base_step = self.slots.get("lam_step")
+        self.dirty = False
+        self.stamp = self.file_stamp()
+        self.files = None
+        self.windows = []
+
+    def file_stamp(self):
+        """
+        Modification stamp of the file on disk.
+
+        :return: the modification time and size of the file.
+        """
+
+        stat = os.stat(self.fl_name)
+        return stat.st_mtime_ns, stat.st_size
+
+    def has_elem(self, elem):
+        """
+        Check if the element has an abundance slot.
+
+        :param elem: element to look for.
+        :return: true if finds it; false if not.
+        """
+
+        return elem + "_ab" in self.slots
+
+    def get(self, name):
+        """
+        Get the current value of a slot.
+
+        :param name: slot name.
+        :return: the value.
+        """
+
+        value = self.slots[name]
+        if value is None:
+            raise ValueError("The value of {} in {} is not a single number: ({}).".format(
+                name, self.fl_name, self.raw[name].strip()))
+        return value
+
+    def set(self, name, value):
+        """
+        Change the value of a slot in memory.
+
+        :param name: slot name.
+        :param value: new value.
+        """
+
+        value = float(value)
+        if self.slots[name] != value:
+            self.slots[name] = value
+            self.raw[name] = str(value)
+            self.dirty = True
+
+    def abundances(self):
+        """
+        Current abundances.
+
+        :return: dictionary with the abundance slots and values.
+        """
+
+        return {name: round(value, 6) for name, value in self.slots.items()
+                if name.endswith("_ab") and value is not None}
+
+    def state(self):
+        """
+        Current abundances, wavelength step and stamps of the input files (see :meth:`input_stamps`),
+        which define a synthesized spectrum apart from its range.
+
+        :return: dictionary with the slots and values.
+        """
+
+        state = self.abundances()
+        if self.slots.get("lam_step") is not None:
+            state["lam_step"] = round(self.slots["lam_step"], 9)
+        state["files"] = self.input_stamps()
+        return state
+
+    def input_stamps(self):
+        """
+        Modification stamps of the input files of the script (see :meth:`referenced_files`), so a
+        change of the line data or of the model atmosphere is noticed.
+
+        :return: tuple with the path, modification time and size of each file.
+        """
+
+        stamps = []
+        for fl_name in self.referenced_files():
+            try:
+                stat = os.stat(fl_name)
+            except OSError:
+                continue
+            stamps.append((fl_name, stat.st_mtime_ns, stat.st_size))
+        return tuple(stamps)
+
+    def find_window(self):
+        """
+        Find a synthesized spectrum of the current state (see :meth:`state`) that covers the current range.
+
+        :return: the spectrum sliced to the current range, or None if there is none.
+        """
+
+        low, upp = self.slots.get("lam_min"), self.slots.get("lam_max")
+        if low is None or upp is None:
+            return None
+
+        state = self.state()
+        for window_state, spec in reversed(self.windows):
+            half_step = (spec[0].iloc[1] - spec[0].iloc[0]) / 2
+            covers = spec[0].iloc[0] <= low + half_step and spec[0].iloc[-1] >= upp - half_step
+            if window_state == state and covers:
+                return spec[(spec[0] >= low - half_step) & (spec[0] <= upp + half_step)].reset_index(drop=True)
+
+        return None
+
+    def add_window(self, spec, size=8):
+        """
+        Keep a synthesized spectrum of the current state to be reused by :meth:`find_window`.
+
+        :param spec: the synthetic spectrum.
+        :param size: number of spectra kept.
+        """
+
+        if len(spec) < 2:
+            return
+        self.windows.append((self.state(), spec.copy()))
+        del self.windows[:-size]
+        self.step = spec[0].iloc[1] - spec[0].iloc[0]
+
+    def set_range(self, lamb, cut_val):
+        """
+        Change the spectrum range.
+
+        :param lamb: central wavelength.
+        :param cut_val: range to be applied.
+        """
+
+        self.set("lam_min", lamb - cut_val)
+        self.set("lam_max", lamb + cut_val)
+
+    def text(self, values=None):
+        """
+        Render the configuration file text.
+
+        :param values: dictionary to overwrite the text of some slots.
+        :return: the text with the current slot values.
+        """
+
+        raw = self.raw if values is None else dict(self.raw, **values)
+        return "".join(raw[chunk] if i % 2 else chunk for i, chunk in enumerate(self.chunks))
+
+    def outputs(self):
+        """
+        Find the files written by the TurboSpectrum runs (``'MODELOPACFILE:'`` and ``'RESULTFILE :'``).
+
+        :return: list with the paths as written in the script.
+        """
+
+        return self.output_pattern.findall(self.text())
+
+    def referenced_files(self):
+        """
+        | Find the input files referred to in the script, like line data and model atmospheres.
+        | The simple ``set`` and single valued ``foreach`` variables are expanded, and the outputs
+          and the script itself are ignored.
+
+        :return: list with the paths of the existing files.
+        """
+
+        if self.files is not None:
+            return self.files
+
+        text = self.text()
+        variables = self.variables()
+
+        def expand(token):
+            return self.expand_path(token, variables)
+
+        ignore = [expand(out) for out in self.outputs()] + [os.path.abspath(self.fl_name)]
+
+        self.files = []
+        for token in set(re.findall(r"[^\s'\"()<>|;]+", text)):
+            if "/" not in token and "." not in token:
+                continue
+            path = expand(token)
+            if "$" not in path and path not in ignore and path not in self.files and os.path.isfile(path):
+                self.files.append(path)
+        self.files.sort()
+
+        return self.files
+
+    def variables(self):
+        """
+        Find the simple ``set`` and single valued ``foreach`` variables of the script.
+        The values of the slots are normalized, so ``7.50`` and ``7.5`` give the same expansion.
+
+        :return: dictionary with the variable names and values.
+        """
+
+        text = self.text()
+        variables = dict(re.findall(r"^[ \t]*set\s+(\w+)\s*=\s*'?([^'\s]+)'?", text, re.MULTILINE))
+        variables.update(re.findall(r"^[ \t]*foreach\s+(\w+)\s*\(\s*([^)\s]+)\s*\)", text, re.MULTILINE))
+        variables.update({name: repr(value) for name, value in self.slots.items() if value is not None})
+        return variables
+
+    @staticmethod
+    def expand(text, variables):
+        """
+        Replace the ``$name`` and ``${name}`` variables in a text.
+
+        :param text: the text.
+        :param variables: dictionary with the variable names and values.
+        :return: the expanded text.
+        """
+
+        for _ in range(5):
+            new = re.sub(r"\$\{?(\w+)\}?", lambda m: variables.get(m.group(1), m.group(0)), text)
+            if new == text:
+                break
+            text = new
+        return text
+
+    def expand_path(self, token, variables):
+        """
+        Expand the variables of a path and make it absolute, relative to the script folder.
+
+        :param token: the path as written in the script.
+        :param variables: dictionary with the variable names and values.
+        :return: the absolute path.
+        """
+
+        folder = os.path.dirname(os.path.abspath(self.fl_name))
+        return os.path.normpath(os.path.join(folder, os.path.expanduser(self.expand(token, variables))))
+
+    def stages(self):
+        """
+        Find the babsma (continuum opacity) and bsyn (synthesis) runs of the script.
+
+        :return: dictionary with the ``re.Match`` of each stage in the rendered text, or None if
+                 the script does not have both stages.
+        """
+
+        stages = {}
+        for match in self.stage_pattern.finditer(self.text()):
+            stages.setdefault(match.group(2), match)
+
+        return stages if len(stages) == 2 else None
+
+    def opacity_state(self):
+        """
+        | Describe everything the continuum opacity depends on: the expanded input of babsma (model
+          atmosphere, wavelength range, metallicity and the abundances it reads) and the
+          modification time of the files it refers to.
+        | An abundance that babsma does not read does not change the state.
+
+        :return: the text of the state, or None if the script does not have both stages.
+        """
+
+        stages = self.stages()
+        if stages is None:
+            return None
+
+        variables = self.variables()
+        outputs = self.opacity_files()
+        state = self.expand(stages["babsma"].group(0), variables)
+        for token in sorted(set(re.findall(r"[^\s'\"()<>|;]+", state))):
+            path = self.expand_path(token, variables)
+            if os.path.isfile(path) and path not in outputs:
+                stat = os.stat(path)
+                state += "\n{}:{}:{}".format(os.path.basename(path), stat.st_mtime_ns, stat.st_size)
+
+        return state
+
+    def opacity_files(self):
+        """
+        Find the continuum opacity files written by babsma.
+
+        :return: list with the absolute paths, or an empty list if they are not known, e.g. when
+                 they depend on a variable with several values.
+        """
+
+        stages = self.stages()
+        if stages is None:
+            return []
+
+        variables = self.variables()
+        files = [self.expand_path(out, variables) for out in self.opacity_pattern.findall(stages["babsma"].group(4))]
+        return [] if any("$" in fl_name for fl_name in files) else files
+
+    def linelist_files(self):
+        """
+        Find the line data files read by bsyn (the lines after ``'NFILES   :'``).
+
+        :return: list with the start and end of each path in the rendered text and the absolute path
+                 of the existing files.
+        """
+
+        text = self.text()
+        bsyn = [match for match in self.stage_pattern.finditer(text) if match.group(2) == "bsyn"]
+        if not bsyn:
+            return []
+
+        variables = self.variables()
+        files = []
+        for match in self.linelist_pattern.finditer(text, bsyn[0].start(4), bsyn[0].end(4)):
+            pos = match.end()
+            for _ in range(int(match.group(1))):
+                line = re.match(r"[ \t]*'?([^'\s]*)'?[^\n]*\n?", text[pos:])
+                path = self.expand_path(line.group(1), variables)
+                if line.group(1) and "$" not in path and os.path.isfile(path):
+                    files.append((pos + line.start(1), pos + line.end(1), path))
+                pos += line.end()
+
+        return files
+
+    def run_script(self, skip_babsma=False, linelists=None):
+        """
+        Write the copy of the script that is run, next to the script.
+
+        | When ``skip_babsma`` is true, the input of babsma is sent to ``/dev/null``, so the
+          script structure does not change.
+
+        :param skip_babsma: skip the babsma stage.
+        :param linelists: dictionary with the start and end of line data paths in the rendered text
+                          (see :meth:`linelist_files`) and the files to use instead.
+        :return: the file name of the copy.
+        """
+
+        text = self.text()
+        changes = dict(linelists) if linelists is not None else {}
+        if skip_babsma:
+            babsma = self.stages()["babsma"]
+            changes[(babsma.start(1), babsma.end(1))] = "cat > /dev/null"
+
+        for (start, end), new in sorted(changes.items(), reverse=True):
+            text = text[:start] + new + text[end:]
+
+        fl_name = self.fl_name + ".run"
+        if not os.path.isfile(fl_name) or open(fl_name).read() != text:
+            with open(fl_name, "w") as file:
+                file.write(text)
+            shutil.copymode(self.fl_name, fl_name)
+
+        return fl_name
+
+    def render(self):
+        """
+        Write the configuration file to disk if any slot changed.
+        """
+
+        if self.dirty:
+            with open(self.fl_name, "w") as file:
+                file.write(self.text())
+            self.dirty = False
+            self.stamp = self.file_stamp()
+
+
+templates = {}
+
+
+def get_template(fl_name):
+    """
+    Get the template of a Turbospectrum2019 configuration file, parsing it only once
+    or when it was changed by something else.
+
+    :param fl_name: file name of the TurboSpectrum configuration file.
+    :return: the ``ConfigTemplate`` object.
+    """
+
+    key = os.path.abspath(fl_name)
+    template = templates.get(key)
+
+    if template is None:
+        template = templates[key] = ConfigTemplate(fl_name)
+    elif template.stamp != template.file_stamp():
+        template.load()
+
+    return template
 
 
 def check_elem_configfl(fl_name, elem):
@@ -22,16 +486,7 @@ def check_elem_configfl(fl_name, elem):
     :return: true if finds it; false if not.
     """
 
-    with open(fl_name, 'r') as file:
-        fl = file.read()
-
-    elem = "foreach " + elem + "_ab"
-    pos = fl.find(elem)
-
-    if pos == -1:
-        return False
-    else:
-        return True
+    return get_template(fl_name).has_elem(elem)
 
 
 def change_spec_range_configfl(fl_name, lamb, cut_val):
@@ -43,21 +498,7 @@ def change_spec_range_configfl(fl_name, lamb, cut_val):
     :param cut_val: range to be applied.
     """
 
-    spec_range = [lamb - cut_val, lamb + cut_val]
-
-    with open(fl_name, 'r') as file:
-        fl = file.read()
-
-    for i, str_i in enumerate(["set lam_min    = ", "set lam_max    = "]):
-        pos = fl.find(str_i)
-        # noinspection PyListCreation
-        pos = [pos + fl[pos:].find("'") + 1]
-        # noinspection
-        pos.append(pos[0] + fl[pos[0]:].find("'"))
-        fl = fl[:pos[0]] + str(spec_range[i]) + fl[pos[1]:]
-
-    with open(fl_name, "w") as file:
-        file.write(fl)
+    get_template(fl_name).set_range(lamb, cut_val)
 
 
 def change_abund_configfl(fl_name, elem, abund=None, find=True):
@@ -72,40 +513,738 @@ def change_abund_configfl(fl_name, elem, abund=None, find=True):
     :return: abundance.
     """
 
-    with open(fl_name, 'r') as file:
-        fl = file.read()
-
-    elem = "foreach " + elem + "_ab"
-    pos = fl.find(elem)
-    pos += fl[pos:].find("(") + 1
-    pos_end = pos + fl[pos:].find(")")
+    template = get_template(fl_name)
 
     if find:
-        abund = float(fl[pos:pos_end])
+        abund = template.get(elem + "_ab")
     else:
-        fl = fl[:pos] + str(abund) + fl[pos_end:]
-
-        with open(fl_name, "w") as file:
-            file.write(fl)
+        template.set(elem + "_ab", abund)
 
     return abund
 
 
-def run_configfl(config_fl):
+def change_step_configfl(fl_name, factor=1.):
+    """
+    Change the wavelength step in Turbospectrum2019 configuration file to a multiple of the
+    step of the file, e.g. to run the first fit stages at a coarser sampling.
+
+    :param fl_name: file name of the TurboSpectrum configuration file.
+    :param factor: multiple of the original step, 1 to return to it.
+    :return: the factor applied, 1 if the file has no ``'LAMBDA_STEP:'`` entry.
+    """
+
+    template = get_template(fl_name)
+    if template.base_step is None:
+        return 1.
+
+    template.set("lam_step", template.base_step * factor)
+    return factor
+
+
+def flush_configfl(fl_name):
+    """
+    Write the pending changes of the Turbospectrum2019 configuration file to disk.
+
+    :param fl_name: file name of the TurboSpectrum configuration file.
+    """
+
+    get_template(fl_name).render()
+
+
+cache = None
+opacity_cache = None
+
+
+class SynthesisCancelled(Exception):
+    """
+    Raised by the syntheses when their ``cancel_event`` is set before or while they run.
+    """
+
+
+def enable_cache(folder=None, max_size=500*1024**2, precision=4):
+    """
+    Enable the persistent cache of synthetic spectra used by ``synthesize``.
+
+    :param folder: directory of the cache. Default is ``~/.cache/meafs/spectra``.
+    :param max_size: maximum size of the cache in bytes.
+    :param precision: number of decimals of the abundances in the cache key.
+    :return: the ``synth_cache.SpectrumCache`` object.
+    """
+
+    global cache
+
+    cache = sc.SpectrumCache(folder=folder, max_size=max_size, precision=precision)
+    return cache
+
+
+def read_spectrum(fl_name, mmap=False):
+    """
+    Read the wavelength and normalized flux of a TurboSpectrum output spectrum.
+
+    | The whitespace separated text is parsed straight into float64 arrays with the C parser of
+      ``numpy.loadtxt``, without building a full ``pandas.read_csv`` table. Binary ``.npy``
+      spectra (with one row per column, like in the cache) are also accepted and can be
+      memory-mapped.
+
+    :param fl_name: file name of the spectrum.
+    :param mmap: memory-map a ``.npy`` spectrum instead of reading it.
+    :return: the spectrum.
+    """
+
+    if str(fl_name).endswith(".npy"):
+        data = np.load(fl_name, mmap_mode="r" if mmap else None)
+    else:
+        try:
+            data = np.loadtxt(fl_name, dtype=np.float64, usecols=(0, 1), unpack=True, ndmin=2)
+        except ValueError:
+            # Irregular file, use the slower parser
+            data = pd.read_csv(fl_name, header=None, delimiter=r"\s+").to_numpy(dtype=np.float64).T
+
+    return pd.DataFrame({0: data[0], 1: data[1]})
+
+
+def synthesize(config_fl, conv_name, stats=None, cancel_event=None):
+    """
+    Run Turbospectrum2019 and read the output spectrum.
+
+    | If a spectrum with the same abundances, step and input files and a range that covers the
+      current one was synthesized recently, it is sliced instead. When the cache is enabled, the spectrum is
+      read from it if the same synthesis was already done.
+    | If ``cancel_event`` is set, ``SynthesisCancelled`` is raised instead of running TurboSpectrum.
+
+    :param config_fl: file name of the TurboSpectrum configuration file.
+    :param conv_name: file name of the TurboSpectrum output file.
+    :param stats: dictionary to accumulate the number of syntheses that ran TurboSpectrum (``"nsynth"``).
+    :param cancel_event: event (like ``threading.Event``) set to cancel the synthesis.
+    :return: the synthetic spectrum.
+    """
+
+    template = get_template(config_fl)
+    spec = template.find_window()
+    if spec is not None:
+        return spec
+
+    key = None
+    if cache is not None:
+        key = cache.key(template, exclude=[conv_name])
+        spec = cache.get(key)
+
+    if spec is None:
+        if cancel_event is not None and cancel_event.is_set():
+            raise SynthesisCancelled("Synthesis cancelled.")
+        run_configfl(config_fl)
+        spec = read_spectrum(conv_name)
+        if stats is not None:
+            stats["nsynth"] = stats.get("nsynth", 0) + 1
+
+        if key is not None:
+            cache.put(key, spec)
+
+    template.add_window(spec)
+    return spec
+
+
+def broadening_margin(config_fl, convol):
+    """
+    Margin to add to a synthesis range, so the convolution is not affected by the edges of the range.
+
+    :param config_fl: file name of the TurboSpectrum configuration file.
+    :param convol: the largest convolution in FWHM (in pixels).
+    :return: the margin, or 0 if the wavelength step is still unknown.
+    """
+
+    step = get_template(config_fl).step
+    if step is None:
+        return 0.
+
+    # Half size of the Gaussian kernel (see fit_functions.spec_operations)
+    return 4 * convol / (2*np.sqrt(2*np.log(2))) * step
+
+
+def enable_opacity_cache(folder=None, max_size=2*1024**3):
+    """
+    Enable the cache of the continuum opacity, so only the bsyn stage of the script runs when the
+    opacity of the current state was already computed (see ``ConfigTemplate.opacity_state``).
+
+    :param folder: directory of the cache. Default is ``~/.cache/meafs/opacity``.
+    :param max_size: maximum size of the cache in bytes.
+    :return: the ``synth_cache.OpacityCache`` object.
+    """
+
+    global opacity_cache
+
+    opacity_cache = sc.OpacityCache(folder=folder, max_size=max_size)
+    return opacity_cache
+
+
+class Linelist:
+    """
+    Line data file in the TurboSpectrum format.
+
+    | The file is a sequence of species, each one with two quoted header lines (the species
+      identifier, ionization and number of lines, then the species name) and one line for each
+      transition, starting with the wavelength.
+    | Hydrogen lines are always kept in the trimmed files, because of their wide wings.
+
+    :param fl_name: file name of the line data.
+    """
+
+    def __init__(self, fl_name):
+        self.fl_name = fl_name
+        self.species = []
+
+        with open(fl_name, "r") as file:
+            lines = file.read().splitlines(keepends=True)
+
+        pos = 0
+        while pos < len(lines):
+            if not lines[pos].strip():
+                pos += 1
+                continue
+            header = lines[pos:pos + 2]
+            if len(header) < 2 or not all(line.lstrip().startswith("'") for line in header):
+                raise ValueError("Not a TurboSpectrum line data file: {}".format(fl_name))
+            nlines = int(header[0].split()[-1])
+            data = lines[pos + 2:pos + 2 + nlines]
+            wave = np.array([float(line.split(None, 1)[0]) for line in data])
+            hydrogen = float(header[0].split("'")[1].split()[0]) < 2
+            self.species.append((header, data, wave, hydrogen))
+            pos += 2 + nlines
+
+    def trim(self, low, upp):
+        """
+        Keep only the lines inside a range.
+
+        :param low: lower limit of the range.
+        :param upp: upper limit of the range.
+        :return: the text of the trimmed file, or None if all lines are inside the range.
+        """
+
+        if all(hydrogen or ((wave >= low) & (wave <= upp)).all() for _, _, wave, hydrogen in self.species):
+            return None
+
+        blocks = []
+        for header, data, wave, hydrogen in self.species:
+            keep = np.ones(len(wave), dtype=bool) if hydrogen else (wave >= low) & (wave <= upp)
+            if keep.any():
+                blocks.append((header, [data[i] for i in np.flatnonzero(keep)]))
+
+        if not blocks and self.species:
+            # Keep the line closest to the range, so the file is never empty
+            header, data, wave, _ = min(self.species, key=lambda sp: np.abs(sp[2] - (low + upp) / 2).min()
+                                        if len(sp[2]) else np.inf)
+            if len(wave):
+                blocks.append((header, [data[np.abs(wave - (low + upp) / 2).argmin()]]))
+
+        text = ""
+        for header, data in blocks:
+            count = re.sub(r"\d+(\s*)$", lambda m: "{:>{}}".format(len(data), len(m.group(0)) - len(m.group(1)))
+                           + m.group(1), header[0])
+            text += count + header[1] + "".join(data)
+
+        return text
+
+
+linelist_cache = None
+linelist_margin = 10.
+linelists = {}
+
+
+def enable_linelist_cache(folder=None, max_size=1024**3, margin=10.):
+    """
+    Enable the trimming of the line data, so each synthesis reads only the lines around its range.
+
+    :param folder: directory of the cache of trimmed files. Default is ``~/.cache/meafs/linelists``.
+    :param max_size: maximum size of the cache in bytes.
+    :param margin: lines up to this distance (in Angstrom) outside the range are kept.
+    :return: the ``synth_cache.LinelistCache`` object.
+    """
+
+    global linelist_cache, linelist_margin
+
+    linelist_cache = sc.LinelistCache(folder=folder, max_size=max_size)
+    linelist_margin = margin
+    return linelist_cache
+
+
+def get_linelist(fl_name):
+    """
+    Get the parsed line data file, parsing it only once or when it changed.
+
+    :param fl_name: file name of the line data.
+    :return: the ``Linelist`` object, or None if the file is not in the TurboSpectrum format.
+    """
+
+    stat = os.stat(fl_name)
+    stamp = (stat.st_mtime_ns, stat.st_size)
+    if fl_name not in linelists or linelists[fl_name][0] != stamp:
+        try:
+            linelists[fl_name] = (stamp, Linelist(fl_name))
+        except (ValueError, IndexError):
+            linelists[fl_name] = (stamp, None)
+
+    return linelists[fl_name][1]
+
+
+def trim_linelists(template):
+    """
+    Find or create the line data files trimmed to the current range.
+
+    | The range is extended by ``linelist_margin`` and rounded out to multiples of it, so
+      nearby syntheses share the same trimmed files.
+    | Files that are not in the TurboSpectrum format or that have no line outside the range
+      are given unchanged.
+
+    :param template: the ``ConfigTemplate`` object.
+    :return: dictionary with the start and end of each line data path in the rendered text
+             and the trimmed file to use instead.
+    """
+
+    low, upp = template.slots.get("lam_min"), template.slots.get("lam_max")
+    if linelist_cache is None or low is None or upp is None:
+        return {}
+
+    step = max(linelist_margin, 1.)
+    low, upp = step * np.floor((low - linelist_margin) / step), step * np.ceil((upp + linelist_margin) / step)
+
+    trimmed = {}
+    for start, end, fl_name in template.linelist_files():
+        key = linelist_cache.key_range(fl_name, low, upp)
+        path = linelist_cache.find(key)
+        if path is None:
+            linelist = get_linelist(fl_name)
+            text = linelist.trim(low, upp) if linelist is not None else None
+            if text is None:
+                continue
+            path = linelist_cache.store(key, text)
+        trimmed[(start, end)] = path
+
+    return trimmed
+
+
+def stage_script(config_fl):
+    """
+    Choose the script to run: a copy without the babsma stage when the continuum opacity of the
+    current state is already on disk or in the opacity cache, and with the line data trimmed to
+    the current range when enabled (see ``trim_linelists``), or the script itself.
+
+    :param config_fl: file name of the TurboSpectrum configuration file.
+    :return: the file name of the script and the opacity key to store after running it (None if
+             nothing has to be stored).
+    """
+
+    template = get_template(config_fl)
+    skip_babsma, key = False, None
+
+    state = template.opacity_state() if opacity_cache is not None else None
+    files = template.opacity_files() if state is not None else []
+    if files:
+        key = opacity_cache.key_state(state)
+        if template.opacity_key == key and all(os.path.isfile(fl_name) for fl_name in files):
+            skip_babsma, key = True, None
+        elif opacity_cache.restore(key, files):
+            template.opacity_key = key
+            skip_babsma, key = True, None
+
+    trimmed = trim_linelists(template)
+    if not skip_babsma and not trimmed:
+        return config_fl, key
+
+    return template.run_script(skip_babsma=skip_babsma, linelists=trimmed), key
+
+
+def store_opacity(config_fl, key):
+    """
+    Store the continuum opacity written by a full run of the script.
+
+    :param config_fl: file name of the TurboSpectrum configuration file.
+    :param key: the opacity key given by ``stage_script``.
+    """
+
+    if key is None:
+        return
+
+    template = get_template(config_fl)
+    opacity_cache.store(key, template.opacity_files())
+    template.opacity_key = key
+
+
+def run_configfl(config_fl, timeout=None):
     """
     Run Turbospectrum2019.
 
     :param config_fl: file name of the TurboSpectrum configuration file.
+    :param timeout: maximum time of the run in seconds.
+    """
+
+    flush_configfl(config_fl)
+    script, opacity_key = stage_script(config_fl)
+
+    config_folder = os.path.dirname(os.path.abspath(config_fl))
+
+    subprocess.check_output([os.path.abspath(script)], cwd=config_folder, timeout=timeout)
+    store_opacity(config_fl, opacity_key)
+
+
+async def run_configfl_async(config_fl, timeout=None, poll=0.05, cancel_event=None):
+    """
+    Run Turbospectrum2019 without blocking the asyncio event loop.
+
+    | The script runs in its own process group, which is killed with the programs started by the
+      script when the timeout is exceeded, when ``cancel_event`` is set (``SynthesisCancelled`` is
+      then raised) or when the task is cancelled.
+
+    :param config_fl: file name of the TurboSpectrum configuration file.
+    :param timeout: maximum time of the run in seconds.
+    :param poll: interval in seconds to check the timeout and ``cancel_event``.
+    :param cancel_event: event (like ``threading.Event``) set to cancel the synthesis.
+    :return: the standard output of the script.
+    """
+
+    flush_configfl(config_fl)
+    script, opacity_key = stage_script(config_fl)
+
+    config_folder = os.path.dirname(os.path.abspath(config_fl))
+    run = os.path.basename(script)
+
+    proc = await asyncio.create_subprocess_exec(os.path.abspath(script), cwd=config_folder,
+                                                stdout=asyncio.subprocess.PIPE, start_new_session=True)
+    communicate = asyncio.ensure_future(proc.communicate())
+    deadline = None if timeout is None else time.monotonic() + timeout
+    try:
+        while not communicate.done():
+            if cancel_event is not None and cancel_event.is_set():
+                raise SynthesisCancelled("Synthesis cancelled.")
+            if deadline is not None and time.monotonic() > deadline:
+                raise subprocess.TimeoutExpired(run, timeout)
+            await asyncio.wait([communicate], timeout=poll)
+    except BaseException:
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        # The output pipe is closed once all the killed programs exit, wait for them even if cancelled again
+        while not communicate.done():
+            try:
+                await asyncio.wait([communicate])
+            except asyncio.CancelledError:
+                pass
+        raise
+    output, _ = communicate.result()
+
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, run, output=output)
+
+    store_opacity(config_fl, opacity_key)
+    return output
+
+
+class SynthesisPool:
+    """
+    Run several independent Turbospectrum2019 syntheses at the same time.
+
+    | Each synthesis runs in one of up to ``limit`` sandboxes (see :class:`Sandbox`), created
+      when first needed and reused by the next syntheses. The scripts run as asyncio
+      subprocesses, so waiting for them does not block the ``poll`` function.
+    | A synthesis is described by the slots of the configuration template (see
+      :class:`ConfigTemplate`) that differ from the current state of the configuration file.
+    | When ``cancel_event`` is set, the running scripts are killed and ``SynthesisCancelled`` is raised.
+
+    :param config_fl: file name of the TurboSpectrum configuration file.
+    :param conv_name: file name of the TurboSpectrum output file.
+    :param limit: maximum number of simultaneous syntheses. Default is the number of CPUs.
+    :param timeout: maximum time of each synthesis in seconds.
+    :param cancel_event: event (like ``threading.Event``) set to cancel the syntheses.
+    """
+
+    def __init__(self, config_fl, conv_name, limit=None, timeout=None, cancel_event=None):
+        self.config_fl = config_fl
+        self.conv_name = conv_name
+        self.limit = limit if limit is not None else os.cpu_count() or 1
+        self.timeout = timeout
+        self.cancel_event = cancel_event
+        self.sandboxes = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.cleanup()
+
+    async def synthesize_async(self, values, sandboxes, stats=None):
+        """
+        Run one synthesis in the first free sandbox.
+
+        :param values: the values of all the slots of the configuration template.
+        :param sandboxes: ``asyncio.Queue`` with the free sandboxes.
+        :param stats: dictionary to accumulate the number of syntheses that ran TurboSpectrum (``"nsynth"``).
+        :return: the synthetic spectrum.
+        """
+
+        sandbox = await sandboxes.get()
+        try:
+            template = get_template(sandbox.config_fl)
+            for name, value in values.items():
+                template.set(name, value)
+
+            key = None
+            if cache is not None:
+                key = cache.key(template, exclude=[sandbox.conv_name])
+                spec = cache.get(key)
+                if spec is not None:
+                    return spec
+
+            if self.cancel_event is not None and self.cancel_event.is_set():
+                raise SynthesisCancelled("Synthesis cancelled.")
+            await run_configfl_async(sandbox.config_fl, timeout=self.timeout, cancel_event=self.cancel_event)
+            spec = read_spectrum(sandbox.conv_name)
+            if stats is not None:
+                stats["nsynth"] = stats.get("nsynth", 0) + 1
+
+            if key is not None:
+                cache.put(key, spec)
+
+            return spec
+        finally:
+            sandboxes.put_nowait(sandbox)
+
+    def synthesize_all(self, requests, poll=None, stats=None):
+        """
+        Run all the syntheses and wait for them.
+
+        :param requests: list of dictionaries with the changed slots of each synthesis,
+                         e.g. ``{"Fe_ab": 7.5}``.
+        :param poll: function called periodically while waiting, e.g. to update the UI.
+        :param stats: dictionary to accumulate the number of syntheses that ran TurboSpectrum (``"nsynth"``).
+        :return: list with the synthetic spectra in the same order of ``requests``.
+        """
+
+        current = {name: value for name, value in get_template(self.config_fl).slots.items() if value is not None}
+        requests = [dict(current, **changes) for changes in requests]
+
+        while len(self.sandboxes) < min(self.limit, len(requests)):
+            self.sandboxes.append(Sandbox(self.config_fl, self.conv_name))
+
+        async def run_all():
+            sandboxes = asyncio.Queue()
+            for sandbox in self.sandboxes:
+                sandboxes.put_nowait(sandbox)
+
+            tasks = [asyncio.ensure_future(self.synthesize_async(values, sandboxes, stats=stats))
+                     for values in requests]
+            try:
+                if poll is not None:
+                    while not all(task.done() for task in tasks):
+                        poll()
+                        await asyncio.wait(tasks, timeout=0.05)
+
+                return await asyncio.gather(*tasks)
+            finally:
+                # When a synthesis fails, wait for the scripts of the others to be killed before the loop is closed
+                for task in tasks:
+                    task.cancel()
+                await asyncio.wait(tasks)
+
+        return asyncio.run(run_all())
+
+    def cleanup(self):
+        """
+        Remove the sandboxes.
+        """
+
+        for sandbox in self.sandboxes:
+            sandbox.cleanup()
+        self.sandboxes = []
+
+
+def plan_windows(lambs, cut_val, max_width=None):
+    """
+    Group nearby lines in shared synthesis windows.
+
+    | Lines are added to a group while their windows overlap and the window of the group
+      is not wider than ``max_width``.
+
+    :param lambs: central wavelengths of the lines.
+    :param cut_val: half width of the window of each line.
+    :param max_width: maximum width of a shared window. Default is ten times ``cut_val``.
+    :return: list of groups, each one a list with the indices of the lines sorted by wavelength.
+    """
+
+    if max_width is None:
+        max_width = 10 * cut_val
+
+    groups = []
+    for i in np.argsort(lambs, kind="stable"):
+        if groups:
+            first, last = lambs[groups[-1][0]], lambs[groups[-1][-1]]
+            if lambs[i] - last <= 2 * cut_val and lambs[i] - first + 2 * cut_val <= max_width:
+                groups[-1].append(int(i))
+                continue
+        groups.append([int(i)])
+
+    return groups
+
+
+class SharedWindows:
+    """
+    Synthetic spectra at the reference abundances shared by nearby lines.
+
+    | Before the abundance fit, the lines are synthesized with the abundances of the configuration
+      file, so the lines of a group (see :func:`plan_windows`) can be sliced from one synthesis of
+      the whole group window.
+    | A synthesis is reused only while the state of the configuration file (see
+      :meth:`ConfigTemplate.state`) is the same as when it was made.
+
+    :param config_fl: file name of the TurboSpectrum configuration file.
+    :param conv_name: file name of the TurboSpectrum output file.
+    :param lambs: central wavelengths of the lines.
+    :param cut_val: half width of the window of each line.
+    :param max_width: maximum width of a shared window.
+    :param cancel_event: event (like ``threading.Event``) set to cancel the syntheses.
+    """
+
+    def __init__(self, config_fl, conv_name, lambs, cut_val, max_width=None, cancel_event=None):
+        self.config_fl = config_fl
+        self.conv_name = conv_name
+        self.cancel_event = cancel_event
+        self.lambs = lambs
+        self.cut_val = cut_val
+        self.groups = plan_windows(lambs, cut_val, max_width=max_width)
+        self.group_of = {i: k for k, group in enumerate(self.groups) for i in group}
+        self.spectra = {}
+        self.syntheses = 0
+
+    def spectrum(self, i, margin=0.):
+        """
+        Synthetic spectrum of a line with the current abundances, sliced from its group window.
+
+        :param i: index of the line.
+        :param margin: margin added to the window of the line, so the convolution is not affected by
+                       the edges (see :func:`broadening_margin`).
+        :return: the synthetic spectrum, or None if the line has no neighbours to share the synthesis.
+        """
+
+        k = self.group_of[i]
+        group = self.groups[k]
+        if len(group) == 1:
+            return None
+
+        state = get_template(self.config_fl).state()
+        if k not in self.spectra or self.spectra[k][0] != (state, margin):
+            low = self.lambs[group[0]] - self.cut_val - margin
+            upp = self.lambs[group[-1]] + self.cut_val + margin
+            change_spec_range_configfl(self.config_fl, (low + upp) / 2, (upp - low) / 2)
+            self.spectra[k] = ((state, margin), synthesize(self.config_fl, self.conv_name,
+                                                           cancel_event=self.cancel_event))
+            self.syntheses += 1
+
+        return ff.cut_spec(self.spectra[k][1], self.lambs[i], self.cut_val + margin).reset_index(drop=True)
+
+
+class Sandbox:
+    """
+    Isolated copy of the Turbospectrum2019 configuration file and output path, so several
+    TurboSpectrum runs can happen at the same time.
+
+    | The folder of the configuration file is mirrored with symbolic links into a private
+      folder (in tmpfs, when available). The folders the script writes to (the output file and
+      the ``'MODELOPACFILE:'`` and ``'RESULTFILE :'`` entries) are created empty instead, so
+      the runs in different sandboxes do not share any output.
+    | Relative paths that leave the folder of the configuration file, like ``../DATA`` or
+      ``set mpath=../models``, are made absolute in the sandboxed script.
+    | Files written with fixed names outside these folders are still shared.
+
+    :param config_fl: file name of the TurboSpectrum configuration file.
+    :param conv_name: file name of the TurboSpectrum output file.
+    :param root: folder to create the sandbox. Default is ``/dev/shm`` when available.
     """
 
-    run = config_fl.split("/")[-1]
-    config_fodler = config_fl.removesuffix(run)
+    def __init__(self, config_fl, conv_name, root=None):
+        if root is None and os.access("/dev/shm", os.W_OK):
+            root = "/dev/shm"
+        self.folder = tempfile.mkdtemp(prefix="meafs_", dir=root)
+
+        config_dir = os.path.dirname(os.path.abspath(config_fl))
+        template = get_template(config_fl)
+        text = template.text()
+        outputs = template.outputs()
+
+        conv_abs = os.path.abspath(conv_name)
+        conv_rel = os.path.relpath(conv_abs, config_dir)
+        if conv_rel.startswith(".."):
+            # Output outside the configuration folder, point it to the sandbox
+            self.conv_name = os.path.join(self.folder, os.path.basename(conv_abs))
+            text = text.replace(conv_abs, self.conv_name).replace(conv_rel, self.conv_name)
+        else:
+            self.conv_name = os.path.join(self.folder, conv_rel)
+            outputs.append(conv_rel)
+        text = self.absolute_paths(text, config_dir)
+
+        # Private folders (and files, when written in the top folder) for the outputs
+        private = {os.path.basename(config_fl)}
+        for out in outputs:
+            out = os.path.normpath(out)
+            parent = os.path.dirname(out)
+            if out.startswith(("/", "~", "..")) or "$" in parent:
+                continue
+            if parent == "":
+                private.add(out)
+                continue
+            os.makedirs(os.path.join(self.folder, parent), exist_ok=True)
+            private.add(parent.split(os.sep)[0])
+
+        for name in os.listdir(config_dir):
+            # The script and its copies (see ConfigTemplate.run_script) are private
+            if name not in private and not name.startswith(os.path.basename(config_fl) + "."):
+                os.symlink(os.path.join(config_dir, name), os.path.join(self.folder, name))
+
+        self.config_fl = os.path.join(self.folder, os.path.basename(config_fl))
+        with open(self.config_fl, "w") as file:
+            file.write(text)
+        shutil.copymode(config_fl, self.config_fl)
+
+    @staticmethod
+    def absolute_paths(text, folder):
+        """
+        Make absolute the relative paths of a script that point outside of its folder.
+
+        :param text: the script text.
+        :param folder: folder of the script.
+        :return: the text with the paths replaced.
+        """
+
+        def absolute(match):
+            path = match.group(0)
+            # Only the part before a variable is changed, e.g. ../models/${MODEL}
+            static = path[:path.rfind("/", 0, path.find("$")) + 1] if "$" in path else path
+            norm = os.path.normpath(static)
+            if norm != ".." and not norm.startswith(".." + os.sep):
+                return path
+            absolute_static = os.path.normpath(os.path.join(folder, static))
+            return os.path.join(absolute_static, path[len(static):]) if path[len(static):] else absolute_static
+
+        return re.sub(r"(?<![^\s'\"()<>|;=])\.\.[^\s'\"()<>|;=]*", absolute, text)
+
+    def type_synth(self):
+        """
+        Synthetic spectrum generator description pointing to the sandbox.
+
+        :return: the ``type_synth`` list used in the fit functions.
+        """
 
-    subprocess.check_output("cd \"{}\" && ./{}".format(config_fodler, run), shell=True)
+        return ["TurboSpectrum", self.conv_name, self.config_fl]
+
+    def cleanup(self):
+        """
+        Remove the sandbox.
+        """
+
+        templates.pop(os.path.abspath(self.config_fl), None)
+        shutil.rmtree(self.folder, ignore_errors=True)
 
 
 def optimize_spec(spec_obs_cut, spec_conv, lamb, cut_val, continuum, init=None, iterac=100, convovbound=None,
-                  wavebound=None):
+                  wavebound=None, stats=None):
     """
     Fit of the Convolution, Wavelength Shift and Continuum using the minimization of the :math:`\\chi^2`
     with the Nelder-Mead method.
@@ -119,6 +1258,7 @@ def optimize_spec(spec_obs_cut, spec_conv, lamb, cut_val, continuum, init=None,
     :param iterac: maximum allowed iterations of the Nelder-Mead method.
     :param convovbound: range to fit the convolution.
     :param wavebound: range to fit the wavelength shift.
+    :param stats: dictionary to accumulate the number of objective evaluations (``nfev``).
     :return: the optimized parameters
     """
 
@@ -128,10 +1268,13 @@ def optimize_spec(spec_obs_cut, spec_conv, lamb, cut_val, continuum, init=None,
     if convovbound is None:
         convovbound = [3.5, 4.2]
     if wavebound is None:
-        wavebound = [lamb-1, lamb+1]
+        wavebound = [-1, +1]
     else:
         wavebound = [-wavebound, +wavebound]
 
+    # Keep the initial guesses inside the boundaries
+    init = [np.clip(init[0], *wavebound), init[1], np.clip(init[2], *convovbound)]
+
     # First, apply a convolution of 3.85
     sp_convoluted = ff.spec_operations(spec_conv.copy(), convol=init[2])
 
@@ -139,8 +1282,10 @@ def optimize_spec(spec_obs_cut, spec_conv, lamb, cut_val, continuum, init=None,
     def opt_desloc_continuum(guess):
         sp_fit = ff.spec_operations(sp_convoluted.copy(), lamb_desloc=guess[0], continuum=guess[1], convol=0)
         return ff.chi2(spec_obs_cut, sp_fit)
-    pars = minimize(opt_desloc_continuum, np.array([init[0], continuum]), method='Nelder-Mead',
-                    options={"maxiter": iterac}, bounds=[wavebound, [continuum*0.9, continuum*1.1]]).x
+    res = minimize(opt_desloc_continuum, np.array([init[0], continuum]), method='Nelder-Mead',
+                   options={"maxiter": iterac}, bounds=[wavebound, [continuum*0.9, continuum*1.1]])
+    pars = res.x
+    nfev = res.nfev
 
     # pars = [pars[0], continuum]
 
@@ -152,8 +1297,13 @@ def optimize_spec(spec_obs_cut, spec_conv, lamb, cut_val, continuum, init=None,
         # noinspection PyTypeChecker
         sp_fit = ff.spec_operations(spec_conv.copy(), lamb_desloc=pars[0], continuum=pars[1], convol=guess[0])
         return ff.chi2(spec_obs_cut, sp_fit)
-    par = minimize(opt_convolution, np.array([init[2]]), method='Nelder-Mead', options={"maxiter": iterac},
-                   bounds=[convovbound]).x
+    res = minimize(opt_convolution, np.array([init[2]]), method='Nelder-Mead', options={"maxiter": iterac},
+                   bounds=[convovbound])
+    par = res.x
+    nfev += res.nfev
+
+    if stats is not None:
+        stats["nfev"] = stats.get("nfev", 0) + nfev
 
     pars = np.append(pars, par, axis=0)
     # pars = [0, 1, 1]
@@ -161,10 +1311,242 @@ def optimize_spec(spec_obs_cut, spec_conv, lamb, cut_val, continuum, init=None,
     return pars
 
 
-def optimize_abund(spec_obs_cut, config_fl, conv_name, elem, opt_pars, par, abund_lim, iterac=10):
+class AbundanceEmulator:
+    """
+    Emulator of the synthetic spectrum of a line as a function of the abundance.
+
+    | The spectrum is synthesized at a few abundance nodes and the flux at each synthetic pixel
+      is interpolated between the nodes with a monotonic cubic (PCHIP) interpolation. The
+      :math:`\\chi^2` is the same of ``fit_functions.chi2``, with the observed spectrum
+      interpolated at the synthetic pixels once.
+    | The Wavelength Shift, Continuum and Convolution are applied to every node spectrum, which
+      is equivalent to applying them to the interpolated spectrum since they are linear in the flux.
+
+    :param spec_obs_cut: spectrum data.
+    :param config_fl: file name of the TurboSpectrum configuration file.
+    :param conv_name: file name of the TurboSpectrum output file.
+    :param elem: element to be fitted.
+    :param opt_pars: the Continuum, Convolution and Wavelength Shift parameters.
+    :param cancel_event: event (like ``threading.Event``) set to cancel the syntheses.
+    """
+
+    def __init__(self, spec_obs_cut, config_fl, conv_name, elem, opt_pars, cancel_event=None):
+        self.config_fl = config_fl
+        self.cancel_event = cancel_event
+        self.conv_name = conv_name
+        self.elem = elem
+        self.opt_pars = opt_pars
+        self.spec_obs_cut = spec_obs_cut
+        self.x = None
+        self.obs = None
+        self.nodes = []
+        self.fluxes = []
+        self.specs = []
+        self.interpol = None
+
+    def spectrum(self, abund, spec_conv=None, stats=None):
+        """
+        Synthesize the spectrum at an abundance.
+
+        :param abund: the abundance.
+        :param spec_conv: the synthetic spectrum at the abundance, if it was already synthesized.
+        :param stats: dictionary to accumulate the number of syntheses (``"nsynth"``).
+        :return: the synthetic spectrum before the Wavelength Shift, Continuum and Convolution, and
+                 the flux after them at the synthetic pixels inside the observed range.
+        """
+
+        if spec_conv is None:
+            change_abund_configfl(self.config_fl, self.elem, find=False, abund=abund)
+            spec_conv = synthesize(self.config_fl, self.conv_name, stats=stats, cancel_event=self.cancel_event)
+        # noinspection PyTypeChecker
+        spec = ff.spec_operations(spec_conv.copy(), lamb_desloc=self.opt_pars[0], continuum=self.opt_pars[1],
+                                  convol=self.opt_pars[2])
+
+        if self.x is None:
+            obs = np.interp(spec[0], self.spec_obs_cut[0], self.spec_obs_cut[1], left=np.nan, right=np.nan)
+            mask = np.isfinite(obs)
+            self.x = np.asarray(spec[0])[mask]
+            self.obs = obs[mask]
+
+        return spec_conv, np.interp(self.x, spec[0], spec[1])
+
+    def add(self, abund, spec_conv=None, stats=None):
+        """
+        Synthesize the spectrum at a new abundance node.
+
+        :param abund: the abundance.
+        :param spec_conv: the synthetic spectrum at the abundance, if it was already synthesized.
+        :param stats: dictionary to accumulate the number of syntheses (``"nsynth"``).
+        :return: the synthetic spectrum before the Wavelength Shift, Continuum and Convolution.
+        """
+
+        spec_conv, flux = self.spectrum(abund, spec_conv=spec_conv, stats=stats)
+        self.nodes.append(abund)
+        self.fluxes.append(flux)
+        self.specs.append(spec_conv)
+        self.interpol = None
+
+        return spec_conv
+
+    def flux(self, abund):
+        """
+        Emulated flux at the synthetic pixels inside the observed range.
+
+        :param abund: the abundance.
+        :return: the flux array.
+        """
+
+        if self.interpol is None:
+            order = np.argsort(self.nodes)
+            self.interpol = PchipInterpolator(np.asarray(self.nodes)[order], np.asarray(self.fluxes)[order],
+                                              axis=0, extrapolate=True)
+        return self.interpol(abund)
+
+    def chi2(self, abund):
+        """
+        :math:`\\chi^2` of the emulated spectrum.
+
+        :param abund: the abundance.
+        :return: the :math:`\\chi^2`.
+        """
+
+        return ff.chi2_pixels(self.obs, self.flux(abund))
+
+    def minimum(self, bounds, samples=200):
+        """
+        Find the abundance of the minimum :math:`\\chi^2` of the emulator.
+
+        | A dense sampling selects the global minimum, which is then refined with the bounded
+          Brent method around it.
+
+        :param bounds: the lower and upper limits of the abundance.
+        :param samples: number of samples of the dense sampling.
+        :return: the abundance.
+        """
+
+        grid = np.linspace(bounds[0], bounds[1], samples)
+        chis = [self.chi2(abund) for abund in grid]
+        k = int(np.argmin(chis))
+        low, upp = grid[max(k - 1, 0)], grid[min(k + 1, samples - 1)]
+
+        return minimize_scalar(self.chi2, bounds=(low, upp), method="bounded", options={"xatol": 1e-5}).x
+
+    def direct_minimum(self, abund, step, stats=None):
+        """
+        Fit the abundance with the synthesized :math:`\\chi^2`, without the emulator.
+
+        | The :math:`\\chi^2` is synthesized at ``abund`` and at ``step`` on each side of it, and
+          the abundance is the minimum of the parabola through the three values.
+
+        :param abund: the abundance, usually the minimum of the emulator.
+        :param step: distance of the side abundances.
+        :param stats: dictionary to accumulate the number of syntheses (``"nsynth"``).
+        :return: the abundance, or None if the three values have no minimum.
+        """
+
+        chis = []
+        for value in [abund - step, abund, abund + step]:
+            k, dist = self.nearest(value)
+            flux = self.fluxes[k] if dist < 1e-9 else self.spectrum(value, stats=stats)[1]
+            chis.append(ff.chi2_pixels(self.obs, flux))
+
+        curvature = chis[0] - 2 * chis[1] + chis[2]
+        if curvature <= 0:
+            return None
+        return abund + step * (chis[0] - chis[2]) / (2 * curvature)
+
+    def nearest(self, abund):
+        """
+        Find the closest synthesized node of an abundance.
+
+        :param abund: the abundance.
+        :return: the index of the node and the distance to it.
+        """
+
+        dist = np.abs(np.asarray(self.nodes) - abund)
+        k = int(np.argmin(dist))
+        return k, dist[k]
+
+
+def emulate_abund(spec_obs_cut, config_fl, conv_name, elem, opt_pars, par, abund_lim, nodes=5, refine=1,
+                  tol=1e-3, validate=None, stats=None, pool=None, cancel_event=None):
+    """
+    Fit of the Abundance using the minimization of the :math:`\\chi^2` of an emulator built from a
+    small grid of syntheses (see :class:`AbundanceEmulator`).
+
+    | The grid has ``nodes`` abundances across the ``abund_lim`` range. While the minimum is far
+      from every node, a new node is synthesized on it, up to ``refine`` times.
+    | The validation compares the abundance with the one fitted directly on the synthesized
+      :math:`\\chi^2` around it (see :meth:`AbundanceEmulator.direct_minimum`), which costs
+      two more syntheses.
+
+    :param spec_obs_cut: spectrum data.
+    :param config_fl: file name of the TurboSpectrum configuration file.
+    :param conv_name: file name of the TurboSpectrum output file.
+    :param elem: element to be fitted.
+    :param opt_pars: the Continuum, Convolution and Wavelength Shift parameters.
+    :param par: initial guess, the center of the grid.
+    :param abund_lim: range to try the fit.
+    :param nodes: number of abundances of the initial grid.
+    :param refine: maximum number of nodes added near the minimum.
+    :param tol: distance from the closest node to consider the minimum converged.
+    :param validate: maximum difference between the emulated and the directly fitted abundance.
+                     If it is exceeded, the Nelder-Mead method is used instead, starting from the
+                     directly fitted abundance. If None, the emulator is not validated.
+    :param stats: dictionary to accumulate the number of syntheses that ran TurboSpectrum in this
+                  call (``"nsynth"``) and the emulator error (``"emulator_error"``).
+    :param pool: ``SynthesisPool`` object to synthesize the initial grid at the same time.
+    :param cancel_event: event (like ``threading.Event``) set to cancel the syntheses.
+    :return: the abundance and the synthetic spectrum at it, or None instead of the spectrum if
+             the validation failed.
+    """
+
+    if stats is not None:
+        stats.setdefault("nsynth", 0)
+    bounds = [par[0] - abund_lim, par[0] + abund_lim]
+    emulator = AbundanceEmulator(spec_obs_cut, config_fl, conv_name, elem, opt_pars, cancel_event=cancel_event)
+    grid = np.linspace(bounds[0], bounds[1], nodes)
+    if pool is None:
+        for abund in grid:
+            emulator.add(abund, stats=stats)
+    else:
+        specs = pool.synthesize_all([{elem + "_ab": abund} for abund in grid], stats=stats)
+        for abund, spec_conv in zip(grid, specs):
+            emulator.add(abund, spec_conv=spec_conv)
+
+    best = emulator.minimum(bounds)
+    for _ in range(refine):
+        if emulator.nearest(best)[1] < tol:
+            break
+        emulator.add(best, stats=stats)
+        best = emulator.minimum(bounds)
+
+    k, dist = emulator.nearest(best)
+    if dist < tol:
+        best = emulator.nodes[k]
+        spec_conv = emulator.specs[k]
+    else:
+        spec_conv = emulator.add(best, stats=stats)
+
+    if validate is not None:
+        direct = emulator.direct_minimum(best, max(validate, tol), stats=stats)
+        error = np.inf if direct is None else abs(direct - best)
+
+        if stats is not None:
+            stats["emulator_error"] = max(stats.get("emulator_error", 0), error)
+        if error > validate:
+            return [best if direct is None else direct], None
+
+    return [best], spec_conv
+
+
+def optimize_abund(spec_obs_cut, config_fl, conv_name, elem, opt_pars, par, abund_lim, iterac=10,
+                   method="nelder-mead", tol=1e-3, validate=None, stats=None, pool=None, cancel_event=None):
     """
     Fit of the Abundance using the minimization of the :math:`\\chi^2`
-    with the Nelder-Mead method.
+    with the Nelder-Mead method, the bounded Brent method or an emulator (see :func:`emulate_abund`).
+
+    | The visited abundances are memoized, so no abundance is synthesized twice.
 
     :param spec_obs_cut: spectrum data.
     :param config_fl: file name of the TurboSpectrum configuration file.
@@ -173,26 +1555,54 @@ def optimize_abund(spec_obs_cut, config_fl, conv_name, elem, opt_pars, par, abun
     :param opt_pars: the Continuum, Convolution and Wavelength Shift parameters.
     :param par: initial guess for the optimization.
     :param abund_lim: range to try the fit.
-    :param iterac: maximum allowed iterations of the Nelder-Mead method.
+    :param iterac: maximum allowed iterations of the Nelder-Mead or Brent methods.
+    :param method: ``"nelder-mead"``, ``"brent"`` or ``"emulator"``.
+    :param tol: absolute tolerance of the abundance of the Brent method.
+    :param validate: tolerance of the emulator validation (see :func:`emulate_abund`).
+    :param stats: dictionary to accumulate the number of syntheses that ran TurboSpectrum (``"nsynth"``).
+    :param pool: ``SynthesisPool`` object for the emulator grid.
+    :param cancel_event: event (like ``threading.Event``) set to cancel the syntheses.
     :return: the abundance, the value of the minimum :math:`\\chi^2` and the spectrum
              generated with the best parameters.
     """
 
+    bounds = [[par[0] - abund_lim, par[0] + abund_lim]]
+    if stats is not None:
+        stats.setdefault("nsynth", 0)
+
+    spec_conv = None
+    if method == "emulator":
+        # If the validation fails, the Nelder-Mead method starts from the emulator minimum
+        par, spec_conv = emulate_abund(spec_obs_cut, config_fl, conv_name, elem, opt_pars, par, abund_lim,
+                                       validate=validate, stats=stats, pool=pool, cancel_event=cancel_event)
+
+    visited = {}
+
+    def synthesize_abund(abund):
+        abund = round(float(abund), 6)
+        if abund not in visited:
+            change_abund_configfl(config_fl, elem, find=False, abund=abund)
+            spec = synthesize(config_fl, conv_name, stats=stats, cancel_event=cancel_event)
+            # noinspection PyTypeChecker
+            spec_op = ff.spec_operations(spec.copy(), lamb_desloc=opt_pars[0], continuum=opt_pars[1],
+                                         convol=opt_pars[2])
+            visited[abund] = (ff.chi2(spec_obs_cut, spec_op), spec)
+        return visited[abund]
+
     def opt_abund(abund):
-        change_abund_configfl(config_fl, elem, find=False, abund=abund[0])
-        run_configfl(config_fl)
-        spec = pd.read_csv(conv_name, header=None, delimiter=r"\s+")
-        # noinspection PyTypeChecker
-        spec = ff.spec_operations(spec.copy(), lamb_desloc=opt_pars[0], continuum=opt_pars[1],
-                                  convol=opt_pars[2])
+        return synthesize_abund(abund[0])[0]
 
-        chi = ff.chi2(spec_obs_cut, spec)
-        return chi
+    if spec_conv is None:
+        if method == "brent":
+            par = [minimize_scalar(lambda abund: synthesize_abund(abund)[0], bounds=bounds[0], method="bounded",
+                                   options={"xatol": tol, "maxiter": iterac}).x]
+        else:
+            par = minimize(opt_abund, np.array(par), method='Nelder-Mead', options={"maxiter": iterac},
+                           bounds=bounds).x
 
-    par = minimize(opt_abund, np.array(par), method='Nelder-Mead', options={"maxiter": iterac},
-                   bounds=[[par[0] - abund_lim, par[0] + abund_lim]]).x
+        change_abund_configfl(config_fl, elem, find=False, abund=par[0])
+        spec_conv = synthesize_abund(par[0])[1]
 
-    spec_conv = pd.read_csv(conv_name, header=None, delimiter=r"\s+")
     spec_fit = ff.spec_operations(spec_conv, lamb_desloc=opt_pars[0], continuum=opt_pars[1],
                                   convol=opt_pars[2])
     chi = ff.chi2(spec_obs_cut, spec_fit)
@@ -11,6 +11,9 @@ import numpy as np
 
 from . import fit_functions as ff
 
+# Smallest width of the fitted profiles, the Gaussian and Lorentzian are not defined for a null width
+min_width = 1e-4
+
 
 def gaussian(x, b, c, a=1, d=0):
     """
@@ -90,7 +93,7 @@ def find_func(type_func):
 
 
 def optimize_spec(spec_obs_cut, type_synth, lamb, continuum, convovbound=None,
-                  wavebound=None, iterac=100):
+                  wavebound=None, iterac=100, on_pixels=True, init=None, stats=None):
     """
     Fit of the Convolution and the Wavelength Shift using the minimization of the :math:`\\chi^2`
     with the Nelder-Mead method.
@@ -102,12 +105,19 @@ def optimize_spec(spec_obs_cut, type_synth, lamb, continuum, convovbound=None,
     :param convovbound: range to fit the convolution.
     :param wavebound: range to fit the wavelength shift.
     :param iterac: maximum allowed iterations of the Nelder-Mead method.
+    :param on_pixels: evaluate the profile exactly at the observed wavelengths instead of
+                      interpolating the observed spectrum into a dense grid. Only the fit uses it,
+                      the returned :math:`\\chi^2` is always the one of the dense grid.
+    :param init: initial guess values for the Wavelength Shift, Continuum and Convolution.
+    :param stats: dictionary to accumulate the number of objective evaluations (``nfev``).
     :return: the optimized parameters, the value of the minimum :math:`\\chi^2` and the spectrum
-             generated with the best parameters.
+             generated with the best parameters (in the dense grid, for display).
     """
 
     if convovbound is None:
         convovbound = [0, 1]
+    # Keep the width away from zero
+    convovbound = [max(convovbound[0], min_width), max(convovbound[1], min_width)]
     if wavebound is None:
         wavebound = [lamb-1, lamb+1]
     else:
@@ -115,6 +125,7 @@ def optimize_spec(spec_obs_cut, type_synth, lamb, continuum, convovbound=None,
 
     func = find_func(type_synth[1])
 
+    # Dense grid of the returned chi2 and spectrum, also used by the fit when not evaluating on the observed pixels
     x = np.linspace(min(spec_obs_cut.iloc[:, 0]), max(spec_obs_cut.iloc[:, 0]), 1000)
 
     a = -(continuum - spec_obs_cut.iloc[ff.bisec(spec_obs_cut, lamb), 1])
@@ -122,24 +133,38 @@ def optimize_spec(spec_obs_cut, type_synth, lamb, continuum, convovbound=None,
     c = type_synth[2]
     d = continuum
 
+    if init is not None:
+        b = np.clip(lamb + init[0], *wavebound)
+        c = np.clip(init[2], *convovbound)
+
+    x_obs = spec_obs_cut.iloc[:, 0].values
+    y_obs = spec_obs_cut.iloc[:, 1].values
+
     def fit(guess):
         bfit = guess[0]
         cfit = guess[1]
+        if on_pixels:
+            return ff.chi2_pixels(y_obs, func(x_obs, bfit, cfit, a, d))
         sp_fit = [x, func(x, bfit, cfit, a, d)]
         return ff.chi2(spec_obs_cut, sp_fit)
 
-    b, c = minimize(fit, np.array([b, c]), method='Nelder-Mead', bounds=[wavebound, convovbound],
-                    options={"maxiter": iterac}).x
+    res = minimize(fit, np.array([b, c]), method='Nelder-Mead', bounds=[wavebound, convovbound],
+                   options={"maxiter": iterac})
+    b, c = res.x
+
+    if stats is not None:
+        stats["nfev"] = stats.get("nfev", 0) + res.nfev
 
     # opt_pars = [lamb_desloc, continuum, convol]
     opt_pars = [b - lamb, d, c]
     spec_fit = pd.DataFrame({0: x, 1: func(x, b, c, a, d)})
-    chi = ff.chi2(spec_obs_cut, spec_fit)
+    # Same scale of the Chi of the dense grid, whatever the evaluation used by the fit
+    chi = ff.chi2(spec_obs_cut, [x, spec_fit[1].values])
 
     return opt_pars, chi, spec_fit
 
 
-def optimize_abund(spec_obs_cut, type_synth, lamb, opt_pars, iterac=100):
+def optimize_abund(spec_obs_cut, type_synth, lamb, opt_pars, iterac=100, on_pixels=True):
     """
     Fit of the Abundance using the minimization of the :math:`\\chi^2`
     with the Nelder-Mead method.
@@ -149,12 +174,16 @@ def optimize_abund(spec_obs_cut, type_synth, lamb, opt_pars, iterac=100):
     :param lamb: current wavelength.
     :param opt_pars: the Continuum, Convolution and Wavelength Shift parameters.
     :param iterac: maximum allowed iterations of the Nelder-Mead method.
+    :param on_pixels: evaluate the profile exactly at the observed wavelengths instead of
+                      interpolating the observed spectrum into a dense grid. Only the fit uses it,
+                      the returned :math:`\\chi^2` is always the one of the dense grid.
     :return: the abundance, the value of the minimum :math:`\\chi^2` and the spectrum
-             generated with the best parameters.
+             generated with the best parameters (in the dense grid, for display).
     """
 
     func = find_func(type_synth[1])
 
+    # Dense grid of the returned chi2 and spectrum, also used by the fit when not evaluating on the observed pixels
     x = np.linspace(min(spec_obs_cut.iloc[:, 0]), max(spec_obs_cut.iloc[:, 0]), 1000)
 
     a = - (opt_pars[1] - spec_obs_cut.iloc[ff.bisec(spec_obs_cut, lamb), 1])
@@ -162,8 +191,13 @@ def optimize_abund(spec_obs_cut, type_synth, lamb, opt_pars, iterac=100):
     c = opt_pars[2]
     d = opt_pars[1]
 
+    x_obs = spec_obs_cut.iloc[:, 0].values
+    y_obs = spec_obs_cut.iloc[:, 1].values
+
     def fit(guess):
         afit = guess[0]
+        if on_pixels:
+            return ff.chi2_pixels(y_obs, func(x_obs, b, c, afit, d))
         sp_fit = [x, func(x, b, c, afit, d)]
         return ff.chi2(spec_obs_cut, sp_fit)
 
@@ -172,6 +206,7 @@ def optimize_abund(spec_obs_cut, type_synth, lamb, opt_pars, iterac=100):
 
     par = a
     spec_fit = pd.DataFrame({0: x, 1: func(x, b, c, a, d)})
-    chi = ff.chi2(spec_obs_cut, spec_fit)
+    # Same scale of the Chi of the dense grid, whatever the evaluation used by the fit
+    chi = ff.chi2(spec_obs_cut, [x, spec_fit[1].values])
 
     return par, chi, spec_fit
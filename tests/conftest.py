@@ -0,0 +1,90 @@
+import pytest
+
+# Turbospectrum2019 script in the layout of the COM folder of the distribution
+ts_script = """#!/bin/csh -f
+
+date
+set mpath=../models
+
+foreach MODEL (sun.mod)
+
+set lam_min    = '5000.0'
+set lam_max    = '5010.0'
+
+set METALLIC = '     0.000'
+set TURBVEL  = '1.0'
+
+foreach Fe_ab (7.50)
+foreach Ti_ab (4.90)
+
+../exec/babsma_lu << EOF
+'LAMBDA_MIN:'  '${lam_min}'
+'LAMBDA_MAX:'  '${lam_max}'
+'LAMBDA_STEP:' '0.01'
+'MODELINPUT:' '$mpath/${MODEL}'
+'MARCS-FILE:' '.true.'
+'MODELOPACFILE:' './contopac/${MODEL}opac'
+'METALLICITY:'    '${METALLIC}'
+'ALPHA/Fe   :'    '0.00'
+'HELIUM     :'    '0.00'
+'R-PROCESS  :'    '0.00'
+'S-PROCESS  :'    '0.00'
+'XIFIX:' 'T'
+$TURBVEL
+EOF
+
+../exec/bsyn_lu <<EOF
+'LAMBDA_MIN:'     '${lam_min}'
+'LAMBDA_MAX:'     '${lam_max}'
+'LAMBDA_STEP:'    '0.01'
+'INTENSITY/FLUX:' 'Flux'
+'COS(THETA)    :' '1.00'
+'ABFIND        :' '.false.'
+'MODELOPACFILE:' './contopac/${MODEL}opac'
+'RESULTFILE :' './syntspec/sun.spec'
+'METALLICITY:'    '${METALLIC}'
+'ALPHA/Fe   :'    '0.00'
+'HELIUM     :'    '0.00'
+'R-PROCESS  :'    '0.00'
+'S-PROCESS  :'    '0.00'
+'INDIVIDUAL ABUNDANCES:'   '2'
+26  $Fe_ab
+22  $Ti_ab
+'ISOTOPES : ' '0'
+'NFILES   :' '2'
+../DATA/Hlinedata
+../linelists/vald.list
+'SPHERICAL:'  'F'
+  30
+  300.00
+  15
+  1.30
+EOF
+
+../exec/faltbon << EOF
+./syntspec/sun.spec
+./syntspec/sun.conv
+-3.85
+EOF
+
+end
+end
+end
+"""
+
+
+@pytest.fixture
+def ts_config(tmp_path):
+    """Turbospectrum2019 tree with the script in its COM folder, returning the script file name."""
+
+    root = tmp_path.joinpath("Turbospectrum2019")
+    for folder in ["COM", "DATA", "exec", "models", "linelists"]:
+        root.joinpath(folder).mkdir(parents=True)
+    root.joinpath("DATA", "Hlinedata").write_text("H lines\n")
+    root.joinpath("linelists", "vald.list").write_text("vald lines\n")
+    root.joinpath("models", "sun.mod").write_text("model\n")
+
+    config = root.joinpath("COM", "run.com")
+    config.write_text(ts_script)
+    config.chmod(0o755)
+    return str(config)
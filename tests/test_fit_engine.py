@@ -0,0 +1,215 @@
+import threading
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from meafs_code.scripts import turbospec_functions as tf
+from meafs_code.scripts import fake_turbospec as ft
+from meafs_code.scripts import fit_engine as fe
+from meafs_code.scripts import fit_functions as ff
+from meafs_code.scripts import benchmarks as bench
+
+
+def square(value):
+    return value**2
+
+
+def ew_spectrum(centers, shift=0.02):
+    wave = np.arange(5000, 5060, 0.01)
+    flux = 1 - sum(0.4 * np.exp(-(wave - c - shift)**2 / (2 * 0.05**2)) for c in centers)
+    flux += np.random.default_rng(0).normal(0, 0.002, len(wave))
+    return pd.DataFrame({0: wave, 1: flux})
+
+
+@pytest.mark.parametrize("backend", ["serial", "thread"])
+def test_line_executor_starts_tasks_lazily(backend):
+    tasks = [{"value": k} for k in range(6)]
+    returned = []
+    started = {}
+
+    def start(j, task):
+        started[j] = len(returned)
+        task["value"] += 1
+
+    for result in fe.LineExecutor(backend, workers=2).map(square, tasks, start=start, order=[1, 0, 2, 3, 4, 5]):
+        returned.append(result)
+
+    # The results keep the order of the tasks and see the changes of start
+    assert returned == [(k + 1)**2 for k in range(6)]
+    if backend == "serial":
+        assert started == {k: k for k in range(6)}
+    else:
+        # Only the number of workers is submitted ahead of the results
+        assert started == {0: 0, 1: 0, 2: 1, 3: 2, 4: 3, 5: 4}
+
+
+@pytest.mark.parametrize("backend, cold", [("serial", 1), ("thread", 2)])
+def test_fit_lines_warm_start_uses_returned_lines(backend, cold, tmp_path):
+    centers = [5005, 5015, 5025, 5035, 5045]
+    linelist = pd.DataFrame([["Fe1", c] for c in centers])
+    refer = pd.DataFrame({"value": ["7.5"]}, index=["Fe"])
+    config = fe.FitConfig(type_synth=["Equivalent Width", "Gaussian", 0.05], executor=backend, workers=2)
+    warm_start = ff.WarmStart()
+
+    results = fe.fit_lines(ew_spectrum(centers), linelist, refer, config, folder=str(tmp_path),
+                           warm_start=warm_start)
+
+    assert len(results) == len(centers)
+    assert np.allclose(results["Lamb Shift"].astype(float), 0.02, atol=1e-3)
+    assert (len(warm_start.nfev_cold), len(warm_start.nfev_warm)) == (cold, len(centers) - cold)
+    # Each line is logged when it starts
+    log = tmp_path.joinpath("log.txt").read_text()
+    assert log.count("Analysing the element") == len(centers)
+
+
+def test_validate_lines_reasons():
+    wave = np.arange(5000, 5060, 0.01)
+    spectrum = pd.DataFrame({0: wave, 1: np.ones(len(wave))})
+    linelist = pd.DataFrame([["Fe1", 5030], ["Ti2", 5002], ["Fe1", 5070], ["Fe", 5059.995]])
+    refer = pd.DataFrame({"value": ["7.5", "x"]}, index=["Fe", "Ti"])
+    config = fe.FitConfig(type_synth=["Equivalent Width", "Gaussian", 0.05])
+
+    table = fe.validate_lines(spectrum, linelist, refer, config)
+
+    assert table["Element"].tolist() == ["Fe", "Ti", "Fe", "Fe"]
+    assert table["Order"].tolist() == ["1", "2", "1", ""]
+    # Elements without a numeric reference abundance have a wider abundance range
+    assert table["Refer Abundance"].tolist() == [7.5, 0, 7.5, 7.5]
+    assert table["Abund Lim"].tolist() == [1, 3, 1, 1]
+    assert table["Reason"].fillna("").tolist() == ["", "Continuum range smaller than 0.",
+                                                    "Wavelength not in the range of the spectrum.",
+                                                    "Wavelength not in the range of the spectrum."]
+
+
+def test_validate_lines_matches_the_cut_of_the_spectrum():
+    wave = np.arange(5000, 5020, 0.01)
+    spectrum = pd.DataFrame({0: wave, 1: np.ones(len(wave))})
+    lambs = [5000.004, 5000.1, 5001.6, 5004.99, 5005.01, 5018.6, 5019.98]
+    cut_val = [5, 1.5, .2, .5]
+    config = fe.FitConfig(type_synth=["Equivalent Width", "Gaussian", 0.05], cut_val=cut_val)
+
+    table = fe.validate_lines(spectrum, pd.DataFrame([["Fe1", lamb] for lamb in lambs]),
+                              pd.DataFrame({"value": ["7.5"]}, index=["Fe"]), config)
+
+    # The same lines as checking the ranges cut from the spectrum one by one
+    for lamb, skipped in zip(lambs, table["Reason"].notna()):
+        assert skipped == any(len(ff.cut_spec(spectrum, lamb, cut_val=cut)) <= 1 for cut in cut_val)
+
+
+def test_validate_lines_turbospectrum_elements(ts_config):
+    wave = np.arange(5000, 5010, 0.01)
+    spectrum = pd.DataFrame({0: wave, 1: np.ones(len(wave))})
+    linelist = pd.DataFrame([["Fe1", 5005], ["Ni1", 5005], ["Ti1", 5005.5]])
+    config = fe.FitConfig(type_synth=["TurboSpectrum", "sun.conv", ts_config], cut_val=[2, 1.5, .2, .5])
+
+    table = fe.validate_lines(spectrum, linelist, pd.DataFrame({"value": ["7.5"]}, index=["Fe"]), config)
+
+    assert table["Reason"].fillna("").tolist() == ["", "Element not in TurboSpectrum Configuration file", ""]
+
+
+def test_fit_line_equivalent_width_runs_the_stages_once(tmp_path):
+    spec = ew_spectrum([5005])
+    results = [fe.fit_line(spec, "Fe", "1", 5005, 7.5, 1., ["Equivalent Width", "Gaussian", 0.05], [5, 1.5, .2, .5],
+                           1., str(tmp_path), repfit=repfit, max_iter=[1000, 1000, 10], convovbound=[0, 5],
+                           wavebound=.2, contpars=[2, 8])
+               for repfit in [1, 3]]
+
+    # The next iterations would repeat the first one
+    assert [result["passes"] for result in results] == [1, 1]
+    assert results[1]["runs"] == {"windows": 1, "continuum": 1, "spec": 1, "abund": 1, "equiv": 2}
+    assert results[0]["par"][0] == results[1]["par"][0]
+    assert results[0]["equiv_width_fit"] == results[1]["equiv_width_fit"]
+
+
+def test_line_stages_reuse_unchanged_inputs():
+    calls = []
+    stages = fe.LineStages()
+
+    def stage(value):
+        calls.append(value)
+        return value**2
+
+    assert stages.run("square", (2,), stage, 2) == 4
+    assert stages.run("square", (2,), stage, 2) == 4
+    assert stages.run("square", (3,), stage, 3) == 9
+    assert stages.done("square", (2,)) and not stages.done("other", (2,))
+    assert calls == [2, 3]
+    assert stages.runs == {"square": 2} and stages.reused == 1
+
+
+def test_fit_line_turbospectrum_reuses_unchanged_stages(tmp_path):
+    type_synth = ft.create(tmp_path, lines=[["Fe", 5005.0, 0.4]], abundances={"Fe": 7.5}, lam_min=4995.,
+                           lam_max=5015., runtime=0.)
+    spec_obs = bench.fake_observed(type_synth, {"Fe": 7.62}, shift=0, convol=3., noise=0)
+
+    result = fe.fit_line(spec_obs, "Fe", "1", 5005., 7.5, .3, type_synth, [5, 1.5, .2, .5], 1., str(tmp_path),
+                         repfit=3, max_iter=[1000, 1000, 10], convovbound=[0, 5], wavebound=.2, contpars=[2, 8],
+                         abund_method="brent")
+
+    # The windows, the parameters and the observed Equivalent Width do not change between the
+    # iterations, only the abundance fit starts from the previous abundance
+    assert result["passes"] == 3
+    assert result["runs"] == {"windows": 1, "continuum": 0, "spec": 1, "abund": 3, "equiv": 2}
+
+
+def test_fit_line_turbospectrum_refines_the_coarse_abundance(tmp_path, monkeypatch):
+    type_synth = ft.create(tmp_path, lines=[["Fe", 5005.0, 0.4]], abundances={"Fe": 7.5}, lam_min=4995.,
+                           lam_max=5015., runtime=0.)
+    spec_obs = bench.fake_observed(type_synth, {"Fe": 7.62}, shift=0, convol=3., noise=0)
+
+    limits = []
+    optimize_abund = tf.optimize_abund
+
+    def spy(*args, **kwargs):
+        limits.append((tf.get_template(type_synth[2]).slots["lam_step"], args[6]))
+        return optimize_abund(*args, **kwargs)
+    monkeypatch.setattr(tf, "optimize_abund", spy)
+
+    result = fe.fit_line(spec_obs, "Fe", "1", 5005., 7.5, .3, type_synth, [5, 1.5, .2, .5], 1., str(tmp_path),
+                         repfit=2, max_iter=[1000, 1000, 10], convovbound=[0, 5], wavebound=.2, contpars=[2, 8],
+                         abund_method="brent", coarse_step=4, refine_lim=.05)
+
+    # The first fit searches the whole range at the coarse step, the last one only refines it
+    base_step = tf.get_template(type_synth[2]).base_step
+    assert limits == [(pytest.approx(4 * base_step), .3), (pytest.approx(base_step), .05)]
+    assert result["passes"] == 2
+
+
+def test_fit_lines_turbospectrum_cancel_event(tmp_path):
+    type_synth = ft.create(tmp_path, lines=[["Fe", 5005.0, 0.4]], abundances={"Fe": 7.5}, lam_min=4995.,
+                           lam_max=5015., runtime=0.)
+    spec_obs = bench.fake_observed(type_synth, {"Fe": 7.62}, shift=0, convol=3., noise=0)
+    config = fe.FitConfig(type_synth=type_synth, abund_lim=.3)
+    cancel_event = threading.Event()
+    cancel_event.set()
+    if os.path.exists(type_synth[1]):
+        os.remove(type_synth[1])
+
+    # The first synthesis is cancelled, so no line is fitted and TurboSpectrum never runs
+    results = fe.fit_lines(spec_obs, pd.DataFrame([["Fe1", 5005.]]), pd.DataFrame({"value": ["7.5"]}, index=["Fe"]),
+                           config, folder=str(tmp_path), cancel_event=cancel_event)
+    assert len(results) == 0
+    assert not os.path.exists(type_synth[1])
+
+
+@pytest.mark.parametrize("stage", ["spec", "abund"])
+def test_fit_line_turbospectrum_cancel_keeps_the_script(stage, tmp_path):
+    type_synth = ft.create(tmp_path, lines=[["Fe", 5005.0, 0.4]], abundances={"Fe": 7.5}, lam_min=4995.,
+                           lam_max=5015., runtime=0.)
+    spec_obs = bench.fake_observed(type_synth, {"Fe": 7.62}, shift=0, convol=3., noise=0)
+    tf.flush_configfl(type_synth[2])
+    original = tf.ConfigTemplate(type_synth[2])
+
+    result = fe.fit_line(spec_obs, "Fe", "1", 5005., 7.5, .3, type_synth, [5, 1.5, .2, .5], 1., str(tmp_path),
+                         repfit=2, max_iter=[1000, 1000, 10], convovbound=[0, 5], wavebound=.2, contpars=[2, 8],
+                         coarse_step=4, callback=lambda event, values: event == stage)
+    assert result is None
+
+    # Apart from the range of the last synthesis, the rendered script is the original one
+    tf.flush_configfl(type_synth[2])
+    rendered = tf.ConfigTemplate(type_synth[2])
+    assert rendered.get("Fe_ab") == 7.5
+    assert rendered.get("lam_step") == 0.01
+    assert rendered.text({name: original.raw[name] for name in ["lam_min", "lam_max"]}) == original.text()
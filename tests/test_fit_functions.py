@@ -0,0 +1,79 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from meafs_code.scripts import fit_functions as ff
+from meafs_code.scripts import voigt_functions as vf
+
+
+def test_chi2_pixels_zero_for_identical_flux():
+    flux = np.linspace(0.5, 1, 50)
+    assert ff.chi2_pixels(flux, flux) == 0
+
+
+def test_chi2_pixels_formula():
+    obs = np.array([0.9, 0.8, 1.0])
+    fit = np.array([1.0, 0.9, 0.95])
+    assert ff.chi2_pixels(obs, fit) == pytest.approx(np.sum((obs - fit)**2 / fit))
+
+
+def test_chi2_pixels_matches_interpolated_chi2_on_shared_axis():
+    wave = np.linspace(5000, 5001, 40)
+    obs = 1 - 0.3 * np.exp(-(wave - 5000.5)**2 / 0.01)
+    fit = 1 - 0.25 * np.exp(-(wave - 5000.52)**2 / 0.012)
+
+    expected = ff.chi2(pd.DataFrame([wave, obs]).T, [wave, fit])
+    assert ff.chi2_pixels(obs, fit) == pytest.approx(expected, rel=1e-4)
+
+
+def test_warm_start_has_no_seed_before_any_fit():
+    assert ff.WarmStart().seed(5000.) is None
+
+
+def test_warm_start_seed_weights_fitted_neighbours():
+    warm = ff.WarmStart(width=10.)
+    warm.add(5000., [0.02, 1., 3.8])
+    warm.add(5010., [0.04, 1., 4.0])
+    warm.add(6000., [1.00, 1., 9.0])
+
+    shift, continuum, convol = warm.seed(5005., continuum=0.98)
+
+    # The two neighbours are equally distant and the far line has no weight
+    assert shift == pytest.approx(0.03)
+    assert convol == pytest.approx(3.9)
+    assert continuum == 0.98
+
+
+def test_warm_start_seed_uses_closest_line_outside_the_window():
+    warm = ff.WarmStart(width=1.)
+    warm.add(5000., [0.02, 1., 3.8])
+    warm.add(5100., [0.04, 1., 4.0])
+
+    assert warm.seed(5500.) == [pytest.approx(0.04), 1., pytest.approx(4.0)]
+
+
+def test_warm_start_falls_back_to_previous_spectrum():
+    warm = ff.WarmStart()
+    warm.add(5000., [0.02, 1., 3.8])
+    warm.new_spectrum()
+
+    assert warm.seed(5000.) == [pytest.approx(0.02), 1., pytest.approx(3.8)]
+
+    warm.add(5000., [0.05, 1., 4.1])
+    assert warm.seed(5000.)[0] == pytest.approx(0.05)
+
+
+def test_optimize_spec_keeps_the_width_and_the_chi_of_the_dense_grid():
+    wave = np.arange(5003, 5007, 0.01)
+    spec = pd.DataFrame({0: wave, 1: 1 - 0.4 * np.exp(-(wave - 5005)**2 / (2 * 0.05**2))})
+    type_synth = ["Equivalent Width", "Gaussian", 0.05]
+
+    # The width never reaches zero, even with a range starting at it
+    with np.errstate(divide="raise", invalid="raise"):
+        pars, chi, spec_fit = vf.optimize_spec(spec, type_synth, 5005, 1., convovbound=[0, 1], init=[0, 1, 0])
+    assert pars[2] >= vf.min_width
+
+    # The Chi of the pixel fit has the scale of the dense grid
+    dense = vf.optimize_spec(spec, type_synth, 5005, 1., convovbound=[0, 1], on_pixels=False)
+    assert chi == pytest.approx(ff.chi2(spec, [spec_fit[0].values, spec_fit[1].values]))
+    assert chi == pytest.approx(dense[1], rel=.1, abs=1e-4)
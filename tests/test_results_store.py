@@ -0,0 +1,204 @@
+import sqlite3
+import json
+
+import numpy as np
+import pandas as pd
+
+from meafs_code.scripts import results_store as rs
+
+
+def results(rows):
+    return pd.DataFrame([[elem, lamb, spec] for elem, lamb, spec in rows],
+                        columns=["Element", "Lambda (A)", "Spectrum"])
+
+
+def test_pending_lines():
+    linelist = pd.DataFrame([["Fe1", 5010.3], ["Ti1", 5025.2], ["Fe1", 5025.2], ["Ni1", 5030.1]])
+    done = results([["Fe1", 5010.30004, 1], ["Ti1", 5025.2, 2], ["Ni1", 5030.2, 1]])
+
+    # Wavelengths within the tolerance are the same line, other elements or wavelengths are not
+    assert rs.pending_lines(linelist, done).values.tolist() == [["Fe1", 5025.2], ["Ni1", 5030.1]]
+    assert rs.pending_lines(linelist, done, spectrum=1).values.tolist() == [["Ti1", 5025.2], ["Fe1", 5025.2],
+                                                                             ["Ni1", 5030.1]]
+    # The order of the linelist is kept
+    assert list(rs.pending_lines(linelist, done, spectrum=1).index) == [1, 2, 3]
+
+
+def test_pending_lines_empty():
+    linelist = pd.DataFrame([["Fe1", 5010.3], ["Ti1", 5025.2]])
+
+    assert rs.pending_lines(linelist, results([])).values.tolist() == linelist.values.tolist()
+    assert rs.pending_lines(linelist, results([["Fe1", 5010.3, 1]]), spectrum=2).values.tolist() == \
+        linelist.values.tolist()
+    assert len(rs.pending_lines(linelist.iloc[:0], results([["Fe1", 5010.3, 1]]))) == 0
+
+
+def row(elem, lamb, abund, spec=1):
+    return [elem, lamb, 0.01, 1.0, 0.1, 7.5, abund, abs(abund - 7.5), "1.0000e-03", "1.0000e-02", "1.0000e-02",
+            spec, 2]
+
+
+def test_results_store_append_and_export(tmp_path):
+    fl_name = tmp_path.joinpath("found_values.csv")
+    store = rs.ResultsStore(fl_name)
+    store.append(row("Fe1", 5010.3, 7.4))
+    store.append(row("Ti1", 5025.2, 4.8))
+    store.replace(0, row("Fe1", 5010.3, 7.45))
+
+    # The rows are readable before the export, and the CSV file is only written by it
+    assert not fl_name.is_file()
+    assert rs.read_results(fl_name)["Fit Abundance"].tolist() == [7.45, 4.8]
+
+    store.export()
+    store.close()
+    assert rs.read_csv(fl_name)["Element"].tolist() == ["Fe1", "Ti1"]
+    assert rs.read_results(fl_name)["Fit Abundance"].tolist() == [7.45, 4.8]
+
+
+def test_results_store_typed_table(tmp_path):
+    fl_name = tmp_path.joinpath("found_values.csv")
+    store = rs.ResultsStore(fl_name)
+    store.append(row("Fe1", 5010.3, 7.4))
+    store.append(row("Fe1", 5010.3, 7.4, spec=2))
+    # The same line of the same spectrum replaces its result in place
+    store.append(row("Fe1", 5010.3, 7.45))
+    store.append(row("Ti1", 5025.2, float("nan")))
+    store.close()
+
+    conn = sqlite3.connect(rs.ResultsStore.path(fl_name))
+    found = conn.execute('SELECT "Spectrum", "Fit Abundance", typeof("Lambda (A)"), typeof("Passes") FROM results '
+                         'WHERE "Element" = ? ORDER BY position', ("Fe1",)).fetchall()
+    assert found == [(1, 7.45, "real", "integer"), (2, 7.4, "real", "integer")]
+    assert conn.execute('SELECT "Fit Abundance" FROM results WHERE "Element" = ?', ("Ti1",)).fetchone() == (None,)
+    conn.close()
+
+    assert rs.read_results(fl_name)["Fit Abundance"].tolist()[:2] == [7.45, 7.4]
+
+
+def test_results_store_converts_json_rows(tmp_path):
+    fl_name = tmp_path.joinpath("found_values.csv")
+    conn = sqlite3.connect(rs.ResultsStore.path(fl_name))
+    with conn:
+        conn.execute("CREATE TABLE results (position INTEGER PRIMARY KEY, row TEXT NOT NULL)")
+        # A row saved before the spectrum and iterations columns existed
+        conn.execute("INSERT INTO results VALUES (0, ?)", (json.dumps(row("Fe1", 5010.3, 7.4)[:-2]),))
+        conn.execute("INSERT INTO results VALUES (1, ?)", (json.dumps(row("Ti1", 5025.2, 4.8)),))
+    conn.close()
+
+    store = rs.ResultsStore(fl_name)
+    results = store.read()
+    store.close()
+    assert results["Element"].tolist() == ["Fe1", "Ti1"]
+    assert results["Fit Abundance"].tolist() == [7.4, 4.8]
+    assert results["Spectrum"].tolist() == [1, 1]
+    assert np.isnan(results["Passes"][0]) and results["Passes"][1] == 2
+
+
+def test_read_csv_old_and_partial_files(tmp_path):
+    fl_name = tmp_path.joinpath("found_values.csv")
+
+    # File written before the spectrum and iterations columns existed
+    pd.DataFrame([row("Fe1", 5010.3, 7.4)[:-2]], columns=rs.result_columns[:-2]).to_csv(fl_name, index=False)
+    prev = rs.read_csv(fl_name)
+    assert list(prev.columns) == rs.result_columns
+    assert prev["Spectrum"].tolist() == [1] and np.isnan(prev["Passes"][0])
+
+    # Rows without some values, like an edited file or a partially written row
+    with open(fl_name, "w") as file:
+        file.write(",".join(rs.result_columns) + "\n")
+        file.write(",".join(str(value) for value in row("Fe1", 5010.3, 7.4, spec=2)) + "\n")
+        file.write("Ti1,5025.2,0.01,1.0,0.1,4.9,4.8,0.1,,,,,\n")
+        file.write("Ni1,5030.1,0.01\n")
+    prev = rs.read_csv(fl_name)
+    assert prev["Spectrum"].tolist() == [2, 1, 1]
+    assert prev["Fit Abundance"].tolist()[:2] == [7.4, 4.8] and np.isnan(prev["Fit Abundance"][2])
+    assert rs.pending_lines(pd.DataFrame([["Fe1", 5010.3], ["Co1", 5040.0]]), prev,
+                            spectrum=2).values.tolist() == [["Co1", 5040.0]]
+
+
+def test_results_store_readers_do_not_write(tmp_path):
+    fl_name = tmp_path.joinpath("found_values.csv")
+    store = rs.ResultsStore(fl_name)
+    store.append(row("Fe1", 5010.3, 7.4))
+    store.export()
+
+    # A CSV file changed by someone else is read as it is, but only the writer imports it
+    pd.DataFrame([row("Ni1", 5030.1, 6.2)], columns=rs.result_columns).to_csv(fl_name, index=False)
+    assert rs.read_results(fl_name)["Element"].tolist() == ["Ni1"]
+    assert store.read()["Element"].tolist() == ["Fe1"]
+    assert store.outdated()
+    store.close()
+
+    store = rs.ResultsStore(fl_name)
+    assert store.read()["Element"].tolist() == ["Ni1"]
+    store.close()
+
+
+def test_results_store_reader_follows_a_running_writer(tmp_path):
+    fl_name = tmp_path.joinpath("found_values.csv")
+    store = rs.ResultsStore(fl_name)
+    store.append(row("Fe1", 5010.3, 7.4))
+    assert len(rs.read_results(fl_name)) == 1
+    store.append(row("Ti1", 5025.2, 4.8))
+    assert len(rs.read_results(fl_name)) == 2
+    store.close()
+
+    assert rs.read_results(tmp_path.joinpath("other.csv")) is None
+
+
+def curve(depth):
+    wave = np.linspace(5010, 5011, 5)
+    return pd.DataFrame({0: wave, 1: 1 - depth * np.exp(-(wave - 5010.5)**2 / 0.01)})
+
+
+def test_fit_curves_checkpoint_and_export(tmp_path):
+    plots = tmp_path.joinpath("On_time_Plots")
+    plots.mkdir()
+    # Curves of a previous run without the batch output
+    curve(0.1).to_csv(plots.joinpath("fit_Fe1_5010.3_ang_1.csv"), index=False)
+
+    curves = rs.FitCurves(tmp_path, checkpoint=2)
+    curves.add("Fe1", 5010.3, [curve(0.5)])
+    assert not rs.FitCurves.path(tmp_path).is_file()
+    curves.add("Ti1", 5025.2, [curve(0.3)])
+
+    # The checkpoint writes the curves but keeps the files of the previous run, the newest curves are read
+    assert rs.FitCurves.path(tmp_path).is_file()
+    assert plots.joinpath("fit_Fe1_5010.3_ang_1.csv").is_file()
+    found = rs.read_fit_curves(tmp_path, "Fe1", 5010.3)
+    assert len(found) == 1 and np.allclose(found[0][1], curve(0.5)[1], atol=1e-4)
+
+    # A later fit of the same line replaces the previous one, the export removes the outdated files
+    curves.add("Fe1", 5010.3, [curve(0.6)])
+    curves.export()
+    assert not plots.joinpath("fit_Fe1_5010.3_ang_1.csv").exists()
+    loaded = rs.FitCurves.load(tmp_path)
+    assert sorted(loaded) == [("Fe1", 5010.3), ("Ti1", 5025.2)]
+    found = rs.read_fit_curves(tmp_path, "Fe1", 5010.3, curves=loaded)
+    assert np.allclose(found[0][1], curve(0.6)[1], atol=1e-4)
+
+
+def test_fit_curves_export_keeps_the_last_fit(tmp_path):
+    for depth in [0.5, 0.6]:
+        curves = rs.FitCurves(tmp_path)
+        curves.add("Fe1", 5010.3, [curve(depth), curve(depth / 2)])
+        curves.add("Ti1", 5025.2, [curve(0.3)])
+        curves.export()
+
+    # A second run does not grow the file
+    data = pd.read_csv(rs.FitCurves.path(tmp_path))
+    assert len(data) == 3 * len(curve(0))
+    found = rs.read_fit_curves(tmp_path, "Fe1", 5010.3)
+    assert len(found) == 2 and np.allclose(found[0][1], curve(0.6)[1], atol=1e-4)
+
+
+def test_read_fit_curves_prefers_newer_line_files(tmp_path):
+    curves = rs.FitCurves(tmp_path)
+    curves.add("Fe1", 5010.3, [curve(0.5)])
+    curves.export()
+
+    # Curves saved later in their own files, like a fit without the batch output
+    curve(0.2).to_csv(tmp_path.joinpath("On_time_Plots", "fit_Fe1_5010.3_ang_1.csv"), index=False)
+    found = rs.read_fit_curves(tmp_path, "Fe1", 5010.3)
+    assert np.allclose(found[0].iloc[:, 1], curve(0.2)[1])
+    assert rs.read_fit_curves(tmp_path, "Ni1", 5030.1) == []
@@ -0,0 +1,99 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from meafs_code.scripts import synth_cache as sc
+from meafs_code.scripts import turbospec_functions as tf
+
+
+def spectrum(size=100):
+    wave = np.linspace(5000, 5010, size)
+    return pd.DataFrame({0: wave, 1: 1 - 0.5 * np.exp(-(wave - 5005)**2 / 0.01)})
+
+
+def test_spectrum_cache_round_trip(tmp_path):
+    cache = sc.SpectrumCache(folder=tmp_path)
+    spec = spectrum()
+
+    assert cache.get("missing") is None
+    cache.put("key", spec)
+    found = cache.get("key")
+
+    pd.testing.assert_frame_equal(found, spec)
+    assert (cache.hits, cache.misses) == (1, 1)
+    pd.testing.assert_frame_equal(sc.SpectrumCache(folder=tmp_path).get("key", mmap=True), spec)
+
+
+def test_spectrum_cache_key(ts_config, tmp_path):
+    cache = sc.SpectrumCache(folder=tmp_path.joinpath("cache"), precision=4)
+    template = tf.get_template(ts_config)
+    key = cache.key(template)
+
+    # Abundances are compared up to the precision of the key
+    template.set("Fe_ab", 7.50001)
+    assert cache.key(template) == key
+    template.set("Fe_ab", 7.51)
+    assert cache.key(template) != key
+    template.set("Fe_ab", 7.5)
+    assert cache.key(template) == key
+
+    # A change of a referenced file changes the key, unless it is excluded
+    linelist = tmp_path.joinpath("Turbospectrum2019", "linelists", "vald.list")
+    key_exclude = cache.key(template, exclude=[str(linelist)])
+    linelist.write_text("other lines\n")
+    assert cache.key(template) != key
+    assert cache.key(template, exclude=[str(linelist)]) == key_exclude
+
+
+def test_spectrum_cache_evicts_least_recently_used(tmp_path):
+    spec = spectrum()
+    cache = sc.SpectrumCache(folder=tmp_path)
+    cache.put("old", spec)
+    cache.put("new", spec)
+    size = os.path.getsize(tmp_path.joinpath("old.npy"))
+
+    os.utime(tmp_path.joinpath("old.npy"), ns=(1, 1))
+    cache.max_size = 2 * size
+    cache.put("newest", spec)
+
+    assert sorted(os.listdir(tmp_path)) == ["new.npy", "newest.npy"]
+    assert cache.size == 2 * size
+
+    cache.clear()
+    assert os.listdir(tmp_path) == [] and cache.size == 0
+
+
+def test_spectrum_cache_size_of_replaced_entries(tmp_path):
+    cache = sc.SpectrumCache(folder=tmp_path)
+    cache.put("key", spectrum(size=100))
+    cache.put("key", spectrum(size=50))
+
+    # The size of a replaced entry is not counted twice
+    assert cache.size == os.path.getsize(tmp_path.joinpath("key.npy"))
+    assert cache.size == sc.SpectrumCache(folder=tmp_path).size
+
+
+def test_opacity_and_linelist_caches(tmp_path):
+    opacity = tmp_path.joinpath("run", "opac")
+    opacity.parent.mkdir()
+    opacity.write_bytes(b"opacity")
+    cache = sc.OpacityCache(folder=tmp_path.joinpath("opacity"))
+    key = cache.key_state("model:5000-5010")
+
+    assert not cache.restore(key, [str(opacity)])
+    cache.store(key, [str(opacity)])
+    opacity.unlink()
+    assert cache.restore(key, [str(opacity)]) and opacity.read_bytes() == b"opacity"
+    assert (cache.hits, cache.misses) == (1, 1) and cache.size == len(b"opacity")
+
+    linelist = tmp_path.joinpath("linelist")
+    linelist.write_text("lines")
+    cache = sc.LinelistCache(folder=tmp_path.joinpath("linelists"))
+    key = cache.key_range(str(linelist), 5000., 5010.)
+
+    assert cache.key_range(str(linelist), 5000., 5020.) != key
+    assert cache.find(key) is None
+    fl_name = cache.store(key, "trimmed")
+    assert cache.find(key) == fl_name and open(fl_name).read() == "trimmed"
+    assert cache.size == len("trimmed")
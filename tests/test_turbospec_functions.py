@@ -0,0 +1,379 @@
+import subprocess
+import threading
+import asyncio
+import time
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from meafs_code.scripts import turbospec_functions as tf
+from meafs_code.scripts import fake_turbospec as ft
+from meafs_code.scripts import fit_functions as ff
+from meafs_code.scripts import benchmarks as bench
+
+
+@pytest.fixture
+def stand_in(tmp_path):
+    """TurboSpectrum stand-in with one Fe line and an observed spectrum with a higher abundance."""
+
+    type_synth = ft.create(tmp_path, lines=[["Fe", 5005.0, 0.4]], abundances={"Fe": 7.5}, lam_min=5000.,
+                           lam_max=5010., runtime=0.)
+    spec_obs = bench.fake_observed(type_synth, {"Fe": 7.62}, shift=0, convol=3., noise=0)
+    tf.get_template(type_synth[2]).set_range(5005., 1.)
+    return type_synth, ff.cut_spec(spec_obs, 5005., .5).reset_index(drop=True)
+
+
+def test_template_slots(ts_config):
+    template = tf.ConfigTemplate(ts_config)
+
+    assert template.get("lam_min") == 5000.
+    assert template.get("lam_max") == 5010.
+    assert template.get("lam_step") == 0.01
+    assert template.abundances() == {"Fe_ab": 7.5, "Ti_ab": 4.9}
+    assert template.text() == open(ts_config).read()
+
+
+def test_template_renders_only_changes(ts_config):
+    template = tf.get_template(ts_config)
+    template.set("Fe_ab", 7.5)
+    assert not template.dirty
+
+    template.set_range(5005., 1.)
+    template.set("Fe_ab", 7.62)
+    template.render()
+
+    text = open(ts_config).read()
+    assert "set lam_min    = '5004.0'" in text
+    assert "set lam_max    = '5006.0'" in text
+    assert "foreach Fe_ab (7.62)" in text
+    assert tf.change_abund_configfl(ts_config, "Fe") == 7.62
+    assert tf.change_abund_configfl(ts_config, "Ti") == 4.9
+
+
+def test_template_changes_every_step(ts_config):
+    tf.change_step_configfl(ts_config, factor=3)
+    tf.flush_configfl(ts_config)
+
+    text = open(ts_config).read()
+    assert text.count("'0.03'") == 2
+    assert tf.change_step_configfl(ts_config, factor=1) == 1
+
+
+
+def test_template_windows_follow_the_input_files(ts_config):
+    template = tf.get_template(ts_config)
+    wave = np.arange(5000., 5010.005, .01)
+    template.add_window(pd.DataFrame({0: wave, 1: np.ones(len(wave))}))
+    assert template.find_window() is not None
+
+    # A change of the line data is not in the slots of the script
+    linelist = os.path.join(os.path.dirname(ts_config), "..", "linelists", "vald.list")
+    with open(linelist, "a") as file:
+        file.write("more lines\n")
+    assert template.find_window() is None
+
+def test_template_keeps_first_foreach(ts_config):
+    with open(ts_config, "a") as file:
+        file.write("foreach Fe_ab (8.00)\nend\n")
+
+    template = tf.get_template(ts_config)
+    assert template.get("Fe_ab") == 7.5
+
+    template.set("Fe_ab", 7.3)
+    text = template.text()
+    assert "foreach Fe_ab (7.3)" in text
+    assert "foreach Fe_ab (8.00)" in text
+
+
+def test_template_abundance_loop_is_an_error(ts_config):
+    text = open(ts_config).read().replace("foreach Fe_ab (7.50)", "foreach Fe_ab (7.40 7.50 7.60)")
+    with open(ts_config, "w") as file:
+        file.write(text)
+
+    assert tf.check_elem_configfl(ts_config, "Fe")
+    with pytest.raises(ValueError, match="Fe_ab"):
+        tf.change_abund_configfl(ts_config, "Fe")
+    assert tf.change_abund_configfl(ts_config, "Ti") == 4.9
+
+
+def test_sandbox_resolves_paths_outside_the_script_folder(ts_config, tmp_path):
+    ts_root = tmp_path.joinpath("Turbospectrum2019")
+    sandbox = tf.Sandbox(ts_config, ts_root.joinpath("COM", "syntspec", "sun.conv"), root=tmp_path)
+    try:
+        text = open(sandbox.config_fl).read()
+        assert "../" not in text
+        assert "set mpath={}".format(ts_root.joinpath("models")) in text
+        assert "{} << EOF".format(ts_root.joinpath("exec", "babsma_lu")) in text
+        # The outputs stay inside the sandbox
+        assert "'./syntspec/sun.spec'" in text
+        assert sandbox.conv_name == str(tmp_path.joinpath(sandbox.folder, "syntspec", "sun.conv"))
+
+        files = tf.get_template(sandbox.config_fl).referenced_files()
+        assert files == sorted(str(ts_root.joinpath(*name)) for name in
+                               [("DATA", "Hlinedata"), ("linelists", "vald.list"), ("models", "sun.mod")])
+    finally:
+        sandbox.cleanup()
+    assert not tmp_path.joinpath(sandbox.folder).exists()
+
+
+def test_emulate_abund_matches_nelder_mead(stand_in):
+    type_synth, spec_obs_cut = stand_in
+    opt_pars = [0, 1, 3.]
+
+    stats = {}
+    par, spec_conv = tf.emulate_abund(spec_obs_cut, type_synth[2], type_synth[1], "Fe", opt_pars, [7.5], .3,
+                                      validate=.005, stats=stats)
+    # The grid, the refinement and the two syntheses of the validation
+    assert spec_conv is not None
+    assert stats["nsynth"] <= 8
+    assert stats["emulator_error"] < .005
+
+    nelder_stats = {}
+    nelder = tf.optimize_abund(spec_obs_cut, type_synth[2], type_synth[1], "Fe", opt_pars, [7.5], .3,
+                               stats=nelder_stats)[0]
+    assert par[0] == pytest.approx(nelder[0], abs=5e-3)
+    assert par[0] == pytest.approx(7.62, abs=.02)
+    assert nelder_stats["nsynth"] > stats["nsynth"]
+
+
+def test_emulate_abund_counts_only_the_syntheses_it_runs(stand_in):
+    type_synth, spec_obs_cut = stand_in
+
+    counts = []
+    for _ in range(2):
+        stats = {}
+        tf.emulate_abund(spec_obs_cut, type_synth[2], type_synth[1], "Fe", [0, 1, 3.], [7.5], .3, validate=.005,
+                         stats=stats)
+        counts.append(stats["nsynth"])
+
+    # The second fit finds all its spectra in the synthesis windows of the first one
+    assert counts[0] > 0 and counts[1] == 0
+
+
+def test_optimize_abund_brent_matches_nelder_mead(stand_in, monkeypatch):
+    type_synth, spec_obs_cut = stand_in
+    opt_pars = [0, 1, 3.]
+
+    synthesized = []
+    synthesize = tf.synthesize
+
+    def spy(config_fl, conv_name, **kwargs):
+        synthesized.append(tf.change_abund_configfl(config_fl, "Fe"))
+        return synthesize(config_fl, conv_name, **kwargs)
+    monkeypatch.setattr(tf, "synthesize", spy)
+
+    fits = {}
+    for method in ["brent", "nelder-mead"]:
+        synthesized.clear()
+        stats = {}
+        fits[method] = tf.optimize_abund(spec_obs_cut, type_synth[2], type_synth[1], "Fe", opt_pars, [7.5], .3,
+                                         method=method, stats=stats)[0][0]
+        # Each abundance is synthesized only once
+        assert len(synthesized) == len(set(synthesized))
+        assert stats["nsynth"] == len(synthesized)
+
+    assert fits["brent"] == pytest.approx(fits["nelder-mead"], abs=5e-3)
+    assert fits["brent"] == pytest.approx(7.62, abs=.02)
+
+
+def test_emulate_abund_validation_failure(stand_in):
+    type_synth, spec_obs_cut = stand_in
+
+    par, spec_conv = tf.emulate_abund(spec_obs_cut, type_synth[2], type_synth[1], "Fe", [0, 1, 3.], [7.5], .3,
+                                      validate=0.)
+    assert spec_conv is None
+    assert par[0] == pytest.approx(7.62, abs=.02)
+
+
+def test_plan_windows_groups_overlapping_lines():
+    assert tf.plan_windows([5010., 5000., 5000.8, 5020., 5001.5], .5) == [[1, 2, 4], [0], [3]]
+    assert tf.plan_windows([5000., 5001., 5002., 5003.], .5, max_width=2.5) == [[0, 1], [2, 3]]
+
+
+def test_shared_windows_slice_matches_line_synthesis(stand_in):
+    type_synth = stand_in[0]
+    lambs = [5004.5, 5005., 5005.6, 5009.]
+    windows = tf.SharedWindows(type_synth[2], type_synth[1], lambs, .5)
+
+    assert windows.spectrum(3) is None
+    shared = [windows.spectrum(i) for i in range(3)]
+    assert windows.syntheses == 1
+
+    for lamb, spec in zip(lambs, shared):
+        tf.change_spec_range_configfl(type_synth[2], lamb, .5)
+        tf.get_template(type_synth[2]).windows = []
+        direct = tf.synthesize(type_synth[2], type_synth[1])
+
+        assert spec[0].iloc[0] == pytest.approx(direct[0].iloc[0], abs=1e-6)
+        assert spec[0].iloc[-1] == pytest.approx(direct[0].iloc[-1], abs=1e-6)
+        assert np.allclose(spec[1], np.interp(spec[0], direct[0], direct[1]), atol=1e-5)
+
+    # A change of the abundances synthesizes the window again
+    tf.change_abund_configfl(type_synth[2], "Fe", abund=7.7, find=False)
+    windows.spectrum(0)
+    assert windows.syntheses == 2
+
+
+def test_shared_windows_margin_matches_line_synthesis(stand_in):
+    type_synth = stand_in[0]
+    windows = tf.SharedWindows(type_synth[2], type_synth[1], [5004.5, 5005.], .5)
+
+    # The margin widens both the synthesis of the group and the slice of the line
+    spec = windows.spectrum(1, margin=.2)
+    assert windows.syntheses == 1
+    tf.change_spec_range_configfl(type_synth[2], 5005., .7)
+    tf.get_template(type_synth[2]).windows = []
+    direct = tf.synthesize(type_synth[2], type_synth[1])
+    assert spec[0].iloc[0] == pytest.approx(direct[0].iloc[0], abs=1e-6)
+    assert spec[0].iloc[-1] == pytest.approx(direct[0].iloc[-1], abs=1e-6)
+
+    windows.spectrum(0, margin=.2)
+    assert windows.syntheses == 1
+    windows.spectrum(0, margin=.3)
+    assert windows.syntheses == 2
+
+
+def test_opacity_cache_skips_babsma_on_turbospectrum_script(ts_config, tmp_path, monkeypatch):
+    monkeypatch.setattr(tf, "opacity_cache", tf.sc.OpacityCache(folder=tmp_path.joinpath("cache")))
+    template = tf.get_template(ts_config)
+    opacity = tmp_path.joinpath("Turbospectrum2019", "COM", "contopac", "sun.modopac")
+    assert template.opacity_files() == [str(opacity)]
+
+    # Full run, as babsma would write the opacity
+    script, key = tf.stage_script(ts_config)
+    assert script == ts_config and key is not None
+    opacity.parent.mkdir()
+    opacity.write_text("opacity 5000-5010")
+    tf.store_opacity(ts_config, key)
+
+    # An abundance not read by babsma only runs bsyn, with the same input as the full script
+    tf.change_abund_configfl(ts_config, "Fe", abund=7.7, find=False)
+    script, key = tf.stage_script(ts_config)
+    assert key is None and script != ts_config
+    full, bsyn_only = template.text(), open(script).read()
+    assert bsyn_only.replace("cat > /dev/null", "../exec/babsma_lu", 1) == full
+
+    # A new range needs babsma again, and the previous opacity comes back from the cache
+    tf.change_spec_range_configfl(ts_config, 5020., 5.)
+    script, key = tf.stage_script(ts_config)
+    assert script == ts_config
+    opacity.write_text("opacity 5015-5025")
+    tf.store_opacity(ts_config, key)
+
+    tf.change_spec_range_configfl(ts_config, 5005., 5.)
+    script, key = tf.stage_script(ts_config)
+    assert key is None and script != ts_config
+    assert opacity.read_text() == "opacity 5000-5010"
+
+    # A change of the model atmosphere changes the opacity
+    tmp_path.joinpath("Turbospectrum2019", "models", "sun.mod").write_text("other model\n")
+    assert tf.stage_script(ts_config)[0] == ts_config
+
+
+def linelist_text(species, ion, name, waves):
+    text = "'{:>11}             ' {:>4} {:>8}\n'{}'\n".format(species, ion, len(waves), name)
+    return text + "".join("{:10.3f}  2.000 -1.500  5.0  1.0E+08 'x' 'x'  0.0  1.0\n".format(wave) for wave in waves)
+
+
+def test_trimmed_linelists_on_turbospectrum_script(ts_config, tmp_path, monkeypatch):
+    ts_root = tmp_path.joinpath("Turbospectrum2019")
+    ts_root.joinpath("DATA", "Hlinedata").write_text(linelist_text("1.000000", 1, "H I", [3000., 6562.8]))
+    ts_root.joinpath("linelists", "vald.list").write_text(
+        linelist_text("26.000000", 1, "Fe I", [4950., 4995., 5004.2, 5012., 5030.])
+        + linelist_text("22.000000", 1, "Ti I", [4900., 5100.]))
+    monkeypatch.setattr(tf, "linelist_cache", tf.sc.LinelistCache(folder=tmp_path.joinpath("cache")))
+    monkeypatch.setattr(tf, "linelist_margin", 10.)
+
+    template = tf.get_template(ts_config)
+    script, _ = tf.stage_script(ts_config)
+    assert script != ts_config
+
+    text = open(script).read()
+    trimmed = text.split("'NFILES   :' '2'\n")[1].splitlines()[:2]
+    # Hydrogen lines are always kept, so only the metal lines are trimmed
+    assert trimmed[0] == "../DATA/Hlinedata"
+    assert text.replace(trimmed[1], "../linelists/vald.list") == template.text()
+
+    # The range 5000-5010 is extended by the margin to 4990-5020
+    assert open(trimmed[1]).read() == linelist_text("26.000000", 1, "Fe I", [4995., 5004.2, 5012.])
+
+    # Without lines outside of the range, the script runs unchanged
+    tf.change_spec_range_configfl(ts_config, 5000., 300.)
+    assert tf.stage_script(ts_config)[0] == ts_config
+
+
+def test_read_spectrum_matches_read_csv(tmp_path, monkeypatch):
+    rows = ["  {:.3f}  {:.5f}  {:.4e}".format(5000 + i * .01, 1 - .5 * np.exp(-i**2 / 50), 1e15 * (1 + i))
+            for i in range(-20, 21)]
+    regular = tmp_path.joinpath("regular.conv")
+    regular.write_text("\n".join(rows) + "\n")
+    # A truncated last row is only accepted by the slower parser
+    irregular = tmp_path.joinpath("irregular.conv")
+    irregular.write_text("\n".join(rows) + "\n  5000.210\n")
+
+    def old_parser(fl_name):
+        return pd.read_csv(fl_name, header=None, delimiter=r"\s+").iloc[:, :2]
+
+    expected = {fl_name: old_parser(fl_name) for fl_name in [regular, irregular]}
+    calls = []
+    read_csv = pd.read_csv
+    monkeypatch.setattr(tf.pd, "read_csv", lambda *args, **kwargs: calls.append(args) or read_csv(*args, **kwargs))
+
+    pd.testing.assert_frame_equal(tf.read_spectrum(str(regular)), expected[regular])
+    assert calls == []
+    pd.testing.assert_frame_equal(tf.read_spectrum(str(irregular)), expected[irregular])
+    assert len(calls) == 1
+
+    binary = str(tmp_path.joinpath("regular.npy"))
+    np.save(binary, expected[regular].to_numpy().T)
+    for mmap in [False, True]:
+        pd.testing.assert_frame_equal(tf.read_spectrum(binary, mmap=mmap), expected[regular])
+
+
+def test_run_configfl_sync_and_async(stand_in):
+    type_synth = stand_in[0]
+    os.remove(type_synth[1])
+
+    tf.run_configfl(type_synth[2])
+    spec = tf.read_spectrum(type_synth[1])
+    assert spec[0].iloc[0] == pytest.approx(5004.) and spec[0].iloc[-1] == pytest.approx(5006.)
+
+    os.remove(type_synth[1])
+    asyncio.run(tf.run_configfl_async(type_synth[2]))
+    assert tf.read_spectrum(type_synth[1]).equals(spec)
+
+
+def test_run_configfl_async_kills_the_script_on_timeout(stand_in, monkeypatch):
+    type_synth = stand_in[0]
+    os.remove(type_synth[1])
+    monkeypatch.setenv("MEAFS_FAKE_RUNTIME", "0.5")
+
+    start = time.monotonic()
+    with pytest.raises(subprocess.TimeoutExpired):
+        asyncio.run(tf.run_configfl_async(type_synth[2], timeout=0.1))
+    assert time.monotonic() - start < 0.5
+
+    # The killed script never writes its spectrum
+    time.sleep(0.6)
+    assert not os.path.exists(type_synth[1])
+
+
+def test_synthesis_pool_cancel(stand_in, monkeypatch):
+    type_synth = stand_in[0]
+    monkeypatch.setenv("MEAFS_FAKE_RUNTIME", "0.5")
+    cancel_event = threading.Event()
+
+    with tf.SynthesisPool(type_synth[2], type_synth[1], limit=2, cancel_event=cancel_event) as pool:
+        threading.Timer(0.1, cancel_event.set).start()
+        start = time.monotonic()
+        with pytest.raises(tf.SynthesisCancelled):
+            pool.synthesize_all([{"Fe_ab": abund} for abund in [7.4, 7.5, 7.6]])
+        assert time.monotonic() - start < 0.5
+
+        # The scripts were killed before writing their spectra, and nothing else runs once cancelled
+        time.sleep(0.6)
+        assert not any(os.path.exists(sandbox.conv_name) for sandbox in pool.sandboxes)
+        with pytest.raises(tf.SynthesisCancelled):
+            pool.synthesize_all([{"Fe_ab": 7.4}])